@@ -0,0 +1,201 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import compact_tree  # noqa: E402
+import nwk_to_fig  # noqa: E402
+import phylo_updated  # noqa: E402
+from clade_classifier import get_classifier  # noqa: E402
+from generate_tree import MARKERS, bench_clade_details, generate  # noqa: E402
+from svg_render import render_svg  # noqa: E402
+
+SIZES = [1000, 10000, 100000, 1000000]
+# The ete3 stages take minutes and gigabytes beyond this
+ETE3_MAX_LEAVES = 100000
+REGRESSION = 1.25
+# Stages quicker than this are too noisy to flag as regressions
+MIN_SECONDS = 0.05
+# Results under this prefix are MB allocated, not seconds
+MEMORY = "memory."
+
+
+def timed(results: Dict[str, float], stage: str, function: Callable, *args, **kwargs):
+    start = time.perf_counter()
+    value = function(*args, **kwargs)
+    results[stage] = time.perf_counter() - start
+    return value
+
+
+def traced(results: Dict[str, float], stage: str, function: Callable, *args, **kwargs):
+    """
+    Records the peak memory allocated by [function], in MB, under "memory.[stage]". Tracing slows it down, so it is not timed
+    """
+    tracemalloc.start()
+    try:
+        value = function(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    results[MEMORY + stage] = peak / 1024 ** 2
+    return value
+
+
+def bench_size(file: str, style: str, quoted: bool, workdir: str, ete3: bool) -> Dict[str, float]:
+    """
+    Times every stage of the pipeline on the tree at [file].
+
+    Returns:
+
+        - Dict[str, float]: Seconds taken by each stage, and MB allocated by the "memory." ones
+    """
+    details = bench_clade_details()
+    alt_names = {clade: value[0] for clade, value in details.items() if len(value) == 1}
+    clade_details = {clade: value for clade, value in details.items() if len(value) > 1}
+    clades = list(clade_details)
+    marker = MARKERS[style].lstrip("_") if style == "rf" else MARKERS[style]
+    results = {}
+
+    classifier = get_classifier(clades, alt_names)
+    tree = timed(results, "compact.parse", compact_tree.parse_newick, file, quoted)
+    tree = timed(results, "compact.classify", compact_tree.classify, tree, classifier)
+    counts = timed(results, "compact.clade_count", compact_tree.node_clade_counts, tree, len(classifier.labels))
+    clade_counts = {label: int(count) for label, count in zip(classifier.labels, counts[0]) if count}
+    outgroup = phylo_updated.get_compact_max_ancestors(tree, counts, classifier.labels, {"S_": clade_details["S_"]}, clade_counts)["S_"]
+    tree = timed(results, "compact.root_on", compact_tree.set_outgroup, tree, outgroup)
+    counts = compact_tree.node_clade_counts(tree, len(classifier.labels))
+    max_ancestors = timed(
+        results, "compact.max_ancestors", phylo_updated.get_compact_max_ancestors, tree, counts, classifier.labels, clade_details, clade_counts
+    )
+    paint = timed(results, "svg.color_taxons", phylo_updated.compact_paint, tree, marker, -1)
+    for clade, node in max_ancestors.items():
+        paint.bgcolor[node] = clade_details[clade][phylo_updated.CLADE_COL]
+    timed(results, "svg.render", render_svg, tree, os.path.join(workdir, "tree.svg"), paint)
+    settings = os.path.join(workdir, "settings.txt")
+    open(settings, "w").close()
+    timed(results, "nwk_to_fig.convert_to_nexus", nwk_to_fig.convert_to_nexus, file, os.path.join(workdir, "tree"), settings, quoted)
+
+    if ete3:
+        ete_tree = timed(results, "ete3.get_tree", phylo_updated.get_tree, file, quoted)
+        traced(results, "ete3.color_taxons", phylo_updated.color_taxons, ete_tree, marker, -1)
+        timed(results, "ete3.color_taxons", phylo_updated.color_taxons, ete_tree, marker, -1)
+        clade_total = timed(results, "ete3.get_clade_count", phylo_updated.get_clade_count, ete_tree, clades, alt_names)
+        index = phylo_updated.CladeIndex(ete_tree, clades, alt_names)
+        ete_tree = timed(results, "ete3.root_on", phylo_updated.root_on, ete_tree, "S_", clade_details["S_"], clade_total["S_"], clades, alt_names, index)
+        timed(results, "ete3.get_node_details", phylo_updated.get_node_details, ete_tree, clades, alt_names)
+        node_cache = index.node_counts(ete_tree)
+        timed(results, "ete3.color_clades", phylo_updated.color_clades, ete_tree, clades, clade_details, clade_total, node_cache)
+    return results
+
+
+def timings(results: Dict[str, float]) -> Dict[str, float]:
+    return {stage: value for stage, value in results.items() if not stage.startswith(MEMORY)}
+
+
+def scaling(results: Dict[str, Dict[str, float]]) -> Dict[str, float]:
+    """
+    Fits time ~ leaves ** k for every stage timed on at least two sizes and returns k
+    """
+    exponents = {}
+    results = {leaves: timings(stages) for leaves, stages in results.items()}
+    stages = sorted({stage for seconds in results.values() for stage in seconds})
+    for stage in stages:
+        points = [(int(leaves), seconds[stage]) for leaves, seconds in results.items() if seconds.get(stage, 0) > 0]
+        if len(points) >= 2:
+            x, y = np.log([point[0] for point in points]), np.log([point[1] for point in points])
+            exponents[stage] = float(np.polyfit(x, y, 1)[0])
+    return exponents
+
+
+def compare(current: Dict[str, Dict[str, float]], previous_path: str, threshold: float = REGRESSION) -> List[str]:
+    """
+    Returns a line for each stage and size that got more than [threshold] times slower than in the results at [previous_path]
+    """
+    with open(previous_path) as f:
+        previous = json.load(f)["results"]
+    regressions = []
+    for leaves, stages in current.items():
+        for stage, seconds in timings(stages).items():
+            before = previous.get(leaves, {}).get(stage)
+            if before and max(before, seconds) >= MIN_SECONDS and seconds > before * threshold:
+                regressions.append(f"{stage} at {leaves} leaves: {before:.3f}s -> {seconds:.3f}s ({seconds / before:.2f}x)")
+    return regressions
+
+
+def _print_rows(title: str, results: Dict[str, Dict[str, float]], stages: List[str], exponents: Dict[str, float] = None):
+    sizes = list(results)
+    print(f"{title:<30}" + "".join(f"{size:>12}" for size in sizes) + (f"{'exponent':>10}" if exponents is not None else ""))
+    for stage in stages:
+        cells = "".join(f"{results[size][stage]:>12.3f}" if stage in results[size] else f"{'-':>12}" for size in sizes)
+        exponent = "" if exponents is None else f"{exponents[stage]:>10.2f}" if stage in exponents else f"{'-':>10}"
+        print(f"{stage[len(MEMORY):] if stage.startswith(MEMORY) else stage:<30}{cells}{exponent}")
+
+
+def print_table(results: Dict[str, Dict[str, float]], exponents: Dict[str, float]):
+    """
+    Prints the seconds taken by each stage with its scaling exponent, then the MB allocated by the traced stages
+    """
+    stages = sorted({stage for values in results.values() for stage in values})
+    _print_rows("seconds", results, [stage for stage in stages if not stage.startswith(MEMORY)], exponents)
+    memory = [stage for stage in stages if stage.startswith(MEMORY)]
+    if memory:
+        print()
+        _print_rows("MB allocated", results, memory)
+
+
+def _parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description="Times the tree pipeline on synthetic trees of growing size and reports how each stage scales")
+    parser.add_argument("--sizes", dest="sizes", type=int, nargs="+", default=SIZES, help=f"Leaf counts to benchmark. Default {SIZES}")
+    parser.add_argument(
+        "--ete3-max-leaves",
+        dest="ete3_max_leaves",
+        type=int,
+        default=ETE3_MAX_LEAVES,
+        help=f"Largest tree the ete3 stages are timed on. Default {ETE3_MAX_LEAVES}",
+    )
+    parser.add_argument("--style", dest="style", choices=sorted(MARKERS), default="rf", help="Color marker in leaf names. Default rf")
+    parser.add_argument("-q", "--quoted", dest="quoted", action="store_true", help="Use quoted leaf names")
+    parser.add_argument("--repeat", dest="repeat", type=int, default=1, help="Runs each size this many times and keeps the best time of each stage. Default 1")
+    parser.add_argument("--seed", dest="seed", type=int, default=0, help="Seed of the tree generator. Default 0")
+    parser.add_argument("--trees", dest="trees", type=str, help="Directory keeping the generated trees between runs. A temporary one by default")
+    parser.add_argument("-o", "--out", dest="out", type=str, help="Writes the results as json to this path")
+    parser.add_argument("--compare", dest="compare", type=str, help="Results of an earlier run to check for regressions")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        trees = args.trees or tmp
+        os.makedirs(trees, exist_ok=True)
+        for leaves in args.sizes:
+            file = os.path.join(trees, f"tree_{leaves}_{args.seed}_{args.style}{'_q' if args.quoted else ''}.nwk")
+            if not os.path.exists(file):
+                generate(file, leaves, args.seed, args.style, args.quoted)
+            print(f"{leaves} leaves", flush=True)
+            runs = [bench_size(file, args.style, args.quoted, tmp, ete3=leaves <= args.ete3_max_leaves) for _ in range(args.repeat)]
+            results[str(leaves)] = {stage: min(run[stage] for run in runs) for stage in runs[0]}
+
+    exponents = scaling(results)
+    print_table(results, exponents)
+    if args.out:
+        meta = {"date": datetime.datetime.now().isoformat(), "python": platform.python_version(), "machine": platform.platform()}
+        with open(args.out, "w") as f:
+            json.dump({"meta": meta, "results": results, "exponents": exponents}, f, indent=2)
+    if args.compare:
+        regressions = compare(results, args.compare)
+        print("\n".join(["Regressions:"] + regressions) if regressions else "No regressions")
+        if regressions:
+            sys.exit(1)
@@ -0,0 +1,74 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Start up time allowed for each command, in seconds, before it is reported as over budget
+BUDGET = 0.3
+COMMANDS = {
+    "phylo_updated -h": ["phylo_updated.py", "-h"],
+    "graph_plot -h": ["graph_plot.py", "-h"],
+    "graph_animation -h": ["graph_animation.py", "-h"],
+    "gisaid_ingest -h": ["gisaid_ingest.py", "-h"],
+    "clade_store -h": ["clade_store.py", "-h"],
+    "extractor -h": ["extractor.py", "-h"],
+    "threshold_sweep -h": ["threshold_sweep.py", "-h"],
+    "tree_server -h": ["tree_server.py", "-h"],
+    "phylo_batch -h": ["phylo_batch.py", "-h"],
+    "nwk_to_fig -h": ["nwk_to_fig.py", "-h"],
+}
+# Modules these commands must not load, they only import them once they draw something
+HEAVY_MODULES = ["ete3", "PyQt5", "matplotlib", "pandas", "seaborn"]
+
+
+def time_command(args: List[str], repeat: int) -> float:
+    """
+    Returns the best wall time of running the script [args] with the current interpreter [repeat] times
+    """
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run([sys.executable] + args, cwd=ROOT, stdout=subprocess.DEVNULL, check=True)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def heavy_imports(module: str) -> List[str]:
+    """
+    Returns the modules of `HEAVY_MODULES` loaded by importing [module]
+    """
+    code = f"import sys, {module}; print(' '.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, stdout=subprocess.PIPE, check=True).stdout
+    return output.decode().split()
+
+
+def bench_startup(repeat: int) -> Dict[str, float]:
+    baseline = time_command(["-c", "pass"], repeat)
+    return {name: time_command(args, repeat) - baseline for name, args in COMMANDS.items()}
+
+
+def _parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description="Times how long each script takes to start, beyond the interpreter itself")
+    parser.add_argument("--repeat", dest="repeat", type=int, default=5, help="Runs each command this many times and keeps the best. Default 5")
+    parser.add_argument("--budget", dest="budget", type=float, default=BUDGET, help=f"Seconds allowed per command. Default {BUDGET}")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    timings = bench_startup(args.repeat)
+    over = []
+    for name, seconds in timings.items():
+        module = COMMANDS[name][0][: -len(".py")]
+        heavy = heavy_imports(module)
+        print(f"{name:<25}{seconds:>8.3f}s  {'imports ' + ', '.join(heavy) if heavy else ''}")
+        if seconds > args.budget or heavy:
+            over.append(name)
+    if over:
+        print(f"Over the {args.budget}s budget or importing heavy modules: {', '.join(over)}")
+        sys.exit(1)
+    print(f"All within the {args.budget}s budget")
@@ -0,0 +1,120 @@
+import argparse
+import random
+from typing import TextIO
+
+# Clade prefixes and colors as found in clade_del.json
+CLADES = {
+    "S_": "#b3ffb3",
+    "L_": "#d4d4d4",
+    "V_": "#ffddff",
+    "G_": "#fdb3b3",
+    "GH_": "#feab8d",
+    "GR_": "#fe8d8d",
+    "GV_": "#f08bb5",
+}
+# Leaf names of rapidnj and fasttree trees carry their color after "color=", those of iqtree after "____color__"
+MARKERS = {"rf": "_color=", "iq": "____color__"}
+# Names of other sequences, which match no clade
+OTHER = "O_"
+WRITE_BATCH = 1 << 16
+# Leaves of the subtree every clade is given, enough for one of its nodes to hold part of the clade only
+CLADE_LEAVES = 3
+
+
+def bench_clade_details() -> dict:
+    """
+    Returns the contents of a clade json for the generated trees.
+
+    The bounds accept any node holding less than the whole clade, so every run finds one without picking the root, which cannot be rooted on.
+    """
+    details = {f"{clade[:-1]}n_": [clade] for clade in ("G_", "GH_", "GR_")}
+    details.update({clade: [color, 0, 1, 0, 0.99] for clade, color in CLADES.items()})
+    return details
+
+
+def leaf_name(i: int, clade: str, style: str, quoted: bool) -> str:
+    name = f"{clade}hCoV-19/Synthetic/{i}/2020|EPI_ISL_{400000 + i}|2020-03-01"
+    if clade in CLADES:
+        name += f"{MARKERS[style]}{CLADES[clade][1:]}|"
+    return f"'{name}'" if quoted else name
+
+
+def write_tree(f: TextIO, leaves: int, seed: int = 0, style: str = "rf", quoted: bool = False, switch: float = 0.02):
+    """
+    Writes a random binary tree with [leaves] leaves to [f] in newick format.
+
+    Subtrees are split at random, so the depth grows with the log of [leaves]. Each subtree keeps the clade of its parent
+    except with probability [switch], where it moves to a random clade, so clades mostly form whole subtrees.
+    Unless the tree is too small, every clade of `CLADES` also gets a subtree of `CLADE_LEAVES` leaves of its own, chained
+    beside the random part, so that it is present and has a node to color whatever the seed.
+
+    Args:
+
+        - f (TextIO): Where the tree is written
+        - leaves (int): The number of leaves
+        - seed (int): Seed of the random generator, the same seed gives the same tree
+        - style (str): "rf" for rapidnj and fasttree color markers, "iq" for iqtree ones
+        - quoted (bool): Whether names are surrounded by single quotes
+        - switch (float): Probability of a subtree having another clade than its parent
+    """
+    rng = random.Random(seed)
+    clades = list(CLADES) + [OTHER]
+    buffer = []
+    count = 0
+    # Items are either text to write or (leaves, clade, fixed) subtrees still to be written, fixed ones never switch clade
+    stack = [";"]
+    if leaves > CLADE_LEAVES * len(CLADES):
+        # (random part, (S_ subtree, (L_ subtree, ...))), written left to right
+        parts = [(leaves - CLADE_LEAVES * len(CLADES), "S_", False)] + [(CLADE_LEAVES, clade, True) for clade in CLADES]
+        closing = [")"] + [f"){rng.randint(0, 100)}:{rng.random() / 100:.6f}" for _ in parts[2:]]
+        items = []
+        for part in parts[:-1]:
+            items.extend(["(", part, ","])
+        items.append(parts[-1])
+        items.extend(reversed(closing))
+        stack.extend(reversed(items))
+    else:
+        stack.append((leaves, "S_", False))
+    while stack:
+        item = stack.pop()
+        if isinstance(item, str):
+            buffer.append(item)
+        else:
+            size, clade, fixed = item
+            if not fixed and rng.random() < switch:
+                clade = rng.choice(clades)
+            if size == 1:
+                buffer.append(f"{leaf_name(count, clade, style, quoted)}:{rng.random() / 100:.6f}")
+                count += 1
+            else:
+                split = rng.randint(1, size - 1)
+                buffer.append("(")
+                stack.append(f"){rng.randint(0, 100)}:{rng.random() / 100:.6f}" if stack[-1] != ";" else ")")
+                stack.extend([(size - split, clade, fixed), ",", (split, clade, fixed)])
+        if len(buffer) >= WRITE_BATCH:
+            f.write("".join(buffer))
+            buffer = []
+    f.write("".join(buffer))
+
+
+def generate(path: str, leaves: int, seed: int = 0, style: str = "rf", quoted: bool = False):
+    with open(path, "w") as f:
+        write_tree(f, leaves, seed, style, quoted)
+
+
+def _parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(description="Generates a random NEWICK tree with GISAID-like names for benchmarks")
+    parser.add_argument("out", type=str, help="Path of the NEWICK file to write")
+    parser.add_argument("-n", "--leaves", dest="leaves", type=int, default=1000, help="Number of leaves. Default 1000")
+    parser.add_argument("-s", "--seed", dest="seed", type=int, default=0, help="Seed of the random generator. Default 0")
+    parser.add_argument(
+        "--style", dest="style", choices=sorted(MARKERS), default="rf", help="Color marker in leaf names, rf (color=) or iq (____color__). Default rf"
+    )
+    parser.add_argument("-q", "--quoted", dest="quoted", action="store_true", help="Surrounds names with single quotes")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    generate(args.out, args.leaves, args.seed, args.style, args.quoted)
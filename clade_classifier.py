@@ -0,0 +1,90 @@
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+OTHER = "other"
+# Classifiers kept by `get_classifier`, the least recently used one is dropped beyond that
+MAX_CLASSIFIERS = 8
+
+
+class CladeClassifier:
+    """
+    Maps sequence names to compact integer clade ids using the clade delineators they start with.
+
+    When several delineators match a name, the longest one wins, so "GH_" is preferred over "G_" regardless of the
+    order of the entries in clade_del.json. Delineators are bucketed by length, and a name is looked up with one
+    dictionary probe per distinct delineator length, which keeps classification fast for thousands of delineators.
+
+    Nothing is remembered between names: leaf names are unique within a tree, so a tree is classified once with
+    `compact_tree.classify` and its clade ids are reused from there.
+
+    Args:
+
+        - clades (List[str]): List containing the clade names
+            Clade names should occur at the start of the sequence name.
+        - altername_names (Dict[str, str]): Maps alternate name found in sequence to desired name.
+    """
+
+    def __init__(self, clades: List[str], alternate_names: Dict[str, str]):
+        clade_dict = {clade: clade for clade in clades}
+        clade_dict.update(alternate_names)
+        self.labels = list(OrderedDict.fromkeys(list(clade_dict.values()) + [OTHER]))
+        self.other = len(self.labels) - 1
+
+        columns = {label: col for col, label in enumerate(self.labels)}
+        self._prefixes = {prefix: columns[label] for prefix, label in clade_dict.items()}
+        self._lengths = sorted({len(prefix) for prefix in self._prefixes}, reverse=True)
+        # Identifies the classification rules, so that stored clade ids can be checked before reuse
+        self.key = hashlib.blake2b(
+            json.dumps([self.labels, sorted(self._prefixes.items())]).encode(), digest_size=16
+        ).hexdigest()
+
+    def classify(self, name: str) -> int:
+        """
+        Returns the clade id of [name], `other` if it does not start with any delineator
+        """
+        prefixes = self._prefixes
+        for length in self._lengths:
+            match = prefixes.get(name[:length])
+            if match is not None:
+                return match
+        return self.other
+
+    def classify_all(self, names: Iterable[str]) -> np.ndarray:
+        """
+        Returns the clade id of every name in [names]
+        """
+        classify = self.classify
+        return np.fromiter((classify(name) for name in names), dtype=np.int32)
+
+    def label(self, clade_id: int) -> str:
+        """
+        Returns the clade name of [clade_id]
+        """
+        return self.labels[clade_id]
+
+
+_classifiers = OrderedDict()  # type: Dict[tuple, CladeClassifier]
+
+
+def get_classifier(clades: List[str], alternate_names: Dict[str, str]) -> CladeClassifier:
+    """
+    Returns the CladeClassifier of [clades] and [alternate_names], compiling it on first use.
+    Only the `MAX_CLASSIFIERS` most recently used classifiers are kept.
+
+    Args:
+
+        - clades (List[str]): List containing the clade names
+        - altername_names (Dict[str, str]): Maps alternate name found in sequence to desired name.
+    """
+    key = (tuple(clades), tuple(alternate_names.items()))
+    if key in _classifiers:
+        _classifiers.move_to_end(key)
+    else:
+        _classifiers[key] = CladeClassifier(clades, alternate_names)
+        while len(_classifiers) > MAX_CLASSIFIERS:
+            _classifiers.popitem(last=False)
+    return _classifiers[key]
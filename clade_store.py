@@ -0,0 +1,213 @@
+import argparse
+import json
+import os
+import re
+import tempfile
+import time
+from datetime import datetime
+from typing import List, Optional
+
+import numpy as np
+
+import clade_tables
+from clade_tables import CladeTable
+
+# Bump whenever the layout of the store changes
+STORE_VERSION = 1
+DTYPE = np.dtype("<i8")
+META_FILE = "meta.json"
+# Region of the tables of a clade progression file, whose counts are already the total over every region
+TOTAL_REGION = ""
+# Formats of the period names written by gisaid_ingest.py, "Jan20" for months and "2020-01-06" for weeks
+PERIOD_FORMATS = ("%b%y", "%Y-%m-%d")
+
+
+def _empty_meta() -> dict:
+    return {"version": STORE_VERSION, "regions": [], "clades": [], "periods": [], "counts": ""}
+
+
+def read_meta(store: str) -> Optional[dict]:
+    """
+    Returns the description of the store at [store]: its regions, clades and periods, and the file holding the counts.
+    None if there is no store there yet.
+    """
+    path = os.path.join(store, META_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        meta = json.load(f)
+    if meta.get("version") != STORE_VERSION:
+        raise Exception(f"{store} was written by version {meta.get('version')} of the store, expected {STORE_VERSION}")
+    return meta
+
+
+def _write_meta(store: str, meta: dict):
+    handle, temp = tempfile.mkstemp(dir=store, suffix=".tmp")
+    try:
+        with os.fdopen(handle, "w") as f:
+            json.dump(meta, f)
+        os.replace(temp, os.path.join(store, META_FILE))
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
+def period_key(name: str) -> tuple:
+    """
+    Sort key putting periods in chronological order. Names in one of `PERIOD_FORMATS` sort by their date, before any
+    other name, which sort by the numbers in them, e.g. "week2" before "week10" for geoclade files named by week.
+    """
+    for period_format in PERIOD_FORMATS:
+        try:
+            return (0, datetime.strptime(name, period_format))
+        except ValueError:
+            pass
+    return (1, [int(part) if i % 2 else part for i, part in enumerate(re.split(r"(\d+)", name))])
+
+
+def _slab_bytes(meta: dict) -> int:
+    return len(meta["regions"]) * len(meta["clades"]) * DTYPE.itemsize
+
+
+def load_store(store: str, last: int = 0) -> CladeTable:
+    """
+    Maps the counts of the store at [store] into memory without reading them.
+
+    The counts are kept period after period on disk, so the last periods are a single slice at the end of the file
+    and loading them takes the same time however long the history before them is.
+
+    Args:
+
+        - store (str): The directory of the store
+        - last (int): Number of latest periods to load, 0 for all of them
+
+    Returns:
+
+        - CladeTable: The counts, as a read only view of the file
+    """
+    meta = read_meta(store)
+    if meta is None:
+        raise Exception(f"No clade store found at {store}")
+    regions, clades, periods = meta["regions"], meta["clades"], meta["periods"]
+    start = max(len(periods) - last, 0) if last else 0
+    shape = (len(periods) - start, len(regions), len(clades))
+    if not all(shape):
+        counts = np.zeros(shape, dtype=DTYPE)
+    else:
+        counts = np.memmap(os.path.join(store, meta["counts"]), dtype=DTYPE, mode="r", offset=start * _slab_bytes(meta), shape=shape)
+    return CladeTable(regions, clades, periods[start:], counts.transpose(1, 2, 0))
+
+
+def _relayout(store: str, meta: dict, regions: List[str], clades: List[str], periods: List[str]) -> dict:
+    """
+    Copies the counts of [meta] into a new file laid out for [regions], [clades] and [periods], which hold the current
+    ones. Periods not in the store yet count 0 until written.
+    """
+    handle, path = tempfile.mkstemp(dir=store, prefix=f"counts-{len(regions)}x{len(clades)}-", suffix=".bin")
+    os.close(handle)
+    name = os.path.basename(path)
+    shape = (len(periods), len(regions), len(clades))
+    if all(shape):
+        counts = np.memmap(path, dtype=DTYPE, mode="w+", shape=shape)
+        if meta["periods"]:
+            positions = [periods.index(period) for period in meta["periods"]]
+            counts[positions, : len(meta["regions"]), : len(meta["clades"])] = load_store(store).counts.transpose(2, 0, 1)
+        counts.flush()
+        del counts
+    relaid = dict(meta, regions=regions, clades=clades, periods=periods, counts=name)
+    _write_meta(store, relaid)
+    if meta["counts"]:
+        os.remove(os.path.join(store, meta["counts"]))
+    return relaid
+
+
+def append_store(store: str, table: CladeTable) -> dict:
+    """
+    Adds the periods of [table] to the store at [store], creating it if needed.
+
+    Periods are kept in chronological order, see `period_key`. New periods later than the ones in the store are
+    appended at the end of the counts file, leaving the ones before untouched. A period already in the store is
+    replaced, e.g. the last month when a new drop adds sequences to it. Regions are matched on
+    `clade_tables.region_name`. Only new regions or clades, or a period older than the latest one, make the store copy
+    its counts into a new file.
+
+    A store holds either the totals of clade progression tables, under the single region `TOTAL_REGION`, or counts by
+    region, never both, as the totals would count every sequence a second time.
+
+    Args:
+
+        - store (str): The directory of the store
+        - table (CladeTable): The counts to add
+
+    Returns:
+
+        - dict: The description of the store afterwards, see `read_meta`
+    """
+    os.makedirs(store, exist_ok=True)
+    meta = read_meta(store) or _empty_meta()
+    table_regions = [clade_tables.region_name(region) for region in table.regions]
+    regions = meta["regions"] + [r for r in dict.fromkeys(table_regions) if r not in meta["regions"]]
+    if TOTAL_REGION in regions and len(regions) > 1:
+        raise Exception(f"{store} cannot hold both clade progression totals and counts by region")
+    clades = meta["clades"] + [c for c in dict.fromkeys(table.clades) if c not in meta["clades"]]
+    periods = sorted(dict.fromkeys(meta["periods"] + list(table.periods)), key=period_key)
+    if regions != meta["regions"] or clades != meta["clades"] or not meta["counts"] or periods[: len(meta["periods"])] != meta["periods"]:
+        meta = _relayout(store, meta, regions, clades, periods)
+
+    rows = [regions.index(region) for region in table_regions]
+    columns = [clades.index(clade) for clade in table.clades]
+    slabs = np.zeros((len(table.periods), len(regions), len(clades)), dtype=DTYPE)
+    for period in range(len(table.periods)):
+        np.add.at(slabs[period], np.ix_(rows, columns), table.counts[:, :, period])
+
+    index = {name: i for i, name in enumerate(periods)}
+    with open(os.path.join(store, meta["counts"]), "r+b") as f:
+        # Drops whatever an interrupted append wrote past the periods in the description
+        f.truncate(len(meta["periods"]) * _slab_bytes(meta))
+        for name, slab in zip(table.periods, slabs):
+            f.seek(index[name] * _slab_bytes(meta))
+            f.write(slab.tobytes())
+    meta = dict(meta, periods=periods)
+    _write_meta(store, meta)
+    return meta
+
+
+def _parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Adds clade progression or geoclade tables to a binary store of counts by region, clade and period that graph_plot.py can draw from",
+        epilog="If you notice any issues, please open one over at https://github.com/ElasticBottle/GISAID-Analysis-Update ",
+    )
+    parser.add_argument("store", type=str, help="Directory of the store, created if needed")
+    parser.add_argument("-p", "--progression", dest="progression", type=str, help="A clade progression tsv to add, one period per row")
+    parser.add_argument(
+        "-g",
+        "--geoclade",
+        dest="geoclade",
+        nargs="+",
+        default=[],
+        help="Geoclade tsv files to add, one period each, named after the file",
+    )
+    args = parser.parse_args()
+    if args.progression and args.geoclade:
+        parser.error("a store holds either clade progression totals or geoclade counts by region, not both")
+    return args
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    start = time.perf_counter()
+    tables = []
+    if args.progression:
+        with open(args.progression) as f:
+            tables.append(clade_tables.read_progression(f))
+    for file in args.geoclade:
+        with open(file) as f:
+            tables.append(clade_tables.read_geoclade(f, period=os.path.splitext(os.path.basename(file))[0]))
+    meta = read_meta(args.store) or _empty_meta()
+    for table in tables:
+        meta = append_store(args.store, table)
+    print(
+        f"{args.store}: {len(meta['regions'])} regions, {len(meta['clades'])} clades, {len(meta['periods'])} periods "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
@@ -0,0 +1,201 @@
+import re
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Dict, Iterator, List, NamedTuple, TextIO, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+class CladeTable(NamedTuple):
+    """
+    Sequence counts by region, clade and period
+
+    Attributes:
+
+        - regions (List[str]): The regions, as titled in the file
+        - clades (List[str]): The clades, in the order they first appear in the file
+        - periods (List[str]): The periods, in file order
+        - counts (np.ndarray): regions x clades x periods array of counts. Clades missing from a block count 0
+    """
+    regions: List[str]
+    clades: List[str]
+    periods: List[str]
+    counts: np.ndarray
+
+
+def _index(names: Dict[str, int], name: str) -> int:
+    index = names.get(name)
+    if index is None:
+        index = names[name] = len(names)
+    return index
+
+
+def _build(regions: Dict[str, int], clades: Dict[str, int], periods: Dict[str, int], cells: List[Tuple[int, int, int, int]]) -> CladeTable:
+    counts = np.zeros((len(regions), len(clades), len(periods)), dtype=np.int64)
+    if cells:
+        region, clade, period, count = np.array(cells, dtype=np.int64).T
+        np.add.at(counts, (region, clade, period), count)
+    return CladeTable(list(regions), list(clades), list(periods), counts)
+
+
+def _lines(f: TextIO) -> Iterator[Tuple[int, str]]:
+    for number, line in enumerate(f, start=1):
+        line = line.rstrip("\r\n")
+        if line.strip():
+            yield number, line
+
+
+def read_geoclade(f: TextIO, period: str = "") -> CladeTable:
+    """
+    Reads a geoclade file in one pass: blocks of "clade<TAB>count" lines, each under a line naming its region.
+    Any number of regions and clades is allowed, and blank lines are ignored.
+
+        Europe (+104)
+        G	47
+        GH	8
+
+        Asia (+40)
+        G	8
+        GH	0
+
+    Args:
+
+        - f (TextIO): The file to read
+        - period (str): The name of the only period of the table
+
+    Returns:
+
+        - CladeTable: The counts of every block, with a single period
+    """
+    regions, clades = OrderedDict(), OrderedDict()  # type: Dict[str, int], Dict[str, int]
+    cells = []
+    region = None
+    for number, line in _lines(f):
+        if "\t" not in line:
+            region = _index(regions, line.strip())
+            continue
+        if region is None:
+            raise Exception(f"Line {number} holds counts before any region: {line!r}")
+        clade, count = line.split("\t")[:2]
+        cells.append((region, _index(clades, clade.strip()), 0, int(count)))
+    return _build(regions, clades, OrderedDict([(period, 0)]), cells)
+
+
+def read_progression(f: TextIO, region: str = "") -> CladeTable:
+    """
+    Reads the first table of a clade progression file: an optional title line such as "Per month:", a header row of
+    clades, then one row of counts per period. Reading stops at the next title, e.g. "Cumulative:", whose table is the
+    running sum of the first one.
+
+        Per month:
+        Month	G	GH	GR
+        Dec19	0	0	0
+        Jan20	14	1	0
+
+    Args:
+
+        - f (TextIO): The file to read
+        - region (str): The name of the only region of the table
+
+    Returns:
+
+        - CladeTable: The counts of every period, with a single region
+    """
+    clades, periods = OrderedDict(), OrderedDict()  # type: Dict[str, int], Dict[str, int]
+    columns = None
+    cells = []
+    for number, line in _lines(f):
+        if "\t" not in line:
+            if columns is not None:
+                break
+            continue
+        fields = line.split("\t")
+        if columns is None:
+            columns = [_index(clades, clade.strip()) for clade in fields[1:]]
+            continue
+        period = _index(periods, fields[0].strip())
+        for clade, count in zip(columns, fields[1:]):
+            if count.strip():
+                cells.append((0, clade, period, int(float(count))))
+    if columns is None:
+        raise Exception("No header row of clades found")
+    return _build(OrderedDict([(region, 0)]), clades, periods, cells)
+
+
+def with_totals(table: CladeTable) -> CladeTable:
+    """
+    Returns [table] with each region titled with its total over the first period as in geoclade files, e.g. "Europe (+104)"
+    """
+    totals = table.counts[:, :, 0].sum(axis=1).tolist()
+    return table._replace(regions=[f"{region_name(region)} (+{total})" for region, total in zip(table.regions, totals)])
+
+
+def write_geoclade(f: TextIO, table: CladeTable):
+    """
+    Writes the first period of [table] in the format `read_geoclade` reads, with the regions titled by `with_totals`
+    """
+    table = with_totals(table)
+    for region, counts in zip(table.regions, table.counts[:, :, 0].tolist()):
+        f.write(f"{region}\n")
+        f.writelines(f"{clade}\t{count}\n" for clade, count in zip(table.clades, counts))
+        f.write("\n")
+
+
+def write_progression(f: TextIO, table: CladeTable, period_column: str = "Month", title: str = "Per month"):
+    """
+    Writes the first region of [table] in the format `read_progression` reads: the counts of each period under [title],
+    then their running sum under "Cumulative:"
+    """
+    counts = table.counts[0].T
+    for section, rows in ((title, counts), ("Cumulative", np.cumsum(counts, axis=0))):
+        f.write(f"{section}:\n")
+        f.write("\t".join([period_column] + table.clades) + "\n")
+        for period, row in zip(table.periods, rows.tolist()):
+            f.write("\t".join([period] + [str(count) for count in row]) + "\n")
+
+
+def region_name(title: str) -> str:
+    """
+    Returns the region of a block title without the note in brackets after it, e.g. "Europe" for "Europe (+104)"
+    """
+    return re.sub(r"\s*\([^)]*\)\s*$", "", title)
+
+
+def concat_periods(tables: List[CladeTable], periods: List[str]) -> CladeTable:
+    """
+    Joins single period tables, e.g. the geoclade files of consecutive weeks, into one table with a period per table.
+    Regions are matched on `region_name`, so their notes may change from one table to the next.
+
+    Args:
+
+        - tables (List[CladeTable]): The tables, each with a single period
+        - periods (List[str]): The name of the period of each table
+
+    Returns:
+
+        - CladeTable: The counts of every region and clade of [tables] in each of [periods]
+    """
+    regions, clades = OrderedDict(), OrderedDict()  # type: Dict[str, int], Dict[str, int]
+    for table in tables:
+        for region in table.regions:
+            _index(regions, region_name(region))
+        for clade in table.clades:
+            _index(clades, clade)
+    counts = np.zeros((len(regions), len(clades), len(tables)), dtype=np.int64)
+    for period, table in enumerate(tables):
+        rows = [regions[region_name(region)] for region in table.regions]
+        columns = [clades[clade] for clade in table.clades]
+        np.add.at(counts, np.ix_(rows, columns, [period]), table.counts.sum(axis=2, keepdims=True))
+    return CladeTable(list(regions), list(clades), list(periods), counts)
+
+
+def to_frame(table: CladeTable) -> "pd.DataFrame":
+    """
+    Returns [table] in long form, one row per region, clade and period with its count
+    """
+    import pandas as pd
+
+    index = pd.MultiIndex.from_product([table.regions, table.clades, table.periods], names=["region", "clade", "period"])
+    return pd.DataFrame({"count": table.counts.reshape(-1)}, index=index).reset_index()
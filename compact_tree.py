@@ -0,0 +1,464 @@
+import re
+from typing import TYPE_CHECKING, Iterator, List, NamedTuple, TextIO, Tuple
+
+import numpy as np
+
+from clade_classifier import CladeClassifier
+from extractor import open_input
+
+if TYPE_CHECKING:
+    from ete3 import TreeNode
+
+DELIMITERS = "(),;"
+CHUNK_SIZE = 1 << 20
+DEFAULT_DIST = 1.0
+DEFAULT_SUPPORT = 1.0
+
+_TOKEN = re.compile(r"([(),;])|([^(),;]+)")
+_QUOTED_TOKEN = re.compile(r"([(),;])|((?:'[^']*'|[^(),;'])+)")
+
+
+class CompactTree(NamedTuple):
+    """
+    A tree stored as flat arrays, with nodes numbered in depth first (preorder) order and the root at 0.
+
+    The nodes under node i are exactly i + 1 ... end[i] - 1, so any subtree is a contiguous slice of every array.
+    Distances and supports hold the values ete3 would give the node, including its defaults.
+
+    Attributes:
+
+        - parent (np.ndarray): Index of the parent of each node, -1 for the root
+        - first_child (np.ndarray): Index of the first child of each node, -1 for leaves
+        - next_sibling (np.ndarray): Index of the next sibling of each node, -1 for the last child
+        - end (np.ndarray): One past the index of the last node under each node
+        - depth (np.ndarray): Number of edges between each node and the root
+        - dist (np.ndarray): Branch length of each node
+        - support (np.ndarray): Support value of each node, read from the `)123` labels
+        - name_start (np.ndarray): Start of the name of each node in [names]
+        - name_end (np.ndarray): End of the name of each node in [names]
+        - names (str): The names of all nodes, back to back
+        - clade (np.ndarray): Clade id of each leaf, -1 for internal nodes. None until `classify` is called
+    """
+    parent: np.ndarray
+    first_child: np.ndarray
+    next_sibling: np.ndarray
+    end: np.ndarray
+    depth: np.ndarray
+    dist: np.ndarray
+    support: np.ndarray
+    name_start: np.ndarray
+    name_end: np.ndarray
+    names: str
+    clade: np.ndarray = None
+
+    @property
+    def size(self) -> int:
+        return len(self.parent)
+
+    @property
+    def is_leaf(self) -> np.ndarray:
+        return self.first_child < 0
+
+    @property
+    def leaves(self) -> np.ndarray:
+        return np.flatnonzero(self.is_leaf)
+
+    def name(self, node: int) -> str:
+        return self.names[self.name_start[node] : self.name_end[node]]
+
+    def leaf_names(self) -> List[str]:
+        names = self.names
+        leaves = self.leaves
+        return [names[start:end] for start, end in zip(self.name_start[leaves].tolist(), self.name_end[leaves].tolist())]
+
+    def children(self, node: int) -> List[int]:
+        result = []
+        child = self.first_child[node]
+        while child >= 0:
+            result.append(int(child))
+            child = self.next_sibling[child]
+        return result
+
+
+def read_newick_chunks(f: TextIO, is_quoted: bool = False, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """
+    Reads [f] in chunks that always end right before one of "(),;", outside of any quoted name.
+
+    Names, branch lengths and the `)123` labels therefore never straddle two chunks.
+
+    Args:
+
+        - f (TextIO): The newick file opened in text mode
+        - is_quoted (bool): Whether names are quoted and may contain the delimiters
+        - chunk_size (int): Number of characters to read at a time
+    """
+    carry = ""
+    while True:
+        data = f.read(chunk_size)
+        if not data:
+            break
+        text = carry + data
+        cut = max(text.rfind(delimiter) for delimiter in DELIMITERS)
+        while is_quoted and cut > 0 and text.count("'", 0, cut) % 2:
+            cut = max(text.rfind(delimiter, 0, cut) for delimiter in DELIMITERS)
+        if cut <= 0:
+            carry = text
+            continue
+        yield text[:cut]
+        carry = text[cut:]
+    if carry:
+        yield carry
+
+
+def iter_tokens(chunks: Iterator[str], is_quoted: bool = False) -> Iterator[Tuple[str, str]]:
+    """
+    Splits newick text into delimiters and the labels between them.
+
+    Yields:
+
+        - Tuple[str, str]: Either (delimiter, None) or (None, label), with the label stripped of surrounding whitespace
+    """
+    token = _QUOTED_TOKEN if is_quoted else _TOKEN
+    for chunk in chunks:
+        for match in token.finditer(chunk):
+            delimiter, label = match.groups()
+            if delimiter is not None:
+                yield delimiter, None
+            else:
+                label = label.strip()
+                if label:
+                    yield None, label
+
+
+def iter_leaf_names(chunks: Iterator[str], is_quoted: bool = False) -> Iterator[str]:
+    """
+    Yields the name of every leaf in the newick text [chunks], in order, without building the tree.
+
+    The whole of [chunks] is consumed, including anything after the closing ";".
+    """
+    expecting_leaf = True
+    for delimiter, label in iter_tokens(chunks, is_quoted):
+        if label is None:
+            expecting_leaf = delimiter in "(,"
+        elif expecting_leaf:
+            yield split_label(label, is_quoted)[0]
+            expecting_leaf = False
+
+
+def split_label(label: str, is_quoted: bool = False) -> Tuple[str, str]:
+    """
+    Splits a `name:length` label into its name and length, either of which may be empty
+    """
+    if is_quoted and label.startswith("'"):
+        close = label.index("'", 1)
+        length = label[close + 1 :].strip()
+        return label[1:close], length[1:].strip() if length.startswith(":") else ""
+    name, _, length = label.partition(":")
+    return name.strip(), length.strip()
+
+
+def read_newick(f: TextIO, is_quoted: bool = False, chunk_size: int = CHUNK_SIZE) -> CompactTree:
+    """
+    Parses the first tree in the newick stream [f] without building any ete3 node
+
+    Args:
+
+        - f (TextIO): The newick file opened in text mode
+        - is_quoted (bool): Whether names are surrounded by quotes, which are then removed
+        - chunk_size (int): Number of characters to read at a time
+
+    Returns:
+
+        - CompactTree: The parsed tree
+    """
+    parent, end, depth, dist, support, names = [], [], [], [], [], []
+    stack = []
+    expecting_leaf = True
+    closed = -1
+
+    def new_node(length: str) -> int:
+        node = len(parent)
+        parent.append(stack[-1] if stack else -1)
+        end.append(node + 1)
+        depth.append(len(stack))
+        dist.append(float(length) if length else (DEFAULT_DIST if stack else 0.0))
+        support.append(DEFAULT_SUPPORT)
+        names.append("")
+        return node
+
+    for delimiter, label in iter_tokens(read_newick_chunks(f, is_quoted, chunk_size), is_quoted):
+        if label is not None:
+            name, length = split_label(label, is_quoted)
+            if expecting_leaf:
+                names[new_node(length)] = name
+                expecting_leaf = False
+            elif closed >= 0:
+                try:
+                    support[closed] = float(name) if name else DEFAULT_SUPPORT
+                except ValueError:
+                    names[closed] = name
+                dist[closed] = float(length) if length else dist[closed]
+                closed = -1
+            else:
+                raise ValueError(f"Unexpected label {label!r} in newick")
+            continue
+
+        if delimiter in ",);" and expecting_leaf and parent:
+            raise ValueError("Empty leaf node found")
+        closed = -1
+        if delimiter == "(":
+            stack.append(new_node(""))
+            expecting_leaf = True
+        elif delimiter == ",":
+            expecting_leaf = True
+        elif delimiter == ")":
+            closed = stack.pop()
+            end[closed] = len(parent)
+        elif delimiter == ";":
+            break
+    if stack or not parent:
+        raise ValueError("Unbalanced or empty newick tree")
+
+    return _build(
+        parent=np.array(parent, dtype=np.int64),
+        end=np.array(end, dtype=np.int64),
+        depth=np.array(depth, dtype=np.int64),
+        dist=np.array(dist, dtype=float),
+        support=np.array(support, dtype=float),
+        names=names,
+    )
+
+
+def parse_newick(file: str, is_quoted: bool = False) -> CompactTree:
+    """
+    Parses the newick file at [file], see `read_newick`
+    """
+    with open_input(file, "r", buffering=CHUNK_SIZE) as f:
+        return read_newick(f, is_quoted)
+
+
+def _build(parent: np.ndarray, end: np.ndarray, depth: np.ndarray, dist: np.ndarray, support: np.ndarray, names: List[str], clade: np.ndarray = None) -> CompactTree:
+    lengths = np.array([len(name) for name in names], dtype=np.int64)
+    name_end = np.cumsum(lengths)
+    first_child, next_sibling = _links(parent, end)
+    return CompactTree(
+        parent=parent,
+        first_child=first_child,
+        next_sibling=next_sibling,
+        end=end,
+        depth=depth,
+        dist=dist,
+        support=support,
+        name_start=name_end - lengths,
+        name_end=name_end,
+        names="".join(names),
+        clade=clade,
+    )
+
+
+def _links(parent: np.ndarray, end: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Derives the first child and next sibling of every node of a preorder numbered tree
+    """
+    size = len(parent)
+    nodes = np.arange(size)
+    first_child = np.full(size, -1, dtype=np.int64)
+    has_child = end > nodes + 1
+    first_child[has_child] = nodes[has_child] + 1
+
+    next_sibling = np.full(size, -1, dtype=np.int64)
+    after = end < size
+    candidates = nodes[after]
+    has_sibling = parent[end[after]] == parent[candidates]
+    next_sibling[candidates[has_sibling]] = end[after][has_sibling]
+    return first_child, next_sibling
+
+
+def classify(tree: CompactTree, classifier: CladeClassifier) -> CompactTree:
+    """
+    Returns [tree] with the clade id of every leaf set, see `CladeClassifier`
+    """
+    clade = np.full(tree.size, -1, dtype=np.int32)
+    clade[tree.leaves] = classifier.classify_all(tree.leaf_names())
+    return tree._replace(clade=clade)
+
+
+def node_clade_counts(tree: CompactTree, n_labels: int) -> np.ndarray:
+    """
+    Computes the number of leaves of each clade under every node of a classified tree.
+
+    Since every subtree is a contiguous range of nodes, the counts are differences of prefix sums over the leaf clades.
+
+    Args:
+
+        - tree (CompactTree): The tree, classified with `classify`
+        - n_labels (int): Number of clade labels of the classifier
+
+    Returns:
+
+        - np.ndarray: nodes x labels count matrix, in node order
+    """
+    leaves = tree.leaves
+    prefix = np.zeros((tree.size + 1, n_labels), dtype=np.int64)
+    prefix[leaves + 1, tree.clade[leaves]] = 1
+    np.cumsum(prefix, axis=0, out=prefix)
+    return prefix[tree.end] - prefix[:-1]
+
+
+def levelorder(tree: CompactTree) -> np.ndarray:
+    """
+    Returns the nodes in the order `TreeNode.traverse()` would visit them, breadth first
+    """
+    return np.argsort(tree.depth, kind="stable")
+
+
+def set_outgroup(tree: CompactTree, outgroup: int) -> CompactTree:
+    """
+    Roots [tree] on [outgroup], the same way `TreeNode.set_outgroup` does.
+
+    Only the nodes on the path between the old root and [outgroup] are rearranged; every other subtree is moved
+    as one contiguous block into the new preorder.
+
+    Args:
+
+        - tree (CompactTree): The tree to reroot
+        - outgroup (int): The node to set as outgroup
+
+    Returns:
+
+        - CompactTree: A new tree with [outgroup] as the first child of the root
+    """
+    root = 0
+    outgroup = int(outgroup)
+    if outgroup == root:
+        raise ValueError("Cannot set the root as outgroup")
+
+    # A new node is appended at the end of every array in case the root's other children need to be grouped
+    connector = tree.size
+    parent = np.append(tree.parent, -1)
+    dist = np.append(tree.dist, 0.0)
+    support = np.append(tree.support, DEFAULT_SUPPORT)
+    name_start = np.append(tree.name_start, 0)
+    name_end = np.append(tree.name_end, 0)
+    clade = None if tree.clade is None else np.append(tree.clade, -1)
+
+    parent_outgroup = int(parent[outgroup])
+    top = outgroup
+    while parent[top] != root:
+        top = int(parent[top])
+
+    kids = {root: [child for child in tree.children(root) if child != top]}
+    if len(kids[root]) != 1:
+        support[connector] = support[top]
+        kids[connector] = kids[root]
+        parent[kids[connector]] = connector
+    else:
+        connector = kids[root][0]
+
+    if parent_outgroup != root:
+        becomes_parent = parent_outgroup
+        becomes_child = int(parent[becomes_parent])
+        was_parent = -1
+        kids[becomes_parent] = tree.children(becomes_parent)
+        buffered_dist, buffered_support = dist[becomes_parent], support[becomes_parent]
+        while becomes_child != root:
+            kids.setdefault(becomes_child, tree.children(becomes_child))
+            kids[becomes_parent].append(becomes_child)
+            kids[becomes_child].remove(becomes_parent)
+
+            buffered_dist, dist[becomes_child] = dist[becomes_child], buffered_dist
+            buffered_support, support[becomes_child] = support[becomes_child], buffered_support
+
+            parent[becomes_parent] = was_parent
+            was_parent = becomes_parent
+            becomes_parent = becomes_child
+            becomes_child = int(parent[becomes_parent])
+
+        kids[becomes_parent].append(connector)
+        parent[connector] = becomes_parent
+        parent[becomes_parent] = was_parent
+
+        dist[connector] += buffered_dist
+        outgroup2 = parent_outgroup
+        kids[parent_outgroup].remove(outgroup)
+        dist[outgroup2] = 0
+    else:
+        outgroup2 = connector
+
+    parent[outgroup] = root
+    parent[outgroup2] = root
+    kids[root] = [outgroup, outgroup2]
+    middist = (dist[outgroup2] + dist[outgroup]) / 2
+    dist[outgroup] = middist
+    dist[outgroup2] = middist
+    support[outgroup2] = support[outgroup]
+
+    # Lay the nodes out in the new preorder, untouched subtrees as whole blocks
+    old_size = np.append(tree.end - np.arange(tree.size), 1)
+    starts, stops, depths = [], [], []
+    stack = [(root, 0)]
+    while stack:
+        node, node_depth = stack.pop()
+        starts.append(node)
+        depths.append(node_depth)
+        if node in kids:
+            stops.append(node + 1)
+            stack.extend((child, node_depth + 1) for child in reversed(kids[node]))
+        else:
+            stops.append(node + old_size[node])
+    starts, stops, depths = np.array(starts), np.array(stops), np.array(depths)
+    lengths = stops - starts
+    order = np.concatenate([np.arange(start, stop) for start, stop in zip(starts.tolist(), stops.tolist())])
+
+    new_index = np.full(len(parent), -1, dtype=np.int64)
+    new_index[order] = np.arange(len(order))
+    new_parent = np.where(parent[order] >= 0, new_index[parent[order]], -1)
+
+    old_depth = np.append(tree.depth, 0)
+    new_depth = old_depth[order] + np.repeat(depths - old_depth[starts], lengths)
+
+    size = old_size.copy()
+    for node in reversed(starts.tolist()):
+        if node in kids:
+            size[node] = 1 + sum(size[child] for child in kids[node])
+    new_end = np.arange(len(order)) + size[order]
+
+    first_child, next_sibling = _links(new_parent, new_end)
+    return CompactTree(
+        parent=new_parent,
+        first_child=first_child,
+        next_sibling=next_sibling,
+        end=new_end,
+        depth=new_depth,
+        dist=dist[order],
+        support=support[order],
+        name_start=name_start[order],
+        name_end=name_end[order],
+        names=tree.names,
+        clade=None if clade is None else clade[order],
+    )
+
+
+def to_ete3(tree: CompactTree) -> Tuple["TreeNode", List["TreeNode"]]:
+    """
+    Builds the ete3 tree of [tree], for rendering
+
+    Returns:
+
+        - Tuple[TreeNode, List[TreeNode]]: The root, and the ete3 node of every compact node index
+    """
+    from ete3 import TreeNode
+
+    nodes = []
+    parent = tree.parent.tolist()
+    dist = tree.dist.tolist()
+    support = tree.support.tolist()
+    names = tree.names
+    for i, (start, end) in enumerate(zip(tree.name_start.tolist(), tree.name_end.tolist())):
+        node = TreeNode(name=names[start:end], dist=dist[i], support=support[i])
+        if parent[i] >= 0:
+            up = nodes[parent[i]]
+            up.children.append(node)
+            node.up = up
+        nodes.append(node)
+    return nodes[0], nodes
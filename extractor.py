@@ -1,10 +1,242 @@
 import argparse
+import fnmatch
+import hashlib
+import io
+import os
+import shutil
+import sys
 import tarfile
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import IO, Iterator, List, NamedTuple, Optional, Tuple
 
+# Separates an archive from one of its members in input paths, e.g. "gisaid.tar::trees/iqtree.nwk"
+MEMBER_SEP = "::"
+# Members extracted when no pattern is given on the command line
+DEFAULT_PATTERNS = ["*.nwk", "*.tree", "*.treefile", "*clade_progression*.tsv", "*geoclade*.tsv"]
+# How an existing file is found to be the same as its member, each check including the ones before it
+CHECKS = ["none", "size", "mtime", "checksum"]
+COPY_BLOCK = 1 << 20
 
-def extract(file: str, out: str):
-    with tarfile.open(file, "r") as t:
-        t.extractall(out)
+
+class ExtractResult(NamedTuple):
+    """
+    What `extract` did with each member it was asked for
+
+    Attributes:
+
+        - extracted (List[str]): Members written to disk
+        - unchanged (List[str]): Members already on disk, left as they were
+        - unsafe (List[str]): Members whose path leads outside of the output folder, never written
+        - skipped (List[str]): Links, devices and other members that are not regular files
+    """
+    extracted: List[str]
+    unchanged: List[str]
+    unsafe: List[str]
+    skipped: List[str]
+
+
+def split_member(path: str) -> Tuple[str, Optional[str]]:
+    """
+    Splits an input path into the archive and the member inside it, e.g. ("gisaid.tar", "*.nwk") for "gisaid.tar::*.nwk".
+    The member is None for paths of plain files.
+    """
+    archive, sep, member = path.partition(MEMBER_SEP)
+    return (archive, member) if sep else (path, None)
+
+
+def matches(name: str, patterns: List[str]) -> bool:
+    """
+    Returns whether the member [name] matches one of the glob [patterns], on its full path or its file name
+    """
+    return any(fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(os.path.basename(name), pattern) for pattern in patterns)
+
+
+def find_member(tar: tarfile.TarFile, pattern: str) -> tarfile.TarInfo:
+    """
+    Returns the first regular file of [tar] named [pattern] or matching it, reading the archive only up to it
+    """
+    for member in tar:
+        if member.isfile() and (member.name == pattern or matches(member.name, [pattern])):
+            return member
+    raise Exception(f"No file matching {pattern!r} in {tar.name}")
+
+
+@contextmanager
+def open_input(path: str, mode: str = "r", **kwargs) -> Iterator[IO]:
+    """
+    Opens [path] for reading like `open`, where [path] may also name a member of a tar archive, see `split_member`.
+
+    Members are read straight out of the archive, compressed or not, without writing them anywhere.
+
+    Args:
+
+        - path (str): The path of a file, or "archive.tar::member" where member is a name or a glob pattern
+        - mode (str): "r" for text, "rb" for bytes
+        - kwargs: Passed on to `open` for plain files, e.g. buffering
+
+    Returns:
+
+        - Iterator[IO]: The open file, closed on leaving the context
+    """
+    archive, member = split_member(path)
+    if member is None:
+        with open(path, mode, **kwargs) as f:
+            yield f
+        return
+    with tarfile.open(archive, "r:*") as tar:
+        raw = tar.extractfile(find_member(tar, member))
+        with (raw if "b" in mode else io.TextIOWrapper(raw)) as f:
+            yield f
+
+
+def is_member(path: str) -> bool:
+    return split_member(path)[1] is not None
+
+
+def safe_target(out: str, name: str) -> Optional[str]:
+    """
+    Returns where the member [name] goes under [out], or None if it is absolute or leads outside of [out], e.g. "../x",
+    including through a symbolic link already under [out]
+    """
+    if os.path.isabs(name) or os.path.splitdrive(name)[0]:
+        return None
+    root = os.path.realpath(out)
+    target = os.path.realpath(os.path.join(root, name))
+    if target == root or os.path.commonpath([root, target]) != root:
+        return None
+    return target
+
+
+def _digest(f: IO) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    for block in iter(lambda: f.read(COPY_BLOCK), b""):
+        digest.update(block)
+    return digest.hexdigest()
+
+
+def is_unchanged(tar: tarfile.TarFile, member: tarfile.TarInfo, target: str, check: str) -> bool:
+    """
+    Returns whether the file at [target] holds [member] already, comparing as much as [check] asks for, see `CHECKS`
+    """
+    if check == "none" or not os.path.isfile(target):
+        return False
+    stat = os.stat(target)
+    if stat.st_size != member.size:
+        return False
+    if check == "mtime" and int(stat.st_mtime) != int(member.mtime):
+        return False
+    if check == "checksum":
+        with open(target, "rb") as f:
+            on_disk = _digest(f)
+        return on_disk == _digest(tar.extractfile(member))
+    return True
+
+
+def _write_member(tar: tarfile.TarFile, member: tarfile.TarInfo, target: str):
+    """
+    Writes [member] to [target] through a temporary file, so that an interrupted run never leaves half a file behind
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    handle, temp = tempfile.mkstemp(dir=os.path.dirname(target), suffix=".part")
+    try:
+        with os.fdopen(handle, "wb") as f:
+            shutil.copyfileobj(tar.extractfile(member), f, COPY_BLOCK)
+        os.chmod(temp, member.mode & 0o777)
+        os.utime(temp, (member.mtime, member.mtime))
+        os.replace(temp, target)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
+def _extract_one(tar: tarfile.TarFile, member: tarfile.TarInfo, out: str, check: str) -> str:
+    """
+    Extracts [member] unless it is unsafe, not a regular file or unchanged
+
+    Returns:
+
+        - str: The field of `ExtractResult` the member belongs to
+    """
+    target = safe_target(out, member.name)
+    if target is None:
+        return "unsafe"
+    if not member.isfile() or member.issparse():
+        return "skipped"
+    if is_unchanged(tar, member, target, check):
+        return "unchanged"
+    _write_member(tar, member, target)
+    return "extracted"
+
+
+def _extract_batch(job: Tuple[str, List[tarfile.TarInfo], str, str]) -> List[Tuple[str, str]]:
+    file, members, out, check = job
+    with tarfile.open(file, "r:") as tar:
+        return [(member.name, _extract_one(tar, member, out, check)) for member in members]
+
+
+def _is_compressed(file: str) -> bool:
+    try:
+        tarfile.open(file, "r:").close()
+    except tarfile.ReadError:
+        return True
+    return False
+
+
+def extract(file: str, out: str, patterns: List[str] = None, workers: int = 1, check: str = "mtime") -> ExtractResult:
+    """
+    Extracts the members of the tar archive at [file] matching [patterns] into [out].
+
+    Uncompressed archives are extracted by [workers] threads, each reading its own contiguous share of the archive.
+    Compressed archives can only be read from the start, so they are extracted in a single pass.
+
+    Args:
+
+        - file (str): The path to the tar archive
+        - out (str): The folder to extract into, created if needed
+        - patterns (List[str]): Glob patterns of the members to extract, on their path or file name. None for all of them
+        - workers (int): Number of threads extracting an uncompressed archive
+        - check (str): How a file already in [out] is found to be unchanged and left alone, see `CHECKS`
+
+    Returns:
+
+        - ExtractResult: The names of the members, by what was done with them
+    """
+    if check not in CHECKS:
+        raise Exception(f"Unknown check {check!r}, expected one of {CHECKS}")
+    os.makedirs(out, exist_ok=True)
+
+    def wanted(member: tarfile.TarInfo) -> bool:
+        return not member.isdir() and (patterns is None or matches(member.name, patterns))
+
+    outcomes = []  # type: List[Tuple[str, str]]
+    if workers <= 1 or _is_compressed(file):
+        with tarfile.open(file, "r:*") as tar:
+            for member in tar:
+                if wanted(member):
+                    outcomes.append((member.name, _extract_one(tar, member, out, check)))
+    else:
+        with tarfile.open(file, "r:") as tar:
+            members = sorted((member for member in tar if wanted(member)), key=lambda member: member.offset_data)
+        # Contiguous shares of about the same number of bytes, so that each thread reads the archive forward
+        share_bytes = sum(member.size for member in members) / workers
+        shares, share, done = [], [], 0
+        for member in members:
+            share.append(member)
+            done += member.size
+            if done >= share_bytes * (len(shares) + 1) and len(shares) < workers - 1:
+                shares.append(share)
+                share = []
+        shares.append(share)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for batch in pool.map(_extract_batch, [(file, share, out, check) for share in shares if share]):
+                outcomes.extend(batch)
+    result = ExtractResult([], [], [], [])
+    for name, field in outcomes:
+        getattr(result, field).append(name)
+    return result
 
 
 def _parse_arg():
@@ -19,18 +251,49 @@ def _parse_arg():
         "output",
         metavar="O",
         type=str,
-        help="""The path of the output folder to extract items into. 
+        help="""The path of the output folder to extract items into.
         If folder does not exist, a new one will automatically be created
         E.g. ./out folder out will automatically be created if it doesn't exist""",
     )
+    parser.add_argument(
+        "-p",
+        "--pattern",
+        dest="patterns",
+        action="append",
+        help=f"Only extracts members whose path or file name matches this glob pattern. Can be repeated. Default {' '.join(DEFAULT_PATTERNS)}",
+    )
+    parser.add_argument("-a", "--all", dest="all", action="store_true", help="Extracts every member, ignoring the patterns")
+    parser.add_argument(
+        "-j",
+        "--workers",
+        dest="workers",
+        type=int,
+        default=min(4, os.cpu_count() or 1),
+        help="Number of threads extracting an uncompressed archive. Default 4, or the number of cores if fewer",
+    )
+    parser.add_argument(
+        "--check",
+        dest="check",
+        choices=CHECKS,
+        default="mtime",
+        help="Leaves files already extracted alone when their size, size and modification time, or size and checksum match. Default mtime",
+    )
     return parser.parse_args()
 
 
 def main():
     args = _parse_arg()
-    extract(args.input, args.output)
+    start = time.perf_counter()
+    patterns = None if args.all else args.patterns or DEFAULT_PATTERNS
+    result = extract(args.input, args.output, patterns, args.workers, args.check)
+    print(
+        f"{len(result.extracted)} extracted, {len(result.unchanged)} unchanged, {len(result.skipped)} not regular files "
+        f"in {time.perf_counter() - start:.2f}s"
+    )
+    if result.unsafe:
+        print(f"Refused {len(result.unsafe)} members leading outside of {args.output}: {', '.join(result.unsafe)}")
+        sys.exit(1)
 
 
 if __name__ == "__main__":
     main()
-
@@ -0,0 +1,274 @@
+import argparse
+import time
+from collections import Counter
+from typing import TYPE_CHECKING, Iterable, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+import clade_store
+import clade_tables
+from clade_tables import CladeTable
+from graph_plot import CLADE_LABELS, CONTINENTS
+from profiling import peak_rss_since_reset_mb, reset_peak_rss
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+CHUNK_ROWS = 500000
+# Clades outside of the charts are counted as Other
+OTHER = "O"
+# Substitution marking the "n" variant of a clade, e.g. Gn for G+S477X
+VARIANT_MARKER = "Spike_S477"
+
+
+class Columns(NamedTuple):
+    """
+    The columns of the metadata export that are read
+
+    Attributes:
+
+        - clade (str): The GISAID clade of the sequence, e.g. GH
+        - date (str): The collection date, as YYYY-MM-DD, or YYYY-MM when the day is unknown
+        - location (str): The location, starting with the continent, e.g. "Europe / Germany / Bavaria"
+        - substitutions (str): The amino acid substitutions of the sequence, e.g. "(Spike_D614G,Spike_S477N)"
+    """
+    clade: str = "Clade"
+    date: str = "Collection date"
+    location: str = "Location"
+    substitutions: str = "AA Substitutions"
+
+
+class Period(NamedTuple):
+    """
+    How sequences are grouped in time
+
+    Attributes:
+
+        - freq (str): The pandas period frequency
+        - column (str): The name of the period column of the clade progression table
+        - title (str): The title of the first table of the clade progression file
+        - label (str): strftime format of the period names
+        - needs_day (bool): Whether the collection date must include the day
+    """
+    freq: str
+    column: str
+    title: str
+    label: str
+    needs_day: bool
+
+
+PERIODS = {
+    "month": Period("M", "Month", "Per month", "%b%y", False),
+    # Weeks start on monday and are named after it
+    "week": Period("W-SUN", "Week", "Per week", "%Y-%m-%d", True),
+}
+
+
+class ChunkStats(NamedTuple):
+    """
+    How reading and counting one chunk went
+
+    Attributes:
+
+        - rows (int): Rows in the chunk
+        - counted (int): Rows with a continent, clade and period
+        - seconds (float): Time taken to read and count the chunk
+        - peak_rss_mb (Optional[float]): Peak resident memory while reading and counting the chunk, None outside of Linux
+    """
+    rows: int
+    counted: int
+    seconds: float
+    peak_rss_mb: Optional[float]
+
+
+def clade_names(clades: "pd.Series", substitutions: "pd.Series", marker: str = VARIANT_MARKER) -> "pd.Series":
+    """
+    Returns the chart name of each clade, e.g. Gn for a G sequence with [marker], and `OTHER` for clades the charts do not know
+    """
+    import pandas as pd
+
+    clades = clades.str.strip()
+    variant = clades + "n"
+    has_marker = substitutions.str.contains(marker, regex=False, na=False)
+    names = pd.Series(np.where(has_marker & variant.isin(CLADE_LABELS), variant, clades), index=clades.index)
+    return names.where(names.isin(CLADE_LABELS) | names.isna(), OTHER)
+
+
+def continent_names(locations: "pd.Series") -> "pd.Series":
+    """
+    Returns the continent of each location, without spaces as in the geoclade file, e.g. NorthAmerica
+    """
+    return locations.str.split("/", n=1).str[0].str.strip().str.replace(" ", "", regex=False)
+
+
+def collection_periods(dates: "pd.Series", period: Period) -> "pd.Series":
+    """
+    Returns the period of each collection date, NaT where it is missing or not precise enough
+    """
+    import pandas as pd
+
+    if period.needs_day:
+        parsed = pd.to_datetime(dates, format="%Y-%m-%d", errors="coerce")
+    else:
+        parsed = pd.to_datetime(dates.str.slice(0, 7), format="%Y-%m", errors="coerce")
+    return parsed.dt.to_period(period.freq)
+
+
+def count_chunk(chunk: "pd.DataFrame", columns: Columns, period: Period, marker: str = VARIANT_MARKER) -> Counter:
+    """
+    Counts the sequences of [chunk] by continent, clade and period. Rows missing any of them are left out
+    """
+    frame = chunk.assign(
+        _continent=continent_names(chunk[columns.location]),
+        _clade=clade_names(chunk[columns.clade], chunk[columns.substitutions], marker),
+        _period=collection_periods(chunk[columns.date], period),
+    ).dropna(subset=["_continent", "_clade", "_period"])
+    return Counter(frame.groupby(["_continent", "_clade", "_period"]).size().to_dict())
+
+
+def ingest(file: str, columns: Columns, period: Period, chunk_rows: int = CHUNK_ROWS, marker: str = VARIANT_MARKER) -> Iterable[Tuple[Counter, ChunkStats]]:
+    """
+    Reads the metadata TSV at [file] [chunk_rows] rows at a time, yielding the counts of each chunk with its statistics.
+    Only the four columns of [columns] are read.
+    """
+    import pandas as pd
+
+    reader = pd.read_csv(file, sep="\t", usecols=list(columns), dtype=str, chunksize=chunk_rows)
+    own_peak = reset_peak_rss()
+    start = time.perf_counter()
+    for chunk in reader:
+        counts = count_chunk(chunk, columns, period, marker)
+        seconds = time.perf_counter() - start
+        peak = peak_rss_since_reset_mb() if own_peak else None
+        yield counts, ChunkStats(len(chunk), sum(counts.values()), seconds, peak)
+        own_peak = reset_peak_rss()
+        start = time.perf_counter()
+
+
+def _ordered(names: Iterable[str], order: List[str]) -> List[str]:
+    names = set(names)
+    return [name for name in order if name in names] + sorted(names.difference(order))
+
+
+def count_table(counts: Counter, period: Period) -> CladeTable:
+    """
+    Turns the counts of `ingest` into a table of every continent, clade and period, with the periods in between the
+    first and last filled with 0
+    """
+    import pandas as pd
+
+    if not counts:
+        raise Exception("No sequence with a continent, clade and collection date was found")
+    continents = _ordered((key[0] for key in counts), CONTINENTS)
+    clades = _ordered((key[1] for key in counts), list(CLADE_LABELS))
+    found = [key[2] for key in counts]
+    periods = list(pd.period_range(min(found), max(found), freq=period.freq))
+    period_index = {p: i for i, p in enumerate(periods)}
+    continent_index = {c: i for i, c in enumerate(continents)}
+    clade_index = {c: i for i, c in enumerate(clades)}
+
+    cube = np.zeros((len(continents), len(clades), len(periods)), dtype=np.int64)
+    for (continent, clade, p), count in counts.items():
+        cube[continent_index[continent], clade_index[clade], period_index[p]] += count
+    labels = [(p.start_time if period.needs_day else p).strftime(period.label) for p in periods]
+    return CladeTable(continents, clades, labels, cube)
+
+
+def build_tables(table: CladeTable, geo_periods: int = 1) -> Tuple[CladeTable, CladeTable]:
+    """
+    Splits the table of `count_table` into the tables of the clade progression and geoclade files.
+
+    Args:
+
+        - table (CladeTable): Sequences by continent, clade and period
+        - geo_periods (int): Number of latest periods the geoclade table counts, 0 for all of them
+
+    Returns:
+
+        - Tuple[CladeTable, CladeTable]: The counts of every period over all continents, and the counts of every
+          continent over the last [geo_periods]
+    """
+    progression = table._replace(regions=[""], counts=table.counts.sum(axis=0, keepdims=True))
+    window = table.periods[-geo_periods:] if geo_periods else table.periods
+    counts = table.counts[:, :, len(table.periods) - len(window) :].sum(axis=2, keepdims=True)
+    return progression, table._replace(periods=[f"{window[0]}-{window[-1]}"], counts=counts)
+
+
+def _parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Builds the clade progression and geoclade tables of graph_plot.py from a GISAID metadata export, reading it in chunks",
+        epilog="If you notice any issues, please open one over at https://github.com/ElasticBottle/GISAID-Analysis-Update ",
+    )
+    parser.add_argument("metadata", type=str, help="The metadata TSV exported from GISAID")
+    parser.add_argument("-co", "--clade-progression", dest="c_out", type=str, help="Path to write the clade progression tsv to")
+    parser.add_argument("-go", "--geoclade", dest="g_out", type=str, help="Path to write the geoclade tsv to")
+    parser.add_argument(
+        "-s",
+        "--store",
+        dest="store",
+        type=str,
+        help="Adds the counts of every continent, clade and period to this clade_store.py directory, for graph_plot.py --store",
+    )
+    parser.add_argument("--plot-clade", dest="plot_clade", action="append", help="Draws the clade progression graph straight to this path. Can be repeated")
+    parser.add_argument("--plot-geo", dest="plot_geo", action="append", help="Draws the geoclade graph straight to this path. Can be repeated")
+    parser.add_argument("--period", dest="period", choices=sorted(PERIODS), default="month", help="Groups sequences by month or by week. Default month")
+    parser.add_argument(
+        "--geo-periods",
+        dest="geo_periods",
+        type=int,
+        default=1,
+        help="Number of latest periods the geoclade table counts, 0 for all of them. Default 1",
+    )
+    parser.add_argument("--chunk-rows", dest="chunk_rows", type=int, default=CHUNK_ROWS, help=f"Rows read at a time. Default {CHUNK_ROWS}")
+    parser.add_argument(
+        "--variant-marker",
+        dest="marker",
+        type=str,
+        default=VARIANT_MARKER,
+        help=f"Substitution that puts a sequence in the n variant of its clade, e.g. Gn. Default {VARIANT_MARKER}",
+    )
+    for field, default in Columns._field_defaults.items():
+        parser.add_argument(f"--{field}-column", dest=f"{field}_column", type=str, default=default, help=f"Name of the {field} column. Default '{default}'")
+    args = parser.parse_args()
+    if not (args.c_out or args.g_out or args.store or args.plot_clade or args.plot_geo):
+        parser.error("Nothing to do, give at least one of -co, -go, -s, --plot-clade or --plot-geo")
+    return args
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    start = time.perf_counter()
+    period = PERIODS[args.period]
+    columns = Columns(*(getattr(args, f"{field}_column") for field in Columns._fields))
+    counts = Counter()
+    total = 0
+    for number, (chunk_counts, stats) in enumerate(ingest(args.metadata, columns, period, args.chunk_rows, args.marker), start=1):
+        counts.update(chunk_counts)
+        total += stats.rows
+        memory = f", peak memory {stats.peak_rss_mb:.0f} MB" if stats.peak_rss_mb is not None else ""
+        print(
+            f"chunk {number}: {stats.rows} rows, {stats.rows - stats.counted} skipped, in {stats.seconds:.2f}s "
+            f"({stats.rows / max(stats.seconds, 1e-9):,.0f} rows/s){memory}",
+            flush=True,
+        )
+    table = count_table(counts, period)
+    progression, geoclade = build_tables(table, args.geo_periods)
+    if args.c_out:
+        with open(args.c_out, "w") as f:
+            clade_tables.write_progression(f, progression, period.column, period.title)
+    if args.g_out:
+        with open(args.g_out, "w") as f:
+            clade_tables.write_geoclade(f, geoclade)
+    if args.store:
+        clade_store.append_store(args.store, table)
+    if args.plot_clade or args.plot_geo:
+        import graph_plot
+
+        graph_plot.use_agg()
+        if args.plot_clade:
+            graph_plot.plot_clade_progression(progression, args.plot_clade, False)
+        if args.plot_geo:
+            graph_plot.plot_geoclade_progression(clade_tables.with_totals(geoclade), args.plot_geo)
+    seconds = time.perf_counter() - start
+    print(f"{total} rows, {sum(counts.values())} counted, in {seconds:.2f}s ({total / seconds:,.0f} rows/s)")
@@ -0,0 +1,275 @@
+import argparse
+import math
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+import numpy as np
+
+import clade_tables
+from clade_tables import CladeTable
+from graph_plot import CLADE_LABELS, HATCHED, PIE_COLORS, STACK_COLORS, STACK_ORDER, use_agg
+
+FRAME_DPI = 100
+FPS = 4
+MAX_TICKS = 30
+# Frames handed to a worker at a time
+CHUNK = 8
+
+
+def stack_rows(table: CladeTable) -> Tuple[List[str], np.ndarray]:
+    """
+    Returns the percentage of each clade in every period of the only region of [table], in the stacking order of
+    `plot_stacked_area`. Clades missing from [table] are 0.
+
+    Returns:
+
+        - Tuple[List[str], np.ndarray]: The clade labels, and the labels x periods percentages
+    """
+    labels = list(STACK_COLORS)
+    rows = np.zeros((len(labels), len(table.periods)))
+    for clade, counts in zip(table.clades, table.counts[0]):
+        label = CLADE_LABELS.get(clade, clade)
+        rows[STACK_ORDER.get(label, 0)] += counts
+    totals = rows.sum(axis=0)
+    return labels, np.divide(rows * 100, totals, out=np.zeros_like(rows), where=totals > 0)
+
+
+class Frames:
+    """
+    A figure drawn once, whose changing artists are then drawn again over a copy of the rest for each frame.
+
+    Subclasses build [fig], call `_capture` with the artists that change, and update them before each `_write`.
+    """
+
+    fig = None
+
+    def _capture(self, dynamic: List):
+        self.dynamic = dynamic
+        for artist in dynamic:
+            artist.set_animated(True)
+        self.fig.canvas.draw()
+        self.background = self.fig.canvas.copy_from_bbox(self.fig.bbox)
+
+    def _write(self, out: str):
+        from PIL import Image
+
+        canvas = self.fig.canvas
+        canvas.restore_region(self.background)
+        for artist in self.dynamic:
+            self.fig.draw_artist(artist)
+        width, height = canvas.get_width_height()
+        Image.frombuffer("RGBA", (width, height), canvas.buffer_rgba(), "raw", "RGBA", 0, 1).save(out)
+
+
+class StackedAreaFrames(Frames):
+    """
+    The chart of `plot_stacked_area`, built once, showing the periods up to a given one on each frame.
+    Each frame moves the vertices of the existing polygons instead of drawing the chart again.
+    """
+
+    def __init__(self, table: CladeTable, dpi: int = FRAME_DPI):
+        import matplotlib.pyplot as plt
+
+        self.labels, rows = stack_rows(table)
+        self.tops = np.cumsum(rows, axis=0)
+        self.x = np.arange(len(table.periods))
+        self.fig, ax = plt.subplots(dpi=dpi)
+        self.stacks = ax.stackplot(self.x, *rows, labels=self.labels, colors=list(STACK_COLORS.values()))
+        for stack, key in zip(self.stacks, self.labels):
+            if key in HATCHED:
+                stack.set_hatch("++")
+        ax.set_xlim(0, max(len(self.x) - 1, 1))
+        # Keeps the period labels readable with hundreds of periods
+        step = max(1, math.ceil(len(self.x) / MAX_TICKS))
+        ax.set_xticks(self.x[::step])
+        ax.set_xticklabels(table.periods[::step], rotation=90)
+        ax.set_yticks(np.arange(110, step=10))
+        ax.set_yticklabels([f"{y:.0f}%" for y in np.arange(110, step=10)])
+        ax.margins(y=0)
+        ax.spines["right"].set_visible(False)
+        ax.spines["top"].set_visible(False)
+        box = ax.get_position()
+        ax.set_position([box.x0, box.y0 + 0.2, box.width, box.height * 0.85])
+        ax.legend(ncol=5, loc="lower center", bbox_to_anchor=(0.48, -0.45))
+        self._capture(self.stacks)
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def draw(self, frame: int, out: str):
+        x = self.x[: frame + 1]
+        bottom = np.zeros(len(x))
+        for stack, top in zip(self.stacks, self.tops[:, : frame + 1]):
+            # Same outline as fill_between: along the top, then back along the bottom
+            stack.set_verts([np.column_stack([np.concatenate([x, x[::-1]]), np.concatenate([top, bottom[::-1]])])])
+            bottom = top
+        self._write(out)
+
+
+class PieFrames(Frames):
+    """
+    The pie charts of `generate_geoclade_progression`, one per region, built once and showing one period per frame.
+    Each frame changes the angles of the existing wedges instead of drawing the pies again.
+    """
+
+    def __init__(self, table: CladeTable, dpi: int = FRAME_DPI):
+        import matplotlib.patches as mpatches
+        import matplotlib.pyplot as plt
+
+        self.table = table
+        self.labels = [CLADE_LABELS.get(clade, clade) for clade in table.clades]
+        colors = [PIE_COLORS.get(label, "#ffffff") for label in self.labels]
+        columns = min(3, len(table.regions))
+        rows = math.ceil(len(table.regions) / columns)
+        self.fig, axs = plt.subplots(rows, columns, squeeze=False, dpi=dpi)
+        self.wedges, self.titles = [], []
+        for ax, region in zip(axs.flat, table.regions):
+            wedges, _ = ax.pie(np.ones(len(self.labels)), labeldistance=None, colors=colors)
+            for wedge, label in zip(wedges, self.labels):
+                if label in HATCHED:
+                    wedge.set_hatch("+++")
+            self.wedges.append(wedges)
+            self.titles.append(ax.set_title(region, fontdict={"fontsize": 10}))
+        for ax in list(axs.flat)[len(table.regions) :]:
+            ax.set_visible(False)
+        patches = [mpatches.Patch(facecolor=color, hatch="+++" if label in HATCHED else "", label=label) for label, color in zip(self.labels, colors)]
+        self.fig.legend(handles=patches, ncol=5, loc="lower center")
+        self.title = self.fig.suptitle("")
+        self._capture([wedge for wedges in self.wedges for wedge in wedges] + self.titles + [self.title])
+
+    def __len__(self) -> int:
+        return len(self.table.periods)
+
+    def draw(self, frame: int, out: str):
+        counts = self.table.counts[:, :, frame]
+        totals = counts.sum(axis=1)
+        for wedges, title, region, values, total in zip(self.wedges, self.titles, self.table.regions, counts, totals):
+            angles = np.concatenate([[0], np.cumsum(values) * 360 / total]) if total else np.zeros(len(values) + 1)
+            for wedge, start, end in zip(wedges, angles[:-1], angles[1:]):
+                wedge.set_theta1(start)
+                wedge.set_theta2(end)
+            title.set_text(f"{region} (+{total})")
+        self.title.set_text(self.table.periods[frame])
+        self._write(out)
+
+
+FRAME_TYPES = {"progression": StackedAreaFrames, "geoclade": PieFrames}
+# The chart of each worker process, built by `_init_worker`
+_frames = None
+
+
+def _init_worker(kind: str, table: CladeTable, dpi: int):
+    global _frames
+    use_agg()
+    _frames = FRAME_TYPES[kind](table, dpi)
+
+
+def _draw_frame(job: Tuple[int, str]) -> str:
+    _frames.draw(*job)
+    return job[1]
+
+
+def frame_paths(directory: str, count: int, prefix: str = "frame") -> List[str]:
+    digits = len(str(max(count - 1, 0)))
+    return [os.path.join(directory, f"{prefix}_{i:0{digits}d}.png") for i in range(count)]
+
+
+def write_frames(kind: str, table: CladeTable, paths: List[str], workers: int, dpi: int = FRAME_DPI):
+    """
+    Draws frame i of the [kind] chart of [table] to paths[i] as a PNG.
+
+    Each worker process builds the chart once and then only updates it, so memory stays flat however many frames there are.
+    """
+    jobs = list(enumerate(paths))
+    if workers <= 1:
+        _init_worker(kind, table, dpi)
+        for job in jobs:
+            _draw_frame(job)
+        return
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(kind, table, dpi)) as pool:
+        for _ in pool.map(_draw_frame, jobs, chunksize=CHUNK):
+            pass
+
+
+def write_gif(paths: List[str], out: str, fps: int = FPS):
+    """
+    Joins the PNG frames at [paths] into an animated GIF at [out]
+    """
+    from PIL import Image
+
+    def frames():
+        for path in paths[1:]:
+            with Image.open(path) as image:
+                yield image.convert("P", palette=Image.ADAPTIVE)
+
+    with Image.open(paths[0]) as first:
+        first.convert("P", palette=Image.ADAPTIVE).save(
+            out, save_all=True, append_images=frames(), duration=int(1000 / fps), loop=0, optimize=False
+        )
+
+
+def load_table(kind: str, files: List[str]) -> CladeTable:
+    if kind == "progression":
+        with open(files[0]) as f:
+            return clade_tables.read_progression(f)
+    tables = []
+    for file in files:
+        with open(file) as f:
+            tables.append(clade_tables.read_geoclade(f))
+    return clade_tables.concat_periods(tables, [os.path.splitext(os.path.basename(file))[0] for file in files])
+
+
+def _parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Draws one frame per period of the clade progression chart or of the geoclade pie charts",
+        epilog="If you notice any issues, please open one over at https://github.com/ElasticBottle/GISAID-Analysis-Update ",
+    )
+    parser.add_argument("kind", choices=sorted(FRAME_TYPES), help="progression for the stacked area chart, geoclade for the pie charts")
+    parser.add_argument(
+        "files",
+        nargs="+",
+        help="The clade progression tsv file, or one geoclade tsv file per period in order. Periods are named after the geoclade files",
+    )
+    parser.add_argument(
+        "-o",
+        "--out",
+        dest="out",
+        type=str,
+        required=True,
+        help="Directory to write the PNG frames in, or a path ending in .gif for an animation",
+    )
+    parser.add_argument("--dpi", dest="dpi", type=int, default=FRAME_DPI, help=f"Resolution of the frames. Default {FRAME_DPI}")
+    parser.add_argument("--fps", dest="fps", type=int, default=FPS, help=f"Frames per second of the animation. Default {FPS}")
+    parser.add_argument(
+        "-j",
+        "--workers",
+        dest="workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Number of processes drawing frames. Default the number of cores",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    start = time.perf_counter()
+    table = load_table(args.kind, args.files)
+    is_gif = args.out.lower().endswith(".gif")
+    directory = tempfile.mkdtemp() if is_gif else args.out
+    os.makedirs(directory, exist_ok=True)
+    try:
+        paths = frame_paths(directory, len(table.periods))
+        write_frames(args.kind, table, paths, args.workers, args.dpi)
+        if is_gif:
+            write_gif(paths, args.out, args.fps)
+    finally:
+        if is_gif:
+            shutil.rmtree(directory)
+    seconds = time.perf_counter() - start
+    print(f"{len(paths)} frames in {seconds:.2f}s ({len(paths) / seconds:.1f} frames/s) -> {args.out}")
@@ -1,17 +1,106 @@
 import argparse
+import os
+import time
 from collections import OrderedDict
-from typing import Dict, List
+from concurrent.futures import ProcessPoolExecutor
+from typing import TYPE_CHECKING, Callable, Dict, List, NamedTuple, Tuple
 
-from mpl_toolkits.mplot3d import Axes3D
-import matplotlib.pyplot as plt
-import matplotlib.patches as mpatches
-from matplotlib.collections import PolyCollection
 import numpy as np
-import pandas as pd
-import seaborn as sns
+
+import clade_store
+import clade_tables
+from extractor import open_input
+
+# matplotlib and pandas take most of the start up time, so they are imported by the functions drawing the charts
+if TYPE_CHECKING:
+    import pandas as pd
+
+# Colors of the stacked area chart, in stacking order
+STACK_COLORS = OrderedDict(
+    [
+        ("O", "#7f7f7f"),
+        ("S", "#c6e0b4"),
+        ("L", "#d9d9d9"),
+        ("V", "#ffccff"),
+        ("G", "#ffcccc"),
+        ("G+S477X", "#ffcccc"),
+        ("GV", "#f08bb5"),
+        ("GV+S477X", "#f08bb5"),
+        ("GH", "#f5b183"),
+        ("GH+S477X", "#f5b183"),
+        ("GR", "#fe7c80"),
+        ("GR+S477X", "#fe7c80"),
+    ]
+)
+HATCHED = ["G+S477X", "GH+S477X", "GR+S477X", "GV+S477X"]
+STACK_ORDER = {
+    "O": 0,
+    "S": 1,
+    "L": 2,
+    "V": 3,
+    "G": 4,
+    "G+S477X": 5,
+    "GV": 6,
+    "GV+S477X": 7,
+    "GH": 8,
+    "GH+S477X": 9,
+    "GR": 10,
+    "GR+S477X":11,
+}
+# Names of the clade columns in the charts
+CLADE_LABELS = OrderedDict(
+    [
+        ("G", "G"),
+        ("Gn", "G+S477X"),
+        ("GH", "GH"),
+        ("GHn", "GH+S477X"),
+        ("GR", "GR"),
+        ("GRn", "GR+S477X"),
+        ("GV", "GV"),
+        ("GVn", "GV+S477X"),
+        ("O", "O"),
+        ("S", "S"),
+        ("L", "L"),
+        ("V", "V"),
+    ]
+)
+# Regions of the geoclade pie charts, in the order of their blocks
+CONTINENTS = [
+    "Europe",
+    "Asia",
+    "Africa",
+    "Oceania",
+    "NorthAmerica",
+    "SouthAmerica",
+]
+# Must correspond to order in data
+PIE_COLORS = {
+    "G": "#ffcccc",
+    "G+S477X": "#ffcccc",
+    "GH": "#f4b183",
+    "GH+S477X": "#f4b183",
+    "GR": "#ff7c80",
+    "GR+S477X": "#ff7c80",
+    "GV": "#f08bb5",
+    "GV+S477X": "#f08bb5",
+    "L": "#d9d9d9",
+    "O": "#808080",
+    "S": "#70ad47",
+    "V": "#ff99ff",
+}
+
+
+def save_figure(fig, outs: List[str], dpi: int):
+    """
+    Saves [fig] to every path of [outs], each in the format of its extension
+    """
+    for out in outs:
+        fig.savefig(out, dpi=dpi)
 
 
 def remove_borders():
+    import matplotlib.pyplot as plt
+
     _, ax = plt.subplots()
     right_side = ax.spines["right"]
     right_side.set_visible(False)
@@ -19,7 +108,12 @@ def remove_borders():
     top_side.set_visible(False)
 
 
-def plot_3d(index: pd.Index, df: pd.DataFrame, out: str):
+def plot_3d(index: "pd.Index", df: "pd.DataFrame", outs: List[str]):
+    import matplotlib.pyplot as plt
+    from matplotlib.collections import PolyCollection
+    # Registers the "3d" projection
+    from mpl_toolkits.mplot3d import Axes3D  # noqa: F401
+
     def make_tick_index(index, scale):
         result = []
         for idx in range(len(index) * scale):
@@ -162,36 +256,20 @@ def plot_3d(index: pd.Index, df: pd.DataFrame, out: str):
     # setting the view point
     ax.view_init(elev=15.0, azim=135)
     # plt.show()
-    plt.savefig(out, dpi=320)
+    save_figure(fig, outs, dpi=320)
     return fig, ax
 
 
-def plot_stacked_area(index: pd.Index, labels: List, values: List, out: str):
-    pallette = OrderedDict(
-        [
-            ("O", "#7f7f7f"),
-            ("S", "#c6e0b4"),
-            ("L", "#d9d9d9"),
-            ("V", "#ffccff"),
-            ("G", "#ffcccc"),
-            ("G+S477X", "#ffcccc"),
-            ("GV", "#f08bb5"),
-            ("GV+S477X", "#f08bb5"),
-            ("GH", "#f5b183"),
-            ("GH+S477X", "#f5b183"),
-            ("GR", "#fe7c80"),
-            ("GR+S477X", "#fe7c80"),
-        ]
-    )
-    to_hatch = ["G+S477X", "GH+S477X", "GR+S477X", "GV+S477X"]
+def plot_stacked_area(index: "pd.Index", labels: List, values: List, outs: List[str]):
+    import matplotlib.pyplot as plt
 
     fig, ax = plt.subplots()
     stacks = ax.stackplot(
-        index, *values, labels=labels, colors=list(pallette.values()),
+        index, *values, labels=labels, colors=list(STACK_COLORS.values()),
     )
 
-    for stack, key in zip(stacks, pallette.keys()):
-        if key in to_hatch:
+    for stack, key in zip(stacks, STACK_COLORS.keys()):
+        if key in HATCHED:
             stack.set_hatch("++")
 
     y_ticks = list(map(lambda x: f"{x:.0f}%", np.arange(110, step=10)))
@@ -203,13 +281,13 @@ def plot_stacked_area(index: pd.Index, labels: List, values: List, out: str):
     box = ax.get_position()
     ax.set_position([box.x0, box.y0 + 0.2, box.width, box.height * 0.85])
     ax.legend(ncol=5, loc="lower center", bbox_to_anchor=(0.48, -0.45))
-    fig.savefig(out, dpi=300)
+    save_figure(fig, outs, dpi=300)
     return fig, ax
 
 
-def generate_clade_progression(file: str, out: str, is3d: bool):
+def generate_clade_progression(file: str, outs: List[str], is3d: bool):
     """
-    Generates a Stacked area plot for the clade progression tsv file at [file] and stores the result in [out]
+    Generates a Stacked area plot for the clade progression tsv file at [file] and stores the result in every path of [outs]
 
     Args:
         - file(str): The input file for the clade progression. Must be in .tsv format
@@ -239,76 +317,66 @@ def generate_clade_progression(file: str, out: str, is3d: bool):
                 Jun20	17230	17048	22880	3811	3440	5095	4569
                 Jul20	17720	17408	23907	3814	3512	5096	4574
                 Aug20	17726	17425	23974	3814	3513	5097	4574
-        -out(str): the output path for the generated graph
+        -outs(List[str]): the output paths for the generated graph, one per format wanted
     """
-    df = pd.read_csv(file, sep="\t", skiprows=1, index_col=0,)
-    insert_order = {
-        "O": 0,
-        "S": 1,
-        "L": 2,
-        "V": 3,
-        "G": 4,
-        "G+S477X": 5,
-        "GV": 6,
-        "GV+S477X": 7,
-        "GH": 8,
-        "GH+S477X": 9,
-        "GR": 10,
-        "GR+S477X":11,
-    }
+    with open_input(file, "r") as f:
+        table = clade_tables.read_progression(f)
+    plot_clade_progression(table, outs, is3d)
 
-    labels = OrderedDict(
-        [
-            ("G", "G"),
-            ("Gn", "G+S477X"),
-            ("GH", "GH"),
-            ("GHn", "GH+S477X"),
-            ("GR", "GR"),
-            ("GRn", "GR+S477X"),
-            ("GV", "GV"),
-            ("GVn", "GV+S477X"),
-            ("O", "O"),
-            ("S", "S"),
-            ("L", "L"),
-            ("V", "V"),
-        ]
-    )
+
+def plot_clade_progression(table: clade_tables.CladeTable, outs: List[str], is3d: bool):
+    """
+    Same as `generate_clade_progression`, from the counts of [table] with a single region rather than a file
+    """
+    import pandas as pd
 
     # Retreive the monthly dataframe
-    monthly_df = df.loc[:"Cumulative:", :].iloc[:-1]
-    monthly_df = monthly_df.astype(float)
+    monthly_df = pd.DataFrame(table.counts[0].T, index=table.periods, columns=table.clades).astype(float)
     # If ever need to retrieve the cumulative_dataFrame
-    # cum_df = df.loc["Month":, :].iloc[1:]
-    # cum_df = cum_df.astype(float)
+    # cum_df = monthly_df.cumsum()
 
-    monthly_df.rename(columns=labels, inplace=True)
+    monthly_df.rename(columns=CLADE_LABELS, inplace=True)
     hor_sum = monthly_df.sum(axis=1)
 
     # Find the percentage of the the clades // mutation
     clade_df_percentage = monthly_df.div(hor_sum, axis=0) * 100
 
     # Separate out the individual rows for plotting
-    values = [None] * len(insert_order)
+    values = [None] * len(STACK_ORDER)
 
     # Making the values for the clades
     for label, value in clade_df_percentage.items():
-        values[insert_order.get(label, 0)] = value
+        values[STACK_ORDER.get(label, 0)] = value
 
     remove_borders()
     fig, axes = (
-        plot_3d(monthly_df.index, monthly_df, out,)
+        plot_3d(monthly_df.index, monthly_df, outs,)
         if is3d
         else plot_stacked_area(
             clade_df_percentage.index,
-            sorted(labels.values(), key=lambda x: insert_order.get(x, 0)),
+            sorted(CLADE_LABELS.values(), key=lambda x: STACK_ORDER.get(x, 0)),
             values,
-            out,
+            outs,
         )
     )
 
 
 
-def make_df(file: str, continents: List[str]) -> Dict[str, pd.Series]:
+def store_clade_progression(store: str, outs: List[str], is3d: bool, last: int = 0):
+    """
+    Same as `generate_clade_progression`, from the counts of a `clade_store` summed over its regions
+
+    Args:
+        - store(str): the directory of the store
+        - outs(List[str]): the output paths for the generated graph, one per format wanted
+        - is3d(bool): whether to draw the 3d chart
+        - last(int): number of latest periods to draw, 0 for all of them
+    """
+    table = clade_store.load_store(store, last)
+    plot_clade_progression(table._replace(regions=[""], counts=table.counts.sum(axis=0, keepdims=True)), outs, is3d)
+
+
+def make_df(file: str, continents: List[str]) -> Dict[str, "pd.Series"]:
     """
     Builds the dataFrame given a file
 
@@ -369,34 +437,28 @@ def make_df(file: str, continents: List[str]) -> Dict[str, pd.Series]:
                 S	1
                 V	0
 
-        - continents(str): a list of continents that dataframes needs to be build for (6 in total)
+        - continents(str): a list of continents that dataframes needs to be build for. Regions whose title contains one of them are kept
     """
 
-    def get_clade_value(f):
-        clades, values = [], []
-        for _ in range(10):
-            clade, value = f.readline().split("\t")
-            assert clade is not None and value is not None
-            assert len(clade) > 0 and len(value) > 0
-            value = value[:-1]
-            clades.append(clade)
-            values.append(value)
-        return (clades, values)
+    with open_input(file, "r") as f:
+        table = clade_tables.read_geoclade(f)
+    return table_series(table, continents)
+
+
+def table_series(table: clade_tables.CladeTable, continents: List[str]) -> Dict[str, "pd.Series"]:
+    """
+    Same as `make_df`, from the counts of [table] with a single period rather than a file
+    """
+    import pandas as pd
 
     dfs = OrderedDict()  # continent -> dataFrame of clades
-    with open(file, "r") as f:
-        for line in f:
-            words = line.split("\t")
-            if any(continent in words[0] for continent in continents):
-                label = words[0][:-1]
-                clades, values = get_clade_value(f)
-
-                dfs[label] = pd.Series(values, index=clades).astype(int)
-    assert len(dfs) == 6
+    for region, counts in zip(table.regions, table.counts[:, :, 0]):
+        if any(continent in region for continent in continents):
+            dfs[region] = pd.Series(counts, index=table.clades)
     return dfs
 
 
-def make_pie_chart(index: int, values: pd.Series, title: str, axs):
+def make_pie_chart(index: int, values: "pd.Series", title: str, axs):
     """
     Builds a pie chart at [index] of a 2, 3 subplot with [values] and [title]
 
@@ -406,6 +468,7 @@ def make_pie_chart(index: int, values: pd.Series, title: str, axs):
         - title(str): the title of the chart
         - axs: The maplotlib Axs to plot the pie chart on
     """
+    import matplotlib.patches as mpatches
 
     def get_index(index: int) -> List[int]:
         index -= 1
@@ -414,47 +477,15 @@ def make_pie_chart(index: int, values: pd.Series, title: str, axs):
             return [1, index]
         return [0, index]
 
-    labels = OrderedDict(
-        [
-            ("O", "O"),
-            ("S", "S"),
-            ("L", "L"),
-            ("V", "V"),
-            ("G", "G"),
-            ("Gn", "G+S477X"),
-            ("GH", "GH"),
-            ("GHn", "GH+S477X"),
-            ("GR", "GR"),
-            ("GRn", "GR+S477X"),
-            ("GV", "GV"),
-            ("GVn", "GV+S477X"),
-        ]
-    )
-    # Must correspond to order in data
-    colors = {
-        "G": "#ffcccc",
-        "G+S477X": "#ffcccc",
-        "GH": "#f4b183",
-        "GH+S477X": "#f4b183",
-        "GR": "#ff7c80",
-        "GR+S477X": "#ff7c80",
-        "GV": "#f08bb5",
-        "GV+S477X": "#f08bb5",
-        "L": "#d9d9d9",
-        "O": "#808080",
-        "S": "#70ad47",
-        "V": "#ff99ff",
-    }
-    to_hatch = ["G+S477X", "GH+S477X", "GR+S477X", "GV+S477X"]
     indices = get_index(index)
     # print(title, values)
-    values.rename(index=labels, inplace=True)
+    values.rename(index=CLADE_LABELS, inplace=True)
     # print("renamed", values)
     normalize = values.values.sum(axis=0) != 0
 
     axs[indices[0], indices[1]].set_title(label=title, fontdict={"fontsize": 10})
     pie = axs[indices[0], indices[1]].pie(
-        values.values, normalize=normalize, labeldistance=None, colors=colors.values()
+        values.values, normalize=normalize, labeldistance=None, colors=PIE_COLORS.values()
     )
     plotted_val = values[values > 0]
     plotted_clades = sorted(
@@ -465,37 +496,53 @@ def make_pie_chart(index: int, values: pd.Series, title: str, axs):
     wedges = sorted(wedges, key=lambda x: x[1], reverse=True)
     for wedge, clade in zip(wedges, plotted_clades):
         # print(wedge, clade)
-        # print(f"{clade} in {to_hatch} = {clade in to_hatch}")
-        if clade in to_hatch:
+        # print(f"{clade} in {HATCHED} = {clade in HATCHED}")
+        if clade in HATCHED:
             wedge[0].set_hatch("+++")
 
     wedges = {}
-    for key, value in colors.items():
+    for key, value in PIE_COLORS.items():
         patch = mpatches.Patch(
-            facecolor=value, hatch="+++" if key in to_hatch else "", label=key
+            facecolor=value, hatch="+++" if key in HATCHED else "", label=key
         )
         wedges[key] = patch
     return wedges
 
 
-def generate_geoclade_progression(file: str, out: str):
+def generate_geoclade_progression(file: str, outs: List[str]):
     """
     Generates a pie chart showing the number of infection per continent separated based on clades
 
     Args:
         - file(str): the input path to the tsv file containing the relevant info
-        - out(str): the output path for the chart to be saved in
+        - outs(List[str]): the output paths for the chart to be saved in, one per format wanted
+    """
+    with open_input(file, "r") as f:
+        table = clade_tables.read_geoclade(f)
+    plot_geoclade_progression(table, outs)
+
+
+def store_geoclade_progression(store: str, outs: List[str], last: int = 1):
+    """
+    Same as `generate_geoclade_progression`, from the counts of a `clade_store` over its [last] latest periods.
+    Only those periods are read, however long the history of the store is.
+    """
+    table = clade_store.load_store(store, last)
+    window = f"{table.periods[0]}-{table.periods[-1]}" if table.periods else ""
+    table = table._replace(periods=[window], counts=table.counts.sum(axis=2, keepdims=True))
+    plot_geoclade_progression(clade_tables.with_totals(table), outs)
+
+
+def plot_geoclade_progression(table: clade_tables.CladeTable, outs: List[str]):
+    """
+    Same as `generate_geoclade_progression`, from the counts of [table] with a single period rather than a file
     """
-    continents = [
-        "Europe",
-        "Asia",
-        "Africa",
-        "Oceania",
-        "NorthAmerica",
-        "SouthAmerica",
-    ]
     continents_index = [2, 3, 5, 6, 1, 4]
-    dfs = make_df(file, continents)
+    import matplotlib.pyplot as plt
+
+    dfs = table_series(table, CONTINENTS)
+    if len(dfs) != len(CONTINENTS):
+        raise Exception(f"Expected one region for each of {CONTINENTS}, found {table.regions}")
     fig, axs = plt.subplots(2, 3)
     patches = {}
     for i, item in enumerate(dfs.items()):
@@ -509,7 +556,7 @@ def generate_geoclade_progression(file: str, out: str):
         loc="lower center",
         bbox_to_anchor=(1.7, -0.46),
     )
-    fig.savefig(out, dpi=300)
+    save_figure(fig, outs, dpi=300)
 
 
 def _parse_args():
@@ -522,24 +569,47 @@ def _parse_args():
         "c_file",
         metavar="clade_prog_file",
         type=str,
-        help="""Input file for the clade progression. File format should be .tsv
-        Pass a random string if setting -genc False""",
+        nargs="?",
+        help="""Input file for the clade progression. File format should be .tsv, archive.tar::member reads it out of a tar archive
+        Pass a random string if setting -genc False. Not needed with --store""",
     )
     parser.add_argument(
         "g_file",
         metavar="geoclade_file",
         type=str,
-        help="""Input file for the geo clade progression. File format should be .tsv
-        Pass a random string if setting -geng False""",
+        nargs="?",
+        help="""Input file for the geo clade progression. File format should be .tsv, archive.tar::member reads it out of a tar archive
+        Pass a random string if setting -geng False. Not needed with --store""",
     ),
+    parser.add_argument(
+        "--store",
+        "-s",
+        dest="store",
+        type=str,
+        help="Draws both graphs from a store written by clade_store.py or gisaid_ingest.py instead of the tsv files",
+    )
+    parser.add_argument(
+        "--periods",
+        dest="periods",
+        type=int,
+        default=0,
+        help="With --store, number of latest periods of the clade progression graph. Default 0 for all of them",
+    )
+    parser.add_argument(
+        "--geo-periods",
+        dest="geo_periods",
+        type=int,
+        default=1,
+        help="With --store, number of latest periods counted by the geoclade graph. Default 1",
+    )
     parser.add_argument(
         "--c_out",
         "-co",
         type=str,
         metavar="",
         dest="c_out",
-        default="./clade_prog.png",
-        help="The output path of the clade progression graph. Must include file format. E.g. './clade_prog.png'",
+        action="append",
+        help="The output path of the clade progression graph. Must include file format. E.g. './clade_prog.png'. Repeat to also save it in other formats. Default ./clade_prog.png",
     )
     parser.add_argument(
         "--g_out",
@@ -547,8 +617,8 @@ def _parse_args():
         type=str,
         metavar="",
         dest="g_out",
-        default="./geoclade.png",
-        help="The output path of the GeoClade progression graph. Must include file format. E.g. './outg.png'",
+        action="append",
+        help="The output path of the GeoClade progression graph. Must include file format. E.g. './outg.png'. Repeat to also save it in other formats. Default ./geoclade.png",
     )
     parser.add_argument(
         "--genc",
@@ -572,15 +642,85 @@ def _parse_args():
         action="store_true",
         help="Uses 3d stack area plot instead of regular 3d plot",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--workers",
+        "-j",
+        dest="workers",
+        type=int,
+        default=min(2, os.cpu_count() or 1),
+        help="Number of processes drawing the graphs at the same time. 1 draws them one after the other in this process. Default 2, or 1 on a single core",
+    )
+    args = parser.parse_args()
+    if not args.store and ((args.gc and not args.c_file) or (args.gg and not args.g_file)):
+        parser.error("the clade_prog_file and geoclade_file are required without --store")
+    args.c_out = args.c_out or ["./clade_prog.png"]
+    args.g_out = args.g_out or ["./geoclade.png"]
+    return args
+
+
+class Chart(NamedTuple):
+    """
+    A graph to draw
+
+    Attributes:
+
+        - name (str): The name reported with its timing
+        - function (Callable): Draws and saves the graph, e.g. `generate_clade_progression` or `store_geoclade_progression`
+        - args (Tuple): The arguments of [function]
+    """
+    name: str
+    function: Callable
+    args: Tuple
+
+
+def use_agg():
+    """
+    Switches matplotlib to the non-interactive Agg backend and imports pyplot, so that the first chart does not pay for it
+    """
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot  # noqa: F401
+
+
+def _draw_chart(chart: Chart) -> float:
+    start = time.perf_counter()
+    chart.function(*chart.args)
+    return time.perf_counter() - start
+
+
+def draw_charts(charts: List[Chart], workers: int) -> List[float]:
+    """
+    Draws every chart of [charts], each in its own process when [workers] > 1
+
+    Returns:
+
+        - List[float]: The seconds taken by each chart
+    """
+    if workers <= 1 or len(charts) <= 1:
+        use_agg()
+        return [_draw_chart(chart) for chart in charts]
+    with ProcessPoolExecutor(max_workers=min(workers, len(charts)), initializer=use_agg) as pool:
+        return list(pool.map(_draw_chart, charts))
 
 
 def main():
     args = _parse_args()
-    if args.gc:
-        generate_clade_progression(args.c_file, args.c_out, args.c3d)
-    if args.gg:
-        generate_geoclade_progression(args.g_file, args.g_out)
+    charts = []
+    if args.store:
+        if args.gc:
+            charts.append(Chart("clade progression", store_clade_progression, (args.store, args.c_out, args.c3d, args.periods)))
+        if args.gg:
+            charts.append(Chart("geoclade", store_geoclade_progression, (args.store, args.g_out, args.geo_periods)))
+    else:
+        if args.gc:
+            charts.append(Chart("clade progression", generate_clade_progression, (args.c_file, args.c_out, args.c3d)))
+        if args.gg:
+            charts.append(Chart("geoclade", generate_geoclade_progression, (args.g_file, args.g_out)))
+    start = time.perf_counter()
+    for chart, seconds in zip(charts, draw_charts(charts, args.workers)):
+        print(f"{chart.name}: {seconds:.2f}s -> {', '.join(chart.args[1])}")
+    print(f"Time taken: {time.perf_counter() - start:.2f}s")
 
 
 if __name__ == "__main__":
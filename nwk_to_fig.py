@@ -1,59 +1,200 @@
+import io
+import os
 import re
+import mmap
+import heapq
+import locale
 import argparse
 import datetime
-from typing import List, Union
-from io import TextIOWrapper
-from ete3 import Tree, TreeNode
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, Iterator, List, TextIO, Tuple
 
+from compact_tree import DELIMITERS, iter_leaf_names, read_newick_chunks
+from extractor import is_member, open_input
 
-def convert_to_nexus(file: str, out: str, setting_path: str, is_quoted:bool):
+MAX_TAXA_IN_MEMORY = 1_000_000
+RANGE_SIZE = 64 * 1024 ** 2
+LABEL_RE = re.compile(r"'|\)(\d+)")
+
+
+def convert_to_nexus(file: str, out: str, setting_path: str, is_quoted: bool, max_taxa_in_memory: int = MAX_TAXA_IN_MEMORY, workers: int = 1):
+    """
+    Converts the newick tree at [file] into a FigTree NEXUS file, reading [file] only once.
+
+    The tree is rewritten chunk by chunk into spool files next to the output while its taxa are collected.
+    Taxa are sorted in memory up to [max_taxa_in_memory], beyond which sorted runs are spilled to disk and merged.
+
+    Args:
+        - file(str): the path to the newick tree
+        - out(str): the output path, today's date + '_Full' is appended to it
+        - setting_path(str): the path to the figtree settings block
+        - is_quoted(bool): whether taxon names are surrounded by quotes, which are then removed
+        - max_taxa_in_memory(int): number of taxa to hold in memory before spilling them to disk
+        - workers(int): number of processes rewriting byte ranges of [file] in parallel. 1 reads it serially
+    """
     out += f'{datetime.date.today().strftime("%Y-%m-%d")}_Full'
-    taxon_out = get_taxons_out(file, is_quoted)
-    write_to_file(taxon_out, out, write=True)
-    tree_txt = get_figtree(file)
-    write_to_file(tree_txt, out)
-    settings = get_settings(setting_path)
-    write_to_file(settings, out)
-
-
-def get_taxons_out(file: str, is_quoted:bool):
-    def build_taxon_format(taxons: List[str]):
-        taxons.sort()
-        out = f"#NEXUS\nbegin taxa;\n\tdimensions ntax={len(taxons)};\n\ttaxlabels\n"
-        for taxon in taxons:
-            if is_quoted:
-                out += f"\t{taxon[1:-1]}\n"
-            else:
-                out+= f"\t{taxon}\n"
-        out += f";\nend;\n\n"
-        return out
-
-    def get_taxons(tree: TreeNode):
-        taxons = []
-        for leaf in tree.iter_leaf_names():
-            taxons.append(leaf)
-        return taxons
-
-    tree = Tree(newick=file,)
-    taxons = get_taxons(tree)
-    output = build_taxon_format(taxons)
-    return output
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(out))) as tmp:
+        # Members of a tar archive can only be read in order
+        if workers > 1 and not is_member(file) and os.path.getsize(file) > 0:
+            ntax, runs, taxons, parts = rewrite_parallel(file, tmp, is_quoted, max_taxa_in_memory, workers)
+        else:
+            ntax, runs, taxons, parts = rewrite_serial(file, tmp, is_quoted, max_taxa_in_memory)
+
+        with open(out, "w") as f:
+            write_taxon_format(f, ntax, heapq.merge(*[read_run(run) for run in runs], taxons), is_quoted)
+            f.write("begin trees;\n\ttree tree_1 = [&R] ")
+            for part in parts:
+                with open(part, "r", encoding="utf-8", newline="") as spool:
+                    for block in iter(lambda: spool.read(1 << 20), ""):
+                        f.write(block)
+            f.write("end;\n\n")
+            f.write(get_settings(setting_path))
+
+
+def rewrite_serial(file: str, tmp: str, is_quoted: bool, max_taxa_in_memory: int) -> Tuple[int, List[str], List[str], List[str]]:
+    """
+    Rewrites [file] into a spool file in [tmp] and collects its taxa in a single pass
+
+    Returns:
+        - Tuple[int, List[str], List[str], List[str]]: the number of taxa, the sorted runs of taxa on disk,
+            the sorted taxa left in memory and the spool files holding the rewritten tree, in order
+    """
+    tree_spool = os.path.join(tmp, "tree")
+    with open_input(file, "r") as f, open(tree_spool, "w", encoding="utf-8", newline="") as spool:
+        chunks = rewrite_chunks(read_newick_chunks(f, is_quoted), spool)
+        ntax, runs, taxons = sort_taxons(iter_leaf_names(chunks), tmp, max_taxa_in_memory)
+    return ntax, runs, taxons, [tree_spool]
+
+
+def rewrite_parallel(file: str, tmp: str, is_quoted: bool, max_taxa_in_memory: int, workers: int, range_size: int = RANGE_SIZE) -> Tuple[int, List[str], List[str], List[str]]:
+    """
+    Rewrites [file] with a pool of [workers] processes, each handling byte ranges that start on a delimiter.
+
+    Gives the same result as `rewrite_serial`, see it for the return value.
+    """
+    ranges = split_ranges(file, max(workers, -(-os.path.getsize(file) // range_size)), is_quoted)
+    tasks = [(file, start, end, os.path.join(tmp, f"part{i}"), max_taxa_in_memory) for i, (start, end) in enumerate(ranges)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_rewrite_range, tasks))
+    ntax = sum(count for count, _ in results)
+    runs = [run for _, part_runs in results for run in part_runs]
+    return ntax, runs, [], [task[3] for task in tasks]
+
+
+def split_ranges(file: str, count: int, is_quoted: bool) -> List[Tuple[int, int]]:
+    """
+    Splits [file] into about [count] byte ranges that each start right before one of "(),;", outside of quotes
+    """
+    with open(file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        size = len(mm)
+        bounds = [0]
+        for i in range(1, count):
+            cut = _next_delimiter(mm, max(size * i // count, bounds[-1] + 1))
+            while is_quoted and cut < size and _count_quotes(mm, bounds[-1], cut) % 2:
+                cut = _next_delimiter(mm, cut + 1)
+            if cut >= size:
+                break
+            bounds.append(cut)
+        bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _next_delimiter(mm: mmap.mmap, start: int) -> int:
+    found = [mm.find(delimiter.encode(), start) for delimiter in DELIMITERS]
+    return min([pos for pos in found if pos >= 0], default=len(mm))
+
+
+def _count_quotes(mm: mmap.mmap, start: int, end: int) -> int:
+    return sum(mm[pos : min(pos + RANGE_SIZE, end)].count(b"'") for pos in range(start, end, RANGE_SIZE))
+
+
+def _rewrite_range(task: Tuple[str, int, int, str, int]) -> Tuple[int, List[str]]:
+    """
+    Rewrites one byte range of the newick file into [part], and spills its sorted taxa next to it
+
+    Returns:
+        - Tuple[int, List[str]]: the number of taxa in the range and the paths of their sorted runs
+    """
+    file, start, end, part, max_taxa_in_memory = task
+    with open(file, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        text = mm[start:end].decode(locale.getpreferredencoding(False))
+    # Matches reading the file in text mode, ranges never split a "\r\n" since they start on a delimiter
+    text = text.replace("\r\n", "\n").replace("\r", "\n")
+    with open(part, "w", encoding="utf-8", newline="") as spool:
+        spool.write(rewrite_labels(text))
+    count, runs, taxons = sort_taxons(iter_leaf_names([text]), os.path.dirname(part), max_taxa_in_memory, prefix=os.path.basename(part))
+    if taxons:
+        runs.append(_write_run(os.path.join(os.path.dirname(part), f"{os.path.basename(part)}-run{len(runs)}"), taxons))
+    return count, runs
+
+
+def rewrite_labels(text: str) -> str:
+    """
+    Strips single quotes and turns every `)NNN` support label into `)[&label=NNN]`
+    """
+    return LABEL_RE.sub(lambda match: "" if match.group(1) is None else f")[&label={match.group(1)}]", text)
+
+
+def rewrite_chunks(chunks: Iterable[str], spool: TextIO) -> Iterator[str]:
+    """
+    Writes the rewritten form of every chunk to [spool] as it passes them on
+    """
+    for chunk in chunks:
+        spool.write(rewrite_labels(chunk))
+        yield chunk
+
+
+def sort_taxons(taxons: Iterable[str], run_dir: str, max_in_memory: int, prefix: str = "") -> Tuple[int, List[str], List[str]]:
+    """
+    Sorts [taxons], spilling sorted runs of [max_in_memory] taxa into [run_dir]
+
+    Returns:
+        - Tuple[int, List[str], List[str]]: the number of taxa, the paths of the runs on disk and the sorted taxa left in memory
+    """
+    count, runs, batch = 0, [], []
+    for taxon in taxons:
+        batch.append(taxon)
+        count += 1
+        if len(batch) >= max_in_memory:
+            batch.sort()
+            runs.append(_write_run(os.path.join(run_dir, f"{prefix}-run{len(runs)}"), batch))
+            batch = []
+    batch.sort()
+    return count, runs, batch
+
+
+def _write_run(path: str, taxons: List[str]) -> str:
+    with open(path, "w", encoding="utf-8", newline="") as f:
+        f.writelines(f"{taxon}\n" for taxon in taxons)
+    return path
+
+
+def read_run(path: str) -> Iterator[str]:
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        for line in f:
+            yield line[:-1]
+
+
+def write_taxon_format(f: TextIO, ntax: int, taxons: Iterable[str], is_quoted: bool):
+    f.write(f"#NEXUS\nbegin taxa;\n\tdimensions ntax={ntax};\n\ttaxlabels\n")
+    for taxon in taxons:
+        f.write(f"\t{taxon[1:-1]}\n" if is_quoted else f"\t{taxon}\n")
+    f.write(";\nend;\n\n")
+
+
+def get_taxons_out(file: str, is_quoted: bool):
+    with open_input(file, "r") as f:
+        taxons = sorted(iter_leaf_names(read_newick_chunks(f)))
+    out = io.StringIO()
+    write_taxon_format(out, len(taxons), taxons, is_quoted)
+    return out.getvalue()
 
 
 def get_figtree(file: str):
-    with open(file, "r") as f:
-        tree_txt = f.read()
-    result = ""
-    last_loc = 0
-    for i, match in enumerate(re.finditer(r"'|\)\d+", tree_txt)):
-        result += f"{tree_txt[last_loc:match.start()]}"
-        if tree_txt[match.start() : match.end()] != "'":
-            result += f"{tree_txt[match.start():match.start()+ 1]}"
-            result += f"[&label={tree_txt[match.start() +1: match.end()]}]"
-        last_loc = match.end()
-    result += tree_txt[last_loc:]
-    result = f"begin trees;\n\ttree tree_1 = [&R] " + result + f"end;\n\n"
-    return result
+    with open_input(file, "r") as f:
+        result = "".join(rewrite_labels(chunk) for chunk in read_newick_chunks(f))
+    return f"begin trees;\n\ttree tree_1 = [&R] " + result + f"end;\n\n"
 
 
 def get_settings(setting_path: str):
@@ -80,7 +221,7 @@ def _parse_arg():
         type=str,
         dest="i",
         default="./input.nwk",
-        help="The path to the input file. Remember to include filename and extension! Defaults to ./input.nwk",
+        help="The path to the input file. Remember to include filename and extension! archive.tar::member reads it straight out of a tar archive. Defaults to ./input.nwk",
     )
     parser.add_argument(
         "--output",
@@ -105,9 +246,24 @@ def _parse_arg():
         action = "store_true",
         help="Use if the taxon name for newick files contains quotes"
     )
+    parser.add_argument(
+        "--max-taxa-in-memory",
+        dest="max_taxa_in_memory",
+        type=int,
+        default=MAX_TAXA_IN_MEMORY,
+        help=f"Number of taxa sorted in memory before they are spilled to disk. Default {MAX_TAXA_IN_MEMORY}",
+    )
+    parser.add_argument(
+        "--workers",
+        "-w",
+        dest="workers",
+        type=int,
+        default=1,
+        help="Number of processes rewriting the tree in parallel, useful for multi-gigabyte files. Default 1",
+    )
     return parser.parse_args()
 
 
 if __name__ == "__main__":
     args = _parse_arg()
-    convert_to_nexus(args.i, args.o, args.setting_path, args.is_quoted)
+    convert_to_nexus(args.i, args.o, args.setting_path, args.is_quoted, args.max_taxa_in_memory, args.workers)
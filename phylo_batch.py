@@ -0,0 +1,171 @@
+import argparse
+import contextlib
+import io
+import shlex
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import phylo_updated
+
+
+class BatchResult(NamedTuple):
+    """
+    Outcome of one tree of the batch
+
+    Attributes:
+
+        - file (str): The newick file
+        - out (str): The images written
+        - seconds (float): Time spent on the tree
+        - error (str): The traceback if the tree failed, empty otherwise
+        - log (str): Everything printed while handling the tree
+    """
+    file: str
+    out: str
+    seconds: float
+    error: str
+    log: str
+
+
+def read_manifest(path: str) -> List[List[str]]:
+    """
+    Reads a manifest listing one tree per line, as the arguments `phylo_updated.py` would take for it.
+
+    Blank lines and lines starting with # are skipped.
+    E.g.
+
+        fasttree.nwk -rf -o fasttree.png
+        iqtree.nwk -q -iq -o iqtree.png
+    """
+    entries = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                entries.append(shlex.split(line))
+    return entries
+
+
+def run_entry(task: Tuple[argparse.Namespace, Dict[str, List]]) -> BatchResult:
+    """
+    Renders one tree, catching any failure so the rest of the batch carries on
+    """
+    args, clade_details = task
+    log = io.StringIO()
+    start = time.time()
+    error = ""
+    with contextlib.redirect_stdout(log):
+        try:
+            phylo_updated.run(args, clade_details)
+        except Exception:
+            error = traceback.format_exc()
+    return BatchResult(args.file, ", ".join(args.out), time.time() - start, error, log.getvalue())
+
+
+def _run_pool(tasks: List[Tuple[argparse.Namespace, Dict[str, List]]], workers: int) -> List[Optional[BatchResult]]:
+    """
+    Renders [tasks] in a pool of [workers] processes
+
+    Returns:
+
+        - List[Optional[BatchResult]]: The outcome of each task, None for those lost when a worker process died,
+          e.g. killed for running out of memory or crashed in Qt
+    """
+    results = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_entry, task) for task in tasks]
+        for task, future in zip(tasks, futures):
+            try:
+                results.append(future.result())
+            except BrokenProcessPool:
+                results.append(None)
+            except Exception:
+                args = task[0]
+                results.append(BatchResult(args.file, ", ".join(args.out), 0.0, traceback.format_exc(), ""))
+    return results
+
+
+def run_batch(entries: List[List[str]], shared: List[str] = None, workers: int = 1) -> List[BatchResult]:
+    """
+    Renders every tree of [entries] in a pool of [workers] processes
+
+    Args:
+
+        - entries (List[List[str]]): The `phylo_updated.py` arguments of each tree, as from `read_manifest`
+        - shared (List[str]): Arguments common to all trees, placed before those of each entry so entries can override them
+        - workers (int): The number of trees rendered at the same time
+
+    Returns:
+
+        - List[BatchResult]: The outcome of each tree, in the order of [entries]
+    """
+    results = [None] * len(entries)
+    tasks, indices = [], []
+    # Each clade json is read once for the whole batch
+    clade_details = {}
+    for i, entry in enumerate(entries):
+        try:
+            args = phylo_updated._parse_args((shared or []) + entry)
+            path = args.clade_color_density_coverage
+            if path not in clade_details:
+                clade_details[path] = phylo_updated.load_clade_details(path)
+        except (Exception, SystemExit):
+            results[i] = BatchResult(entry[0] if entry else "", "", 0.0, traceback.format_exc(), "")
+            continue
+        tasks.append((args, clade_details[path]))
+        indices.append(i)
+
+    for i, task, result in zip(indices, tasks, _run_pool(tasks, workers)):
+        if result is None:
+            # A dead worker takes down every tree still in the pool, so each of them is retried in a pool of its own
+            result = _run_pool([task], 1)[0]
+        if result is None:
+            args = task[0]
+            result = BatchResult(args.file, ", ".join(args.out), 0.0, "The process rendering the tree died, e.g. out of memory\n", "")
+        results[i] = result
+    return results
+
+
+def print_summary(results: List[BatchResult]):
+    for result in results:
+        print(f"----- {result.file} -----")
+        print(result.log, end="")
+        if result.error:
+            print(result.error, end="")
+    print(f"{'tree':<40} {'status':<8} {'seconds':>8}  output")
+    for result in results:
+        print(f"{result.file:<40} {'FAILED' if result.error else 'ok':<8} {result.seconds:>8.2f}  {result.out}")
+
+
+def _parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Generates the hcov-19 Phylogentic trees listed in a manifest with a pool of processes. Any other option is passed to phylo_updated.py for every tree",
+        epilog="If you notice any issues, please open one over at https://github.com/ElasticBottle/GISAID-Analysis-Update ",
+    )
+    parser.add_argument(
+        "manifest",
+        type=str,
+        help="file listing one tree per line, as the arguments phylo_updated.py would take for it",
+    )
+    parser.add_argument(
+        "-j",
+        "--workers",
+        dest="workers",
+        default=1,
+        type=int,
+        help="Number of trees rendered at the same time. Default 1",
+    )
+    return parser.parse_known_args()
+
+
+if __name__ == "__main__":
+    args, shared = _parse_args()
+    results = run_batch(read_manifest(args.manifest), shared, args.workers)
+    print_summary(results)
+    if any(result.error for result in results):
+        sys.exit(1)
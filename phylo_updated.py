@@ -1,14 +1,23 @@
 import argparse
 import os
+import re
 import json
 import time
-from functools import partial
-from typing import Dict, List, Tuple, Union
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Iterator, List, NamedTuple, Optional, Tuple, Union
 
 import numpy as np
-import pandas as pd
 
-from ete3 import NodeStyle, Tree, TreeNode, TreeStyle
+import compact_tree
+import tree_cache
+from clade_classifier import CladeClassifier, get_classifier
+from compact_tree import CompactTree
+from profiling import StageProfiler
+from svg_render import NodePaint, Wedge, render_svgs
+
+# ete3 pulls in Qt, which takes seconds to import, so it is only imported once a tree is drawn with it
+if TYPE_CHECKING:
+    from ete3 import NodeStyle, TreeNode, TreeStyle
 
 ALT_NAME = 0
 CLADE_COL= 0
@@ -16,40 +25,92 @@ MIN_DENSITY = 1
 MAX_DENSITY= 2
 MIN_COV = 3
 MAX_COV = 4
+LINE_COLOR = "#343434"
+LINE_WIDTH = 2
+ROOT_OPENING_FACTOR = 0.04
+STAGES = ["parse", "clade_count", "root_on", "node_details", "max_ancestors", "to_ete3", "color_taxons", "color_clades", "render"]
+# Shared NodeStyles by (line color, line width, bgcolor), see `node_style`
+_NODE_STYLES = {}  # type: Dict[Tuple[str, int, Optional[str]], "NodeStyle"]
+OUTPUT_SPEC = re.compile(r"^(?P<path>.+?)(?:@(?P<dpi>\d+))?(?::(?P<width>\d+))?$")
+
+
+class Output(NamedTuple):
+    """
+    An image to write, from an `-o path[@dpi][:width]` option
+    """
+    path: str
+    dpi: int
+    width: int
+
+
+def parse_output(spec: str, dpi: int, width: int) -> Output:
+    """
+    Parses [spec] in the `path[@dpi][:width]` format, falling back on [dpi] and [width] for the parts left out
+    """
+    match = OUTPUT_SPEC.match(spec)
+    return Output(
+        path=match.group("path"),
+        dpi=int(match.group("dpi")) if match.group("dpi") else dpi,
+        width=int(match.group("width")) if match.group("width") else width,
+    )
+
+def tree_style() -> "TreeStyle":
+    from ete3 import TreeStyle
 
-def tree_style() -> TreeStyle:
     style = TreeStyle()
     style.mode = "c"  # draw tree in circular mode
     # style.scale = 20
     # style.branch_vertical_margin = 15
-    style.root_opening_factor = 0.04
+    style.root_opening_factor = ROOT_OPENING_FACTOR
     style.show_leaf_name = False
     style.show_branch_length = False
     style.show_branch_support = False
     return style
 
 
-def node_style(color: str = None) -> NodeStyle:
-    style = NodeStyle()
-    style["fgcolor"] = "#0f0f0f"
-    style["size"] = 0
-    style["shape"] = "circle"
-    style["vt_line_color"] = color if color is not None else "#343434"
-    style["hz_line_color"] = color if color is not None else "#343434"
-    style["vt_line_type"] = 0  # 0 solid, 1 dashed, 2 dotted
-    style["hz_line_type"] = 0
-    style["vt_line_width"] = 2 if color is None else 0
-    style["hz_line_width"] = 2 if color is None else 0
-    return style
+def node_style(color: str = None, bg_color: str = None) -> "NodeStyle":
+    """
+    Returns the style of nodes drawn with [color] lines, or the default line color, over a [bg_color] background.
+
+    Styles are interned: every node with the same line color, line width and background shares one NodeStyle,
+    so they must not be modified in place. Use `node_bg_style` for a style with another background.
+    """
+    line_color = color if color is not None else LINE_COLOR
+    line_width = LINE_WIDTH if color is None else 0
+    return _interned_style(line_color, line_width, bg_color)
 
 
-def node_bg_style(style: Dict, bg_color: str = None):
-    style["bgcolor"] = bg_color
+def node_bg_style(style: "NodeStyle", bg_color: str = None) -> "NodeStyle":
+    """
+    Returns the interned style of [style] over a [bg_color] background, leaving [style] untouched
+    """
+    return _interned_style(style["hz_line_color"], style["hz_line_width"], bg_color)
+
+
+def _interned_style(line_color: str, line_width: int, bg_color: Optional[str]) -> "NodeStyle":
+    key = (line_color, line_width, bg_color)
+    style = _NODE_STYLES.get(key)
+    if style is None:
+        from ete3 import NodeStyle
+
+        style = NodeStyle()
+        style["fgcolor"] = "#0f0f0f"
+        style["size"] = 0
+        style["shape"] = "circle"
+        style["vt_line_color"] = line_color
+        style["hz_line_color"] = line_color
+        style["vt_line_type"] = 0  # 0 solid, 1 dashed, 2 dotted
+        style["hz_line_type"] = 0
+        style["vt_line_width"] = line_width
+        style["hz_line_width"] = line_width
+        if bg_color is not None:
+            style["bgcolor"] = bg_color
+        style = _NODE_STYLES.setdefault(key, style)
     return style
 
 
-def _parse_args():
-    """Parse command-line arguments."""
+def _parse_args(argv: List[str] = None):
+    """Parse command-line arguments, from [argv] if given instead of sys.argv."""
     parser = argparse.ArgumentParser(
         description="Generates hcov-19 Phylogentic tree based on GISAID bi-weekly analysis update",
         epilog="If you notice any issues, please open one over at https://github.com/ElasticBottle/GISAID-Analysis-Update ",
@@ -58,7 +119,7 @@ def _parse_args():
         "file",
         type=str,
         default="",
-        help="file path of the NEWICK tree to parse",
+        help="file path of the NEWICK tree to parse, or archive.tar::member to read it straight out of a tar archive",
     )
     parser.add_argument(
         "-o",
@@ -66,8 +127,11 @@ def _parse_args():
         type=str,
         dest="out",
         metavar="",
-        default="./out.png",
-        help="The output path of the image to be stored. Default ./out.png. Script assumes extension is 3 letters long, .png, .svg etc.",
+        action="append",
+        help="""The output path of the image to be stored. Default ./out.png. Script assumes extension is 3 letters long, .png, .svg etc.
+
+        Can be given several times, the tree is then laid out once and written to each of them.
+        Append @dpi and/or :width to override --dpi and --width for one output, e.g. -o tree.svg -o tree.png@300 -o thumb.png@72:800""",
     )
     parser.add_argument(
         "--dpi",
@@ -146,12 +210,171 @@ def _parse_args():
         action="store_const",
         help="Sets the marker to split on for iqtree for extracting color information. DO NOT use -cm or -rf with this option",
     )
-    args = parser.parse_args()
+    parser.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        type=str,
+        help="Directory to cache the parsed tree in. Later runs on the same NEWICK file skip parsing. Disabled by default",
+    )
+    parser.add_argument(
+        "--cache-size",
+        dest="cache_size",
+        default=2048,
+        type=int,
+        help="Size limit of the cache directory in MB, least recently used trees are removed first. Default 2048",
+    )
+    parser.add_argument(
+        "--renderer",
+        dest="renderer",
+        choices=["ete3", "svg"],
+        default="ete3",
+        help="ete3 draws the tree with Qt in any format ete3 supports. svg writes an SVG directly, much faster and lighter on memory for large trees. Default ete3",
+    )
+    parser.add_argument(
+        "--collapse",
+        dest="collapse",
+        action="store_true",
+        help="Draws each clade as a single wedge labelled with its counts, only the nodes outside of the clades are drawn in full. Needs --renderer svg",
+    )
+    parser.add_argument(
+        "--no-render",
+        dest="no_render",
+        action="store_true",
+        help="Only prints the node picked for each clade, without drawing the tree or loading ete3 and Qt",
+    )
+    parser.add_argument(
+        "--profile",
+        dest="profile",
+        type=str,
+        help="Writes the wall time, CPU time and peak memory of each stage of the run to this json file",
+    )
+    parser.add_argument(
+        "--cprofile",
+        dest="cprofile",
+        type=str,
+        choices=STAGES,
+        help="Runs this stage under cProfile and dumps its stats to <stage>.prof",
+    )
+    args = parser.parse_args(argv)
+    if args.out is None:
+        args.out = ["./out.png"]
+    args.outputs = [parse_output(spec, args.dpi, args.width) for spec in args.out]
+    if args.collapse and args.renderer != "svg":
+        parser.error("--collapse needs --renderer svg")
+    if args.renderer == "svg" and any(not output.path.lower().endswith(".svg") for output in args.outputs):
+        parser.error("--renderer svg only writes .svg outputs")
     return args
 
 
 def main():
-    args = _parse_args()
+    run(_parse_args())
+
+
+def load_clade_details(path: str) -> Dict[str, List]:
+    """
+    Reads the json file mapping clade names to either: Alternate name || [colour, density, min_coverage, max_coverage]
+    """
+    with open(path) as f:
+        return json.load(f)
+
+
+class PreparedTree(NamedTuple):
+    """
+    A classified tree, rooted and counted, ready for picking the node of each clade, see `prepare_tree`
+
+    Attributes:
+
+        - tree (CompactTree): The tree, rerooted if asked to
+        - counts (np.ndarray): nodes x labels clade counts of [tree]
+        - classifier (CladeClassifier): The classifier of the leaves, its labels are the columns of [counts]
+        - clade_counts (Dict[str, int]): The number of leaves of each clade present in the tree
+    """
+    tree: CompactTree
+    counts: np.ndarray
+    classifier: CladeClassifier
+    clade_counts: Dict[str, int]
+
+
+@contextmanager
+def _unprofiled(name: str) -> Iterator[None]:
+    yield
+
+
+def parse_tree(file: str, is_quoted: bool, classifier: CladeClassifier, cache_dir: str = None, cache_bytes: int = tree_cache.DEFAULT_CACHE_SIZE) -> CompactTree:
+    """
+    Parses the tree at [file] and classifies its leaves with [classifier], through the cache in [cache_dir] if given
+
+    Args:
+
+        - file (str): The path to the NEWICK file
+        - is_quoted (bool): Whether the names are surrounded by quotes
+        - classifier (CladeClassifier): The classifier of the clades in use
+        - cache_dir (str): Directory the parsed tree is cached in, see `tree_cache.load_newick`. None to always parse it
+        - cache_bytes (int): Size limit of [cache_dir] in bytes
+
+    Returns:
+
+        - CompactTree: The classified tree
+    """
+    if cache_dir:
+        return tree_cache.load_newick(file, is_quoted, classifier, cache_dir=cache_dir, max_bytes=cache_bytes)
+    return compact_tree.classify(compact_tree.parse_newick(file, is_quoted=is_quoted), classifier)
+
+
+def prepare_tree(tree: CompactTree, classifier: CladeClassifier, clade_details: Dict[str, List], root_on: str = None, profiler: StageProfiler = None) -> PreparedTree:
+    """
+    Counts the clades under each node of [tree] and roots it on the clade [root_on].
+
+    Args:
+
+        - tree (CompactTree): The parsed tree. If its leaves are classified already, it must be with [classifier]
+        - classifier (CladeClassifier): The classifier of the clades of [clade_details]
+        - clade_details (Dict[str, List]): The [color, min_density, max_density, min_coverage, max_coverage] of each clade
+        - root_on (str): The clade to root the tree on, None to keep the root of the file
+        - profiler (StageProfiler): Records the clade_count, root_on and node_details stages, if given
+
+    Returns:
+
+        - PreparedTree: The tree, its clade counts and its classifier
+    """
+    if root_on and root_on not in clade_details:
+        raise Exception(f"Cannot root on {root_on}, it is not one of the clades")
+    stage = profiler.stage if profiler is not None else _unprofiled
+    with stage("clade_count"):
+        if tree.clade is None:
+            tree = compact_tree.classify(tree, classifier)
+        counts = compact_tree.node_clade_counts(tree, len(classifier.labels))
+        clade_counts = {label: int(count) for label, count in zip(classifier.labels, counts[0]) if count}
+    if root_on:
+        with stage("root_on"):
+            outgroup = get_compact_max_ancestors(
+                tree,
+                counts,
+                labels=classifier.labels,
+                clade_details={root_on: clade_details[root_on]},
+                clade_counts=clade_counts,
+            )[root_on]
+            tree = compact_tree.set_outgroup(tree, outgroup)
+            if profiler is not None:
+                profiler.set_size(tree.size, len(tree.leaves))
+        with stage("node_details"):
+            counts = compact_tree.node_clade_counts(tree, len(classifier.labels))
+    return PreparedTree(tree, counts, classifier, clade_counts)
+
+
+def run(args: argparse.Namespace, clade_details: Dict[str, List] = None) -> float:
+    """
+    Generates the image of one tree
+
+    Args:
+
+        - args (argparse.Namespace): The options of the run, as from `_parse_args`
+        - clade_details (Dict[str, List]): The contents of the clade json file, read from args.clade_color_density_coverage if not given
+
+    Returns:
+
+        - float: The time taken in seconds
+    """
     f_slash = args.file.rfind("/")
     b_slash = args.file.rfind("\\")
     print(
@@ -159,49 +382,111 @@ def main():
     )
     if args.no_display:
         os.environ["QT_QPA_PLATFORM"] = "offscreen"
-    
-   
-    # mapping of clade names to either: Alternate name || [colour, density, min_coverage, max_coverage]
-    clade_details = {}
-    with open(args.clade_color_density_coverage) as f:
-        clade_details = json.load(f)
+
+    if clade_details is None:
+        clade_details = load_clade_details(args.clade_color_density_coverage)
     alt_names = {clade: desired_name[ALT_NAME] for clade, desired_name in clade_details.items() if len(desired_name) == 1}
     clade_list_details = {clade: col_dens_cov for clade, col_dens_cov in clade_details.items() if len(col_dens_cov) > 1}
-    clades = list(clade_list_details.keys())
 
     start = time.time()
-    tree = get_tree(file=args.file, is_quoted=args.is_quoted)
-    print(f"{len(tree.get_leaves())} taxons present")
-
-    color_taxons(tree, args.color_marker, args.offset)
-    clade_counts = get_clade_count(tree, clades = clades,alternate_names=alt_names)
-    tree = root_on(
-        tree = tree, 
-        clade = args.root_on,
-        clade_details = clade_list_details[args.root_on], 
-        clade_total = clade_counts[args.root_on],
-        clades = clades,
-        alternate_names=alt_names,
-    )
-    node_cache = get_node_details(tree, clades = clades, alternate_names = alt_names)
-    color_clades(tree, clades = clades, clade_details = clade_list_details, clade_counts=clade_counts, node_cache = node_cache)
-    tree.render(args.out, dpi=args.dpi, w=args.width, tree_style=tree_style())
+    profiler = StageProfiler(args.cprofile)
+    with profiler.stage("parse"):
+        classifier = get_classifier(list(clade_list_details), alt_names)
+        tree = parse_tree(args.file, args.is_quoted, classifier, args.cache_dir, args.cache_size * 1024 ** 2)
+        profiler.set_size(tree.size, len(tree.leaves))
+    tree, counts, classifier, clade_counts = prepare_tree(tree, classifier, clade_list_details, args.root_on, profiler)
+    print(f"{len(tree.leaves)} taxons present")
+    with profiler.stage("max_ancestors"):
+        max_ancestors = get_compact_max_ancestors(tree, counts, classifier.labels, clade_list_details, clade_counts)
+
+    if args.no_render:
+        for clade, pick in clade_picks(max_ancestors, counts, classifier.labels, clade_counts).items():
+            print(f"{clade}: node {pick['node']}, {pick['leaves']} leaves, density {pick['density']:.4f}, coverage {pick['coverage']:.4f}")
+    else:
+        collapsed = None
+        if args.collapse:
+            collapsed = collapsed_clades(max_ancestors, counts, classifier.labels, clade_list_details, clade_counts)
+        draw(tree, max_ancestors, clade_list_details, args.outputs, args.renderer, args.color_marker, args.offset, collapsed, profiler)
     end = time.time()
 
     print(f"Time taken: {end - start:.2f}s")
+    if args.profile:
+        profiler.write(args.profile, file=args.file, renderer=args.renderer)
+    return end - start
 
 
-def get_tree(file: str, is_quoted: bool) -> TreeNode:
+def draw(tree: CompactTree, max_ancestors: Dict[str, int], clade_details: Dict[str, List], outputs: List[Output], renderer: str = "ete3", color_marker: str = "", offset: int = -1, collapsed: List[Wedge] = None, profiler: StageProfiler = None):
+    """
+    Colors a rooted compact tree and writes it to every file of [outputs]
+
+    Args:
+
+        - tree (CompactTree): The rooted tree
+        - max_ancestors (Dict[str, int]): The node of each clade, as from `get_compact_max_ancestors`
+        - clade_details (Dict[str, List]): The [color, density, coverage] list of each clade
+        - outputs (List[Output]): The images to write
+        - renderer (str): "ete3" or "svg", see `_parse_args`
+        - color_marker (str): The delineator after which leaf names hold their color, see `color_taxons`
+        - offset (int): How many characters off the back of the color to chop off
+        - collapsed (List[Wedge]): Clades to draw as wedges, svg renderer only
+        - profiler (StageProfiler): Where the time of each stage is recorded, if anywhere
+    """
+    profiler = profiler if profiler is not None else StageProfiler()
+    if renderer == "svg":
+        with profiler.stage("color_taxons"):
+            paint = compact_paint(tree, color_marker, offset)
+        with profiler.stage("color_clades"):
+            for clade, node in max_ancestors.items():
+                paint.bgcolor[node] = clade_details[clade][CLADE_COL]
+        with profiler.stage("render"):
+            svg_outputs = [(output.path, output.width) for output in outputs]
+            render_svgs(tree, svg_outputs, paint, root_opening_factor=ROOT_OPENING_FACTOR, collapsed=collapsed)
+    else:
+        with profiler.stage("to_ete3"):
+            ete_tree, nodes = compact_tree.to_ete3(tree)
+        with profiler.stage("color_taxons"):
+            color_taxons(ete_tree, color_marker, offset)
+        with profiler.stage("color_clades"):
+            for clade, node in max_ancestors.items():
+                nodes[node].img_style = node_bg_style(nodes[node].img_style, clade_details[clade][CLADE_COL])
+        with profiler.stage("render"):
+            render(ete_tree, outputs, tree_style())
+
+
+def render(tree: "TreeNode", outputs: List[Output], style: "TreeStyle"):
+    """
+    Writes [tree] to every file of [outputs], laying it out only once.
+
+    Same as calling `tree.render` for each output, except that the Qt scene it builds is reused.
+    """
+    from ete3.treeview import drawer
+    from ete3.treeview.main import save
+
+    for nid, node in enumerate(tree.traverse("preorder")):
+        node.add_feature("_nid", nid)
+    scene, img = drawer.init_scene(tree, None, style)
+    tree_item, n2i, n2f = drawer.render(tree, img)
+    scene.init_values(tree, img, n2i, n2f)
+    tree_item.setParentItem(scene.master_item)
+    scene.master_item.setPos(0, 0)
+    scene.addItem(scene.master_item)
+    for output in outputs:
+        save(scene, output.path, w=output.width, dpi=output.dpi)
+
+
+def get_tree(file: str, is_quoted: bool) -> "TreeNode":
     """
     Creates a newick tree where leafs are colored base on the tag in name, and background base on the clade grouping.
 
     Args:
         - file(str): the path to the newick tree
     """
+    from ete3 import Tree
+
     tree = Tree(newick=file, quoted_node_names=is_quoted)
     return tree
 
-def color_taxons(tree: TreeNode, color_marker: str, offset:int):
+def color_taxons(tree: "TreeNode", color_marker: str, offset:int):
     """
     Sets the node style for all nodes in [tree]
 
@@ -215,12 +500,13 @@ def color_taxons(tree: TreeNode, color_marker: str, offset:int):
         - offset(int): how many characters off the back to chop off.
 
     """
+    default = node_style()
     for node in tree.traverse():
-        node.img_style = node_style()
+        node.img_style = default
         if node.is_leaf():
             color_taxon(node, color_marker=color_marker, offset= offset)
 
-def color_taxon(node:TreeNode, color_marker: str, offset: int):
+def color_taxon(node:"TreeNode", color_marker: str, offset: int):
     """
     Sets the NodeStyle for [n]
 
@@ -233,15 +519,42 @@ def color_taxon(node:TreeNode, color_marker: str, offset: int):
             Color should also be in Hex format either FFFFF or #FFFFFF
         - offset(int): how many characters off the back to chop off.
     """
-    split = node.name.split(color_marker)
+    color = taxon_color(node.name, color_marker, offset)
+    if color is not None:
+        node.img_style = node_style(color=color)
+
+def taxon_color(name: str, color_marker: str, offset: int) -> Optional[str]:
+    """
+    Returns the hex color found in [name] after [color_marker], see `color_taxon`, or None if [name] has no color
+    """
+    if not color_marker:
+        return None
+    split = name.split(color_marker)
     if len(split) > 1:
         color = split[-1][:offset]
-        if color.startswith("#"):
-            node.img_style = node_style(color=color)
-        else:
-            node.img_style = node_style(color= f"#{color}")
+        return color if color.startswith("#") else f"#{color}"
+    return None
+
+def compact_paint(tree: CompactTree, color_marker: str, offset: int) -> NodePaint:
+    """
+    Styles the nodes of [tree] for `render_svg` the same way `color_taxons` styles an ete3 tree, with no backgrounds
+
+    Args:
 
-def get_clade_count(tree:TreeNode, clades: List[str], alternate_names: Dict[str, str]) -> Dict[str, int]:
+        - tree(CompactTree): the tree to style
+        - color_marker(Str): the delineator to split taxon sequence name to extract color information
+        - offset(int): how many characters off the back to chop off.
+    """
+    color = np.full(tree.size, LINE_COLOR, dtype=object)
+    width = np.full(tree.size, float(LINE_WIDTH))
+    for leaf in tree.leaves.tolist():
+        leaf_color = taxon_color(tree.name(leaf), color_marker, offset)
+        if leaf_color is not None:
+            color[leaf] = leaf_color
+            width[leaf] = 0
+    return NodePaint(color=color, width=width, bgcolor=np.full(tree.size, None, dtype=object))
+
+def get_clade_count(tree:"TreeNode", clades: List[str], alternate_names: Dict[str, str]) -> Dict[str, int]:
     """
     Returns the total number of clades for each clade in [clades].
 
@@ -258,24 +571,13 @@ def get_clade_count(tree:TreeNode, clades: List[str], alternate_names: Dict[str,
 
         - Dict[str, int]: Maps the clade to the total number present.
     """
-    def get_belonging(leaf: TreeNode, clades: Dict[str, str]):
-        """
-        """
-        result = [clades[clade] for clade in clades.keys() if leaf.name.startswith(clade)]
-        if len(result) == 0:
-            return "other"
-        return result[0]
-    
-
-    clade_dict = {clade: clade for clade in clades}
-    clade_dict.update(alternate_names)
-
-    leaf_clades = list(map(partial(get_belonging, clades = clade_dict), tree.get_leaves()))
-    serialize = pd.Series(data = leaf_clades, dtype = str)
-    return serialize.value_counts().to_dict()
+    classifier = get_classifier(clades, alternate_names)
+    leaf_clades = classifier.classify_all(tree.iter_leaf_names())
+    counts = np.bincount(leaf_clades, minlength=len(classifier.labels))
+    return {classifier.label(col): int(counts[col]) for col in np.flatnonzero(counts)}
 
         
-def root_on(tree: TreeNode, clade: str, clade_details: List, clade_total:int, clades: List[str], alternate_names: Dict[str, str]) -> TreeNode:
+def root_on(tree: "TreeNode", clade: str, clade_details: List, clade_total:int, clades: List[str], alternate_names: Dict[str, str], clade_index: "CladeIndex" = None) -> "TreeNode":
     """
     Roots the given tree on clade
 
@@ -288,16 +590,181 @@ def root_on(tree: TreeNode, clade: str, clade_details: List, clade_total:int, cl
         - clades (List[str]): List containing the clade names
             Clade names should occur at the start of the sequence name.
         - altername_names (Dict[str, str]): Maps alternate name found in sequence to desired name.
+        - clade_index (CladeIndex): Index of [tree] to search the ancestor with. It is kept up to date with the new root.
+            Built from [clades] and [alternate_names] when not specified
         
     Returns:        
 
         - TreeNode: A tree with clade as the outgroup
     """
-    node = get_max_ancestor(tree, clade, clade_details, clade_total, clades, alternate_names)
-    tree.set_outgroup(node)
+    if clade_index is None:
+        clade_index = CladeIndex(tree, clades=clades, alternate_names=alternate_names)
+    node = get_max_ancestor(tree, clade, clade_details, clade_total, node_cache=clade_index.node_counts(tree))
+    clade_index.set_outgroup(tree, node)
     return tree
 
-def get_node_details(tree: TreeNode, clades:List[str], alternate_names: Dict[str, str]) -> Dict[TreeNode, Dict[str, int]]:
+class NodeCounts(NamedTuple):
+    """
+    Clade distribution under every node of a tree, held as a single nodes x clades matrix.
+
+    Attributes:
+
+        - nodes (List[TreeNode]): The nodes of the tree in `tree.traverse()` order. Row i of [matrix] belongs to nodes[i]
+        - index (Dict[TreeNode, int]): Maps a node to its row in [matrix]
+        - labels (List[str]): The clade names of each column in [matrix]. The last column is always "other"
+        - matrix (np.ndarray): Number of leaves of each clade under each node, leaves included
+    """
+    nodes: List["TreeNode"]
+    index: Dict["TreeNode", int]
+    labels: List[str]
+    matrix: np.ndarray
+
+    def distribution(self, node: "TreeNode") -> Dict[str, int]:
+        """
+        Returns the clade distribution under [node] in the same format as `get_clade_count`
+        """
+        row = self.matrix[self.index[node]]
+        return {self.labels[col]: int(row[col]) for col in np.flatnonzero(row)}
+
+
+def get_node_counts(tree: "TreeNode", clades: List[str], alternate_names: Dict[str, str]) -> NodeCounts:
+    """
+    Computes the clade distribution at each node of the tree in a single bottom-up pass.
+
+    Every leaf is classified once, and the count vector of each internal node is the sum of its children's.
+
+    Args:
+
+        - tree (TreeNode): The tree in which clades are to be counted for
+        - clades (List[str]): List containing the clade names
+            Clade names should occur at the start of the sequence name.
+        - altername_names (Dict[str, str]): Maps alternate name found in sequence to desired name.
+
+    Returns:
+
+        - NodeCounts: The nodes x clades count matrix of [tree]
+    """
+    classifier = get_classifier(clades, alternate_names)
+
+    nodes = list(tree.traverse())
+    index = {node: row for row, node in enumerate(nodes)}
+    matrix = np.zeros((len(nodes), len(classifier.labels)), dtype=np.int64)
+    for node in tree.traverse("postorder"):
+        row = matrix[index[node]]
+        if node.is_leaf():
+            row[classifier.classify(node.name)] = 1
+            continue
+        for child in node.children:
+            row += matrix[index[child]]
+    return NodeCounts(nodes=nodes, index=index, labels=classifier.labels, matrix=matrix)
+
+
+class CladeIndex:
+    """
+    Answers the clade distribution under any node of a tree, for any rooting of it.
+
+    Leaves are numbered in depth first order, so that the leaves under a node form the contiguous range [start, end),
+    and the distribution under the node is the difference of two prefix sums over the leaf clades.
+    Rerooting only changes the leaves under the nodes on the path between the old and the new root, their
+    distribution is the complement of the child they used to lead to, and is stored separately.
+
+    Args:
+
+        - tree (TreeNode): The tree to index
+        - clades (List[str]): List containing the clade names
+            Clade names should occur at the start of the sequence name.
+        - altername_names (Dict[str, str]): Maps alternate name found in sequence to desired name.
+    """
+
+    def __init__(self, tree: "TreeNode", clades: List[str], alternate_names: Dict[str, str]):
+        classifier = get_classifier(clades, alternate_names)
+        self.labels = classifier.labels
+
+        self._span = {}
+        leaf_clades = []
+        for node in tree.traverse("postorder"):
+            if node.is_leaf():
+                self._span[node] = (len(leaf_clades), len(leaf_clades) + 1)
+                leaf_clades.append(classifier.classify(node.name))
+            else:
+                self._span[node] = (self._span[node.children[0]][0], self._span[node.children[-1]][1])
+
+        self._prefix = np.zeros((len(leaf_clades) + 1, len(self.labels)), dtype=np.int64)
+        self._prefix[np.arange(1, len(leaf_clades) + 1), leaf_clades] = 1
+        np.cumsum(self._prefix, axis=0, out=self._prefix)
+        self.total = self._prefix[-1].copy()
+        self._fixed = {}
+
+    def vector(self, node: "TreeNode") -> np.ndarray:
+        """
+        Returns the number of leaves of each clade in [labels] under [node]
+        """
+        if node in self._fixed:
+            return self._fixed[node]
+        start, end = self._span[node]
+        return self._prefix[end] - self._prefix[start]
+
+    def clade_count(self) -> Dict[str, int]:
+        """
+        Returns the total number of leaves for each clade in the same format as `get_clade_count`
+        """
+        return {self.labels[col]: int(self.total[col]) for col in np.flatnonzero(self.total)}
+
+    def node_counts(self, tree: "TreeNode") -> NodeCounts:
+        """
+        Returns the clade distribution of every node in [tree], which must be the indexed tree under its current root
+        """
+        nodes = list(tree.traverse())
+        spans = np.array([self._span.get(node, (0, 0)) for node in nodes], dtype=np.int64).reshape(len(nodes), 2)
+        matrix = self._prefix[spans[:, 1]] - self._prefix[spans[:, 0]]
+        index = {node: row for row, node in enumerate(nodes)}
+        for node, vector in self._fixed.items():
+            if node in index:
+                matrix[index[node]] = vector
+        return NodeCounts(nodes=nodes, index=index, labels=self.labels, matrix=matrix)
+
+    def set_outgroup(self, tree: "TreeNode", outgroup: "TreeNode"):
+        """
+        Calls `tree.set_outgroup(outgroup)` and fixes up the distribution of the nodes whose leaves have changed
+
+        Args:
+
+            - tree (TreeNode): The root of the indexed tree
+            - outgroup (TreeNode): The node to set as outgroup
+        """
+        fixed = {}
+        child = outgroup
+        while child.up is not tree:
+            fixed[child.up] = self.total - self.vector(child)
+            child = child.up
+        # [tree] may group the rest of its children under a new node, which holds everything but [child]
+        connector_vector = self.total - self.vector(child)
+
+        tree.set_outgroup(outgroup)
+        self._fixed.update(fixed)
+        self._fixed[tree] = self.total
+        for node in tree.traverse():
+            if node not in self._span and node not in self._fixed:
+                self._fixed[node] = connector_vector
+
+
+def as_node_counts(node_cache: Union[NodeCounts, Dict["TreeNode", Dict[str, int]]]) -> NodeCounts:
+    """
+    Returns [node_cache] as NodeCounts, converting the distribution of each node returned by `get_node_details` if given that
+    """
+    if isinstance(node_cache, NodeCounts):
+        return node_cache
+    nodes = list(node_cache.keys())
+    labels = list(dict.fromkeys(label for distribution in node_cache.values() for label in distribution))
+    column = {label: col for col, label in enumerate(labels)}
+    matrix = np.zeros((len(nodes), len(labels)), dtype=np.int64)
+    for row, distribution in enumerate(node_cache.values()):
+        for label, count in distribution.items():
+            matrix[row, column[label]] = count
+    return NodeCounts(nodes=nodes, index={node: row for row, node in enumerate(nodes)}, labels=labels, matrix=matrix)
+
+
+def get_node_details(tree: "TreeNode", clades:List[str], alternate_names: Dict[str, str]) -> Dict["TreeNode", Dict[str, int]]:
     """
     Computes the clade distribution at each node of the tree.
 
@@ -312,14 +779,10 @@ def get_node_details(tree: TreeNode, clades:List[str], alternate_names: Dict[str
 
         - Dict[TreeNode, Dict[str, int]]: DIctionary mapping a node to the clade_distribution under it.
     """
-    result = {}
-    for node in tree.traverse():
-        if node.is_leaf():
-            continue
-        result[node] = get_clade_count(node, clades= clades, alternate_names=alternate_names)
-    return result
+    node_counts = get_node_counts(tree, clades=clades, alternate_names=alternate_names)
+    return {node: node_counts.distribution(node) for node in node_counts.nodes if not node.is_leaf()}
 
-def get_max_ancestor(tree: TreeNode, clade: Union[str, List[str]], clade_details: List, clade_total:int, clades: List[str] = None, alternate_names: Dict[str, str] = None, node_cache: Dict = None):
+def get_max_ancestor(tree: "TreeNode", clade: Union[str, List[str]], clade_details: List, clade_total:int, clades: List[str] = None, alternate_names: Dict[str, str] = None, node_cache: Union[NodeCounts, Dict["TreeNode", Dict[str, int]]] = None):
     """
     Finds the best ancestor that fulfills the clade_details
     
@@ -334,48 +797,192 @@ def get_max_ancestor(tree: TreeNode, clade: Union[str, List[str]], clade_details
             Should be specified if [node_cache] is not specified
         - alternate_names (Dict[str, str]): Maps alternate name found in sequence to desired name.
             Should be specified if [node_cache] is not specified
-        - node_cache (Dict): Maps TreeNode to the clade distribution of its descnedants.
-            Should be specified if you are coloring the tree
+        - node_cache (Union[NodeCounts, Dict[TreeNode, Dict[str, int]]]): The clade distribution of every node in [tree],
+            see `get_node_counts` or `get_node_details`. Computed in a single pass when not specified
 
     Returns:
 
         - TreeNode: The node corresponding to the best fit ancestor for the given clade
     """
-    def get_details(distribution: Dict[str, int], clade:str, clade_total: int) -> Tuple[float, float]:
-        total = sum(distribution.values())
-        clade_num = float(distribution.get(clade, 0))
-        return (clade_num / total, clade_num / clade_total)
-    
-    def get_qualifying_nodes (tree: TreeNode,clade: Union[str, List[str]], clade_total: int, clade_details: List, clades: List[str] = None, alternate_names: Dict[str, str] = None, node_cache = None, ):
-        qualifying_list = {}
-        for node in tree.traverse():
-            if node.is_leaf():
-                continue
-            
-            children_distribution = {}
-            if node_cache is None:
-                children_distribution = get_clade_count(node, clades= clades, alternate_names=alternate_names)
-            else:
-                children_distribution = node_cache[node]
-            density, coverage = get_details(children_distribution, clade, clade_total)
-            if density >= clade_details[MIN_DENSITY] and density <= clade_details[MAX_DENSITY] and coverage >= clade_details[MIN_COV] and coverage <= clade_details[MAX_COV]:
-                qualifying_list[node] = (density, coverage, density + coverage)
-        return qualifying_list
-        
-    SCORE = 2
+    if node_cache is None:
+        node_cache = get_node_counts(tree, clades=clades, alternate_names=alternate_names)
+    return get_max_ancestors(node_cache, clade_details={clade: clade_details}, clade_counts={clade: clade_total})[clade]
+
+
+def select_best_rows(matrix: np.ndarray, candidates: np.ndarray, columns: np.ndarray, thresholds: np.ndarray, clade_totals: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Finds, for every clade at once, the row of [matrix] with the highest density + coverage within the clade's thresholds.
+
+    Ties go to the last qualifying row, which is the node the previous sort based search picked.
+
+    Args:
+
+        - matrix (np.ndarray): nodes x labels clade count matrix
+        - candidates (np.ndarray): Boolean mask of the rows that may be picked
+        - columns (np.ndarray): Column of [matrix] holding each clade, -1 if the clade never occurs
+        - thresholds (np.ndarray): clades x 4 array of [min_density, max_density, min_coverage, max_coverage]
+        - clade_totals (np.ndarray): The total number of leaves belonging to each clade
+
+    Returns:
+
+        - Tuple[np.ndarray, np.ndarray, np.ndarray]: The best row for each clade (-1 when no row qualifies),
+            and the density and coverage of that row
+    """
+    best = np.full(len(columns), -1, dtype=int)
+    best_density = np.full(len(columns), np.nan)
+    best_coverage = np.full(len(columns), np.nan)
+    rows = np.flatnonzero(candidates)
+    if len(rows) == 0:
+        return best, best_density, best_coverage
+
+    counts = matrix[rows]
+    totals = counts.sum(axis=1, keepdims=True).astype(float)
+    clade_num = np.where(columns >= 0, counts[:, np.maximum(columns, 0)], 0).astype(float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        density = clade_num / totals
+        coverage = clade_num / np.asarray(clade_totals, dtype=float)
+    qualifying = (
+        (density >= thresholds[:, 0])
+        & (density <= thresholds[:, 1])
+        & (coverage >= thresholds[:, 2])
+        & (coverage <= thresholds[:, 3])
+    )
+    score = np.where(qualifying, density + coverage, -np.inf)
+
+    last = len(rows) - 1 - np.argmax(score[::-1], axis=0)
+    clade_idx = np.arange(len(columns))
+    found = qualifying[last, clade_idx]
+    best[found] = rows[last[found]]
+    best_density[found] = density[last[found], clade_idx[found]]
+    best_coverage[found] = coverage[last[found], clade_idx[found]]
+    return best, best_density, best_coverage
+
+
+def pick_max_ancestors(matrix: np.ndarray, candidates: np.ndarray, labels: List[str], clade_details: Dict[str, List], clade_counts: Dict[str, int]) -> Dict[str, int]:
+    """
+    Finds the row of [matrix] of the best ancestor that fulfills the clade_details of every clade
+
+    Args:
+
+        - matrix (np.ndarray): nodes x labels clade count matrix, with rows in `tree.traverse()` order
+        - candidates (np.ndarray): Boolean mask of the rows that may be picked, usually the internal nodes
+        - labels (List[str]): The clade names of each column in [matrix]
+        - clade_details (Dict[str, List]): Maps each clade to [color, min_density, max_density, min_coverage, max_coverage]
+        - clade_counts (Dict[str, int]): The total number leaves in the tree belonging to each clade
+
+    Returns:
+
+        - Dict[str, int]: Maps each clade to the row of its best fit ancestor
+    """
+    clades = list(clade_details.keys())
+    columns = np.array([labels.index(clade) if clade in labels else -1 for clade in clades], dtype=int)
+    thresholds = np.array(
+        [[clade_details[clade][key] for key in (MIN_DENSITY, MAX_DENSITY, MIN_COV, MAX_COV)] for clade in clades],
+        dtype=float,
+    ).reshape(len(clades), 4)
+    clade_totals = np.array([clade_counts[clade] for clade in clades], dtype=float)
+
+    best, density, coverage = select_best_rows(matrix, candidates, columns, thresholds, clade_totals)
+    result = {}
+    for i, clade in enumerate(clades):
+        if best[i] < 0:
+            raise Exception(f"Could not find any node to color for clade {clade} that fulfills criteria: {clade_details[clade]} ")
+        print(f"{clade} coverage: {coverage[i] * 100:.2f}%, density of coverage: {density[i] * 100:.2f}%")
+        result[clade] = int(best[i])
+    return result
+
+
+def get_max_ancestors(node_cache: Union[NodeCounts, Dict["TreeNode", Dict[str, int]]], clade_details: Dict[str, List], clade_counts: Dict[str, int]) -> Dict[str, "TreeNode"]:
+    """
+    Finds the best ancestor that fulfills the clade_details of every clade in a single query over [node_cache]
+
+    Args:
+
+        - node_cache (Union[NodeCounts, Dict[TreeNode, Dict[str, int]]]): The clade distribution of every node in the tree,
+            see `get_node_counts` or `get_node_details`
+        - clade_details (Dict[str, List]): Maps each clade to [color, min_density, max_density, min_coverage, max_coverage]
+        - clade_counts (Dict[str, int]): The total number leaves in the tree belonging to each clade
+
+    Returns:
+
+        - Dict[str, TreeNode]: Maps each clade to the node corresponding to its best fit ancestor
+    """
+    node_cache = as_node_counts(node_cache)
+    internal = np.array([not node.is_leaf() for node in node_cache.nodes], dtype=bool)
+    rows = pick_max_ancestors(node_cache.matrix, internal, node_cache.labels, clade_details, clade_counts)
+    return {clade: node_cache.nodes[row] for clade, row in rows.items()}
+
+
+def get_compact_max_ancestors(tree: CompactTree, counts: np.ndarray, labels: List[str], clade_details: Dict[str, List], clade_counts: Dict[str, int]) -> Dict[str, int]:
+    """
+    Finds the best ancestor that fulfills the clade_details of every clade in a compact tree.
+
+    Nodes are considered in the same order as `get_max_ancestors` does on the equivalent ete3 tree, so ties resolve the same way.
+
+    Args:
+
+        - tree (CompactTree): The tree to search
+        - counts (np.ndarray): The clade distribution of every node in [tree], see `compact_tree.node_clade_counts`
+        - labels (List[str]): The clade names of each column in [counts]
+        - clade_details (Dict[str, List]): Maps each clade to [color, min_density, max_density, min_coverage, max_coverage]
+        - clade_counts (Dict[str, int]): The total number leaves in the tree belonging to each clade
+
+    Returns:
+
+        - Dict[str, int]: Maps each clade to the index of its best fit ancestor in [tree]
+    """
+    order = compact_tree.levelorder(tree)
+    rows = pick_max_ancestors(counts[order], ~tree.is_leaf[order], labels, clade_details, clade_counts)
+    return {clade: int(order[row]) for clade, row in rows.items()}
+
+
+def clade_picks(max_ancestors: Dict[str, int], counts: np.ndarray, labels: List[str], clade_counts: Dict[str, int]) -> Dict[str, Dict]:
+    """
+    Describes the node picked for each clade in a CompactTree
+
+    Args:
+
+        - max_ancestors (Dict[str, int]): The node of each clade, as from `get_compact_max_ancestors`
+        - counts (np.ndarray): The clade counts of every node, as from `compact_tree.node_clade_counts`
+        - labels (List[str]): The clade of each column of [counts]
+        - clade_counts (Dict[str, int]): The total of each clade in the tree
+
+    Returns:
+
+        - Dict[str, Dict]: The node, number of leaves, density and coverage of each clade's node
+    """
+    picks = {}
+    for clade, node in max_ancestors.items():
+        count = int(counts[node][labels.index(clade)])
+        size = int(counts[node].sum())
+        picks[clade] = {"node": node, "leaves": size, "density": count / size, "coverage": count / clade_counts[clade]}
+    return picks
+
+
+def collapsed_clades(max_ancestors: Dict[str, int], counts: np.ndarray, labels: List[str], clade_details: Dict[str, List], clade_counts: Dict[str, int]) -> List[Wedge]:
+    """
+    Describes the wedge drawn in place of each clade's node in collapsed mode
+
+    Args:
+
+        - max_ancestors (Dict[str, int]): The node of each clade in a CompactTree, as from `get_compact_max_ancestors`
+        - counts (np.ndarray): The clade counts of every node, as from `compact_tree.node_clade_counts`
+        - labels (List[str]): The clade of each column of [counts]
+        - clade_details (Dict[str, List]): The [color, density, coverage] list of each clade
+        - clade_counts (Dict[str, int]): The total of each clade in the tree
+
+    Returns:
+
+        - List[Wedge]: One wedge per clade, labelled with the clade, its count under the node and its total
+    """
+    wedges = []
+    for clade, node in max_ancestors.items():
+        count = int(counts[node][labels.index(clade)])
+        wedges.append(Wedge(node=node, color=clade_details[clade][CLADE_COL], label=f"{clade} {count}/{clade_counts[clade]}"))
+    return wedges
 
-    qualifying_list = get_qualifying_nodes(tree, clade= clade, clade_details= clade_details, clade_total= clade_total, clades = clades, alternate_names= alternate_names, node_cache= node_cache)
-    
-    sorted_nodes = list(reversed(sorted(qualifying_list.keys(), key=lambda x: qualifying_list.get(x)[SCORE])))
-    try:
-        print(
-                f"{clade} coverage: {(qualifying_list[sorted_nodes[0]][1])* 100:.2f}%, density of coverage: {qualifying_list[sorted_nodes[0]][0] * 100:.2f}%"
-            )
-    except:
-        raise Exception(f"Could not find any node to color for clade {clade} that fulfills criteria: {clade_details} ")
-    return sorted_nodes[0]
 
-def color_clades(tree: TreeNode, clades:List[str], clade_details: Dict[str, List], clade_counts: Dict[str, int], node_cache: Dict[TreeNode, Dict[str, int]]):
+def color_clades(tree: "TreeNode", clades:List[str], clade_details: Dict[str, List], clade_counts: Dict[str, int], node_cache: Union[NodeCounts, Dict["TreeNode", Dict[str, int]]]):
     """
     Colors a single node for each item in [clades]
 
@@ -383,10 +990,11 @@ def color_clades(tree: TreeNode, clades:List[str], clade_details: Dict[str, List
 
         - tree (TreeNode): The tree in which will be rooted
         - clade (str): The clade to root tree on. Tree must contain sequence belonging to clade.
-        - clade_cache (Dict): Maps TreeNode to the clade distribution of its descnedants.
+        - node_cache (Union[NodeCounts, Dict[TreeNode, Dict[str, int]]]): The clade distribution of every node in [tree],
+            see `get_node_counts` or `get_node_details`
     """
-    for clade in clades:
-        max_ancestor = get_max_ancestor(tree, clade = clade, clade_details=clade_details[clade], clade_total=clade_counts[clade], node_cache = node_cache)
+    max_ancestors = get_max_ancestors(node_cache, clade_details={clade: clade_details[clade] for clade in clades}, clade_counts=clade_counts)
+    for clade, max_ancestor in max_ancestors.items():
         max_ancestor.img_style = node_bg_style(max_ancestor.img_style, clade_details[clade][CLADE_COL])
 if __name__ == "__main__":
     main()
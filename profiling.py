@@ -0,0 +1,136 @@
+import cProfile
+import json
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+# Linux resets the peak resident memory of a process when "5" is written here, and reports it in STATUS
+CLEAR_REFS = "/proc/self/clear_refs"
+STATUS = "/proc/self/status"
+# Highest peak seen before the last reset, which the reset also drops from getrusage
+_peak_before_reset = 0.0
+
+
+def _status_peak_mb() -> Optional[float]:
+    try:
+        with open(STATUS) as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_mb() -> Optional[float]:
+    """
+    Returns the peak resident memory of this process so far in MB, or None where the platform does not report it
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Reported in bytes on macOS and in kilobytes elsewhere
+    peak = peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+    return max(peak, _peak_before_reset)
+
+
+def reset_peak_rss() -> bool:
+    """
+    Starts measuring the peak resident memory again from the current one, see `peak_rss_since_reset_mb`.
+
+    Returns:
+
+        - bool: Whether the platform supports it, only Linux does
+    """
+    global _peak_before_reset
+    peak = _status_peak_mb()
+    if peak is None:
+        return False
+    try:
+        with open(CLEAR_REFS, "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    _peak_before_reset = max(_peak_before_reset, peak)
+    return True
+
+
+def peak_rss_since_reset_mb() -> Optional[float]:
+    """
+    Returns the peak resident memory in MB since the last `reset_peak_rss`, None where the platform does not report it
+    """
+    return _status_peak_mb()
+
+
+class StageProfiler:
+    """
+    Records the wall time, CPU time and peak memory of each named stage of a run, along with the size of the tree at the time.
+
+    The peak memory of a stage is the highest resident memory of the process during that stage alone. It is only
+    measured on Linux, and is None elsewhere.
+
+    Args:
+
+        - cprofile_stage (str): Name of a stage to also run under cProfile, if any
+        - cprofile_out (str): Where the cProfile stats of that stage are dumped
+    """
+
+    def __init__(self, cprofile_stage: str = None, cprofile_out: str = None):
+        self.stages = []
+        self.nodes = None
+        self.leaves = None
+        self.cprofile_stage = cprofile_stage
+        self.cprofile_out = cprofile_out or f"{cprofile_stage}.prof"
+        self._start = time.perf_counter()
+
+    def set_size(self, nodes: int, leaves: int):
+        """
+        Sets the node and leaf counts reported for the stages ending from now on
+        """
+        self.nodes = nodes
+        self.leaves = leaves
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        profile = cProfile.Profile() if name == self.cprofile_stage else None
+        own_peak = reset_peak_rss()
+        wall, cpu = time.perf_counter(), time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield
+        finally:
+            if profile is not None:
+                profile.disable()
+                profile.dump_stats(self.cprofile_out)
+            self.stages.append(
+                {
+                    "stage": name,
+                    "wall_s": time.perf_counter() - wall,
+                    "cpu_s": time.process_time() - cpu,
+                    "peak_rss_mb": peak_rss_since_reset_mb() if own_peak else None,
+                    "nodes": self.nodes,
+                    "leaves": self.leaves,
+                }
+            )
+
+    def report(self) -> Dict:
+        return {
+            "total_wall_s": time.perf_counter() - self._start,
+            "peak_rss_mb": peak_rss_mb(),
+            "stages": self.stages,
+        }
+
+    def write(self, path: str, **details):
+        """
+        Writes the report as json to [path], along with any extra [details] about the run
+        """
+        with open(path, "w") as f:
+            json.dump(dict(details, **self.report()), f, indent=2)
@@ -0,0 +1,260 @@
+import math
+from xml.sax.saxutils import escape
+from collections import OrderedDict
+from typing import Iterable, List, NamedTuple, TextIO, Tuple
+
+import numpy as np
+
+from compact_tree import CompactTree
+
+# Like ete3's circular mode, leaves are spread over 359 degrees to leave a gap at the start of the circle
+ARC_SPAN = 2 * math.pi * 359 / 360
+MARGIN = 0.02
+# Room left around the tree for the labels of collapsed clades
+LABEL_MARGIN = 0.15
+LABEL_GAP = 0.01
+# Qt draws 0 width lines one pixel wide
+HAIRLINE = 1
+BATCH = 10000
+
+
+class NodePaint(NamedTuple):
+    """
+    How each node of a CompactTree is drawn.
+
+    Attributes:
+
+        - color (np.ndarray): Color of the line leading to each node and of the arc joining its children
+        - width (np.ndarray): Width of those lines, 0 for a hairline
+        - bgcolor (np.ndarray): Background color of the wedge covering each node's subtree, None for no background
+    """
+    color: np.ndarray
+    width: np.ndarray
+    bgcolor: np.ndarray
+
+
+class Wedge(NamedTuple):
+    """
+    A collapsed subtree, drawn as one shaded wedge.
+
+    Attributes:
+
+        - node (int): The root of the subtree
+        - color (str): Fill color of the wedge
+        - label (str): Text written next to the wedge
+    """
+    node: int
+    color: str
+    label: str
+
+
+def circular_layout(tree: CompactTree, arc_span: float = ARC_SPAN) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the polar coordinates of every node of [tree] for a circular tree.
+
+    Leaves are spread evenly over [arc_span], each internal node sits halfway between its first and last child,
+    and the radius of a node is its distance from the root.
+
+    Returns:
+
+        - Tuple[np.ndarray, np.ndarray]: The angle, in radians, and the radius of every node
+    """
+    size = tree.size
+    is_leaf = tree.is_leaf
+    leaf_rank = np.cumsum(is_leaf) - 1
+    angle = np.zeros(size)
+    angle[is_leaf] = (leaf_rank[is_leaf] + 0.5) * arc_span / max(int(is_leaf.sum()), 1)
+
+    last_child = last_children(tree)
+    # Internal nodes grouped by depth once, deepest first, so that children are placed before their parent
+    internal = np.flatnonzero(~is_leaf)
+    internal = internal[np.argsort(-tree.depth[internal], kind="stable")]
+    bounds = np.concatenate([[0], np.cumsum(np.bincount(tree.depth[internal])[::-1])])
+    first_child = tree.first_child
+    for start, end in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        if start < end:
+            level = internal[start:end]
+            angle[level] = (angle[first_child[level]] + angle[last_child[level]]) / 2
+
+    # The distance to the root is the sum of the branch lengths of every node whose subtree holds the node
+    dist = np.where(tree.parent >= 0, tree.dist, 0.0)
+    steps = np.zeros(size + 1)
+    np.add.at(steps, np.arange(size), dist)
+    np.add.at(steps, tree.end, -dist)
+    radius = np.cumsum(steps)[:-1]
+    return angle, radius
+
+
+def last_children(tree: CompactTree) -> np.ndarray:
+    """
+    Returns the last child of every node, -1 for leaves
+    """
+    last_child = np.full(tree.size, -1, dtype=np.int64)
+    is_last = (tree.parent >= 0) & (tree.next_sibling < 0)
+    last_child[tree.parent[is_last]] = np.flatnonzero(is_last)
+    return last_child
+
+
+def render_svg(tree: CompactTree, out: str, paint: NodePaint, width: int = 5000, root_opening_factor: float = 0.0, arc_span: float = ARC_SPAN, collapsed: List[Wedge] = None):
+    """
+    Draws [tree] in circular mode straight into the SVG file [out], without going through Qt.
+
+    Lines sharing a color and width are written as a single path, so the file grows with the number of nodes only.
+    Subtrees in [collapsed] are drawn as a single wedge spanning their leaves, so only the nodes outside of them cost anything.
+
+    Args:
+
+        - tree (CompactTree): The tree to draw
+        - out (str): The path of the SVG file to write
+        - paint (NodePaint): The colors and widths of every node
+        - width (int): Width and height of the image in pixels
+        - root_opening_factor (float): Fraction of the tree radius left open around the root
+        - arc_span (float): Angle, in radians, the leaves are spread over
+        - collapsed (List[Wedge]): Subtrees to draw as wedges. Nested ones are drawn on top of the subtree holding them
+    """
+    render_svgs(tree, [(out, width)], paint, root_opening_factor, arc_span, collapsed)
+
+
+def render_svgs(tree: CompactTree, outputs: List[Tuple[str, int]], paint: NodePaint, root_opening_factor: float = 0.0, arc_span: float = ARC_SPAN, collapsed: List[Wedge] = None):
+    """
+    Lays [tree] out once and writes it to every (path, width) of [outputs], see `render_svg` for the other arguments
+    """
+    angle, radius = circular_layout(tree, arc_span)
+    for out, width in outputs:
+        with open(out, "w") as f:
+            write_svg(f, tree, angle, radius, paint, width, root_opening_factor, collapsed)
+
+
+def write_svg(f: TextIO, tree: CompactTree, angle: np.ndarray, radius: np.ndarray, paint: NodePaint, width: int, root_opening_factor: float = 0.0, collapsed: List[Wedge] = None):
+    """
+    Writes the SVG of a laid out tree to [f], see `render_svg`
+    """
+    # Clades sharing a node get a single wedge holding all their labels
+    merged = OrderedDict()
+    for wedge in sorted(collapsed or [], key=lambda wedge: wedge.node):
+        merged[wedge.node] = merged[wedge.node]._replace(label=f"{merged[wedge.node].label}, {wedge.label}") if wedge.node in merged else wedge
+    collapsed = list(merged.values())
+    max_radius = float(radius.max()) or 1.0
+    opening = max_radius * root_opening_factor
+    scale = width * (0.5 - (LABEL_MARGIN if collapsed else MARGIN)) / (max_radius + opening)
+    center = width / 2
+    r = (radius + opening) * scale
+    parent_r = np.where(tree.parent >= 0, r[np.maximum(tree.parent, 0)], r)
+    step = _leaf_step(tree, angle)
+
+    # Nodes strictly inside a collapsed subtree are not drawn
+    hidden = np.zeros(tree.size + 1, dtype=np.int64)
+    for wedge in collapsed:
+        hidden[wedge.node + 1] += 1
+        hidden[tree.end[wedge.node]] -= 1
+    visible = np.cumsum(hidden)[:-1] == 0
+    is_collapsed = np.zeros(tree.size, dtype=bool)
+    is_collapsed[[wedge.node for wedge in collapsed]] = True
+
+    f.write(
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{width}" viewBox="0 0 {width} {width}">\n'
+        f'<rect width="{width}" height="{width}" fill="#ffffff"/>\n'
+    )
+    _write_backgrounds(f, tree, angle, parent_r, float(r.max()), paint, center, step, visible & ~is_collapsed)
+    _write_wedges(f, tree, angle, r, collapsed, center, step, width)
+
+    last_child = last_children(tree)
+    internal = np.flatnonzero(visible & ~is_collapsed & ~tree.is_leaf)
+    branches = np.flatnonzero(visible & (tree.parent >= 0))
+
+    groups = OrderedDict()
+    for node, key in zip(branches.tolist(), zip(paint.color[branches].tolist(), paint.width[branches].tolist())):
+        groups.setdefault(key, ([], []))[0].append(node)
+    for node, key in zip(internal.tolist(), zip(paint.color[internal].tolist(), paint.width[internal].tolist())):
+        groups.setdefault(key, ([], []))[1].append(node)
+
+    for (color, line_width), (group_branches, group_arcs) in groups.items():
+        f.write(f'<path fill="none" stroke="{color}" stroke-width="{max(line_width, HAIRLINE)}" stroke-linecap="square" d="')
+        nodes = np.array(group_branches, dtype=np.int64)
+        _write_segments(f, _lines(center, angle[nodes], parent_r[nodes], r[nodes]))
+        nodes = np.array(group_arcs, dtype=np.int64)
+        _write_segments(f, _arcs(center, r[nodes], angle[tree.first_child[nodes]], angle[last_child[nodes]]))
+        f.write('"/>\n')
+    f.write("</svg>\n")
+
+
+def _leaf_step(tree: CompactTree, angle: np.ndarray) -> float:
+    leaves = tree.leaves
+    return float(angle[leaves[1]] - angle[leaves[0]]) if len(leaves) > 1 else ARC_SPAN
+
+
+def _leaf_span(tree: CompactTree, angle: np.ndarray, node: int, step: float) -> Tuple[float, float]:
+    """
+    Returns the angles between which the leaves of [node] are drawn
+    """
+    leaf_angle = angle[node : tree.end[node]][tree.is_leaf[node : tree.end[node]]]
+    return float(leaf_angle[0]) - step / 2, float(leaf_angle[-1]) + step / 2
+
+
+def _sector(center: float, inner: float, outer: float, start: float, stop: float) -> str:
+    """
+    Returns the path of the ring sector between radii [inner] and [outer] and angles [start] and [stop]
+    """
+    large = int(stop - start > math.pi)
+    return (
+        f"M{_point(center, outer, start)}A{outer:.2f},{outer:.2f} 0 {large} 1 {_point(center, outer, stop)}"
+        f"L{_point(center, inner, stop)}A{inner:.2f},{inner:.2f} 0 {large} 0 {_point(center, inner, start)}Z"
+    )
+
+
+def _write_backgrounds(f: TextIO, tree: CompactTree, angle: np.ndarray, parent_r: np.ndarray, outer: float, paint: NodePaint, center: float, step: float, visible: np.ndarray):
+    """
+    Draws a wedge from the start of each visible node with a background color to the edge of the tree, covering all its leaves
+    """
+    for node, color in enumerate(paint.bgcolor.tolist()):
+        if color and visible[node]:
+            start, stop = _leaf_span(tree, angle, node, step)
+            f.write(f'<path fill="{color}" stroke="none" d="{_sector(center, float(parent_r[node]), outer, start, stop)}"/>\n')
+
+
+def _write_wedges(f: TextIO, tree: CompactTree, angle: np.ndarray, r: np.ndarray, collapsed: List[Wedge], center: float, step: float, width: int):
+    """
+    Draws each collapsed subtree as a wedge from its root to its furthest leaf, labelled just outside the tree
+    """
+    outer = float(r.max())
+    font_size = max(width // 100, 8)
+    for wedge in collapsed:
+        start, stop = _leaf_span(tree, angle, wedge.node, step)
+        tip = float(r[wedge.node : tree.end[wedge.node]].max())
+        f.write(f'<path fill="{wedge.color}" stroke="#343434" d="{_sector(center, float(r[wedge.node]), tip, start, stop)}"/>\n')
+
+        middle = (start + stop) / 2
+        x, y = _point(center, outer + width * LABEL_GAP, middle).split(",")
+        anchor = "start" if math.cos(middle) >= 0 else "end"
+        f.write(
+            f'<text x="{x}" y="{y}" font-size="{font_size}" font-family="sans-serif" text-anchor="{anchor}" dominant-baseline="middle">'
+            f"{escape(wedge.label)}</text>\n"
+        )
+
+
+def _point(center: float, radius: float, theta: float) -> str:
+    return f"{center + radius * math.cos(theta):.2f},{center + radius * math.sin(theta):.2f}"
+
+
+def _lines(center: float, theta: np.ndarray, r1: np.ndarray, r2: np.ndarray) -> Iterable[str]:
+    cos, sin = np.cos(theta), np.sin(theta)
+    points = np.column_stack([center + r1 * cos, center + r1 * sin, center + r2 * cos, center + r2 * sin]).tolist()
+    return (f"M{x1:.2f},{y1:.2f}L{x2:.2f},{y2:.2f}" for x1, y1, x2, y2 in points)
+
+
+def _arcs(center: float, r: np.ndarray, start: np.ndarray, stop: np.ndarray) -> Iterable[str]:
+    large = (stop - start > math.pi).astype(int)
+    points = np.column_stack(
+        [center + r * np.cos(start), center + r * np.sin(start), r, large, center + r * np.cos(stop), center + r * np.sin(stop)]
+    ).tolist()
+    return (f"M{x1:.2f},{y1:.2f}A{radius:.2f},{radius:.2f} 0 {int(big)} 1 {x2:.2f},{y2:.2f}" for x1, y1, radius, big, x2, y2 in points)
+
+
+def _write_segments(f: TextIO, segments: Iterable[str]):
+    batch = []
+    for segment in segments:
+        batch.append(segment)
+        if len(batch) >= BATCH:
+            f.write("".join(batch))
+            batch = []
+    f.write("".join(batch))
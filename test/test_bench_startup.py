@@ -0,0 +1,17 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import bench_startup
+
+
+class TestStartup(unittest.TestCase):
+    def test_no_heavy_imports(self):
+        for name, args in bench_startup.COMMANDS.items():
+            self.assertEqual(bench_startup.heavy_imports(args[0][: -len(".py")]), [], name)
+
+
+if __name__ == "__main__":
+    unittest.main()
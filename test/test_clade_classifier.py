@@ -0,0 +1,50 @@
+import unittest
+
+import clade_classifier
+from clade_classifier import CladeClassifier, get_classifier
+
+
+class TestCladeClassifier(unittest.TestCase):
+    clades = ["G_", "GH_", "GV_", "GR_", "S_", "V_"]
+    alt_names = {"Gn_": "G_", "GRn_": "GR_", "GHn_": "GH_", "GVn_": "GV_"}
+
+    def test_labels(self):
+        classifier = CladeClassifier(self.clades, self.alt_names)
+        self.assertEqual(classifier.labels, self.clades + ["other"])
+
+    def test_alternate_names(self):
+        classifier = CladeClassifier(self.clades, self.alt_names)
+        self.assertEqual(classifier.label(classifier.classify("GHn_hCoV-19/x")), "GH_")
+        self.assertEqual(classifier.label(classifier.classify("Gn_hCoV-19/x")), "G_")
+        self.assertEqual(classifier.label(classifier.classify("L_hCoV-19/x")), "other")
+        self.assertEqual(classifier.label(classifier.classify("")), "other")
+
+    def test_longest_prefix_wins(self):
+        """
+        Overlapping delineators should resolve to the longest match whatever their order
+        """
+        for clades in (["G", "GH", "GHn"], ["GHn", "GH", "G"]):
+            classifier = CladeClassifier(clades, {})
+            self.assertEqual(classifier.label(classifier.classify("GHn_1")), "GHn")
+            self.assertEqual(classifier.label(classifier.classify("GH_1")), "GH")
+            self.assertEqual(classifier.label(classifier.classify("GR_1")), "G")
+
+    def test_many_delineators(self):
+        clades = [f"C{i}_" for i in range(5000)]
+        classifier = CladeClassifier(clades, {"X": "C42_"})
+        ids = classifier.classify_all(["C4999_a", "C42_b", "Xc", "C5000_d"])
+        self.assertEqual([classifier.label(i) for i in ids], ["C4999_", "C42_", "C42_", "other"])
+
+    def test_classifier_is_shared(self):
+        self.assertIs(get_classifier(self.clades, self.alt_names), get_classifier(list(self.clades), dict(self.alt_names)))
+
+    def test_classifiers_are_bounded(self):
+        first = get_classifier(["A_"], {})
+        for i in range(clade_classifier.MAX_CLASSIFIERS):
+            get_classifier([f"B{i}_"], {})
+        self.assertEqual(len(clade_classifier._classifiers), clade_classifier.MAX_CLASSIFIERS)
+        self.assertIsNot(get_classifier(["A_"], {}), first)
+
+
+if __name__ == "__main__":
+    unittest.main()
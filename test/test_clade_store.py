@@ -0,0 +1,109 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import clade_store
+import graph_plot
+from clade_tables import CladeTable
+
+
+def table(regions, clades, periods, start=0) -> CladeTable:
+    counts = np.arange(len(regions) * len(clades) * len(periods)).reshape(len(regions), len(clades), len(periods)) + start
+    return CladeTable(regions, clades, periods, counts)
+
+
+class TestCladeStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = os.path.join(self.tmp.name, "store")
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_append_periods(self):
+        first = table(["Europe", "Asia"], ["G", "GH"], ["Jan20", "Feb20"])
+        clade_store.append_store(self.store, first)
+        counts_file = clade_store.read_meta(self.store)["counts"]
+        size = os.path.getsize(os.path.join(self.store, counts_file))
+        clade_store.append_store(self.store, table(["Europe (+5)", "Asia"], ["G", "GH"], ["Mar20"], start=100))
+
+        self.assertEqual(os.path.getsize(os.path.join(self.store, counts_file)), size * 3 // 2)
+        loaded = clade_store.load_store(self.store)
+        self.assertEqual(loaded.regions, ["Europe", "Asia"])
+        self.assertEqual(loaded.periods, ["Jan20", "Feb20", "Mar20"])
+        self.assertEqual(loaded.counts[:, :, :2].tolist(), first.counts.tolist())
+        self.assertEqual(loaded.counts[:, :, 2].tolist(), [[100, 101], [102, 103]])
+        last = clade_store.load_store(self.store, last=1)
+        self.assertIsInstance(last.counts.base, np.memmap)
+        self.assertEqual(last.periods, ["Mar20"])
+        self.assertEqual(last.counts.tolist(), loaded.counts[:, :, 2:].tolist())
+
+    def test_replace_period_and_widen(self):
+        clade_store.append_store(self.store, table(["Europe"], ["G"], ["Jan20", "Feb20"]))
+        clade_store.append_store(self.store, table(["Asia"], ["GH", "G"], ["Feb20", "Mar20"], start=10))
+
+        meta = clade_store.read_meta(self.store)
+        self.assertEqual(os.listdir(self.store).count(meta["counts"]), 1)
+        self.assertEqual(len([name for name in os.listdir(self.store) if name.endswith(".bin")]), 1)
+        loaded = clade_store.load_store(self.store)
+        self.assertEqual(loaded.regions, ["Europe", "Asia"])
+        self.assertEqual(loaded.clades, ["G", "GH"])
+        self.assertEqual(loaded.periods, ["Jan20", "Feb20", "Mar20"])
+        # Feb20 was replaced by the second table, which has no count for Europe
+        self.assertEqual(loaded.counts[0].tolist(), [[0, 0, 0], [0, 0, 0]])
+        self.assertEqual(loaded.counts[1].tolist(), [[0, 12, 13], [0, 10, 11]])
+
+    def test_interrupted_append(self):
+        clade_store.append_store(self.store, table(["Europe"], ["G"], ["Jan20"]))
+        with open(os.path.join(self.store, clade_store.read_meta(self.store)["counts"]), "ab") as f:
+            f.write(b"\xff" * 3)
+        clade_store.append_store(self.store, table(["Europe"], ["G"], ["Feb20"], start=7))
+        self.assertEqual(clade_store.load_store(self.store).counts.tolist(), [[[0, 7]]])
+
+    def test_older_period_keeps_order(self):
+        clade_store.append_store(self.store, table(["Europe"], ["G"], ["Feb20", "Mar20"], start=1))
+        clade_store.append_store(self.store, table(["Europe"], ["G"], ["Jan20"], start=7))
+        clade_store.append_store(self.store, table(["Europe"], ["G"], ["Dec19", "Apr20"], start=20))
+
+        loaded = clade_store.load_store(self.store)
+        self.assertEqual(loaded.periods, ["Dec19", "Jan20", "Feb20", "Mar20", "Apr20"])
+        self.assertEqual(loaded.counts.tolist(), [[[20, 7, 1, 2, 21]]])
+        last = clade_store.load_store(self.store, last=2)
+        self.assertEqual(last.periods, ["Mar20", "Apr20"])
+        self.assertEqual(last.counts.tolist(), [[[2, 21]]])
+        self.assertEqual(len([name for name in os.listdir(self.store) if name.endswith(".bin")]), 1)
+
+    def test_period_key(self):
+        names = ["week10", "2020-01-13", "week2", "Feb20", "2019-12-30"]
+        self.assertEqual(sorted(names, key=clade_store.period_key), ["2019-12-30", "2020-01-13", "Feb20", "week2", "week10"])
+
+    def test_totals_and_regions_do_not_mix(self):
+        clade_store.append_store(self.store, table([clade_store.TOTAL_REGION], ["G"], ["Jan20"]))
+        with self.assertRaises(Exception):
+            clade_store.append_store(self.store, table(["Europe"], ["G"], ["Feb20"]))
+        self.assertEqual(clade_store.load_store(self.store).regions, [clade_store.TOTAL_REGION])
+
+        other = os.path.join(self.tmp.name, "other")
+        clade_store.append_store(other, table(["Europe"], ["G"], ["Jan20"]))
+        with self.assertRaises(Exception):
+            clade_store.append_store(other, table([clade_store.TOTAL_REGION], ["G"], ["Feb20"]))
+
+    def test_graph_plot_from_store(self):
+        clades = list(graph_plot.CLADE_LABELS)
+        clade_store.append_store(self.store, table(graph_plot.CONTINENTS, clades, ["Jan20", "Feb20", "Mar20"]))
+        outs = [os.path.join(self.tmp.name, name) for name in ("clade.png", "geo.png")]
+        graph_plot.use_agg()
+        graph_plot.store_clade_progression(self.store, outs[:1], False)
+        graph_plot.store_geoclade_progression(self.store, outs[1:], last=2)
+        for out in outs:
+            self.assertGreater(os.path.getsize(out), 0, out)
+
+    def test_missing_store(self):
+        with self.assertRaises(Exception):
+            clade_store.load_store(self.store)
+
+
+if __name__ == "__main__":
+    unittest.main()
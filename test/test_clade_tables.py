@@ -0,0 +1,53 @@
+import io
+import unittest
+
+import clade_tables
+
+GEOCLADE = "Europe (+104)\nG\t47\nGH\t8\n\nAsia (+40)\nG\t8\nGH\t0\nGR\t2\n\n"
+PROGRESSION = "Per month:\nMonth\tG\tGH\nDec19\t0\t1\nJan20\t14\t1\nCumulative:\nMonth\tG\tGH\nDec19\t0\t1\nJan20\t14\t2\n"
+
+
+class TestCladeTables(unittest.TestCase):
+    def test_geoclade(self):
+        table = clade_tables.read_geoclade(io.StringIO(GEOCLADE), period="Aug20")
+        self.assertEqual(table.regions, ["Europe (+104)", "Asia (+40)"])
+        self.assertEqual(table.clades, ["G", "GH", "GR"])
+        self.assertEqual(table.periods, ["Aug20"])
+        self.assertEqual(table.counts[:, :, 0].tolist(), [[47, 8, 0], [8, 0, 2]])
+
+    def test_progression_stops_at_cumulative(self):
+        table = clade_tables.read_progression(io.StringIO(PROGRESSION))
+        self.assertEqual(table.periods, ["Dec19", "Jan20"])
+        self.assertEqual(table.counts[0].tolist(), [[0, 14], [1, 1]])
+
+    def test_errors(self):
+        with self.assertRaises(Exception):
+            clade_tables.read_geoclade(io.StringIO("G\t47\n"))
+        with self.assertRaises(Exception):
+            clade_tables.read_progression(io.StringIO("Per month:\n"))
+
+    def test_concat_periods(self):
+        weeks = [clade_tables.read_geoclade(io.StringIO(text)) for text in (GEOCLADE, "Asia (+1)\nL\t1\n")]
+        table = clade_tables.concat_periods(weeks, ["W1", "W2"])
+        self.assertEqual(table.regions, ["Europe", "Asia"])
+        self.assertEqual(table.clades, ["G", "GH", "GR", "L"])
+        self.assertEqual(table.counts[1].tolist(), [[8, 0], [0, 0], [2, 0], [0, 1]])
+
+    def test_write_round_trip(self):
+        geoclade = clade_tables.read_geoclade(io.StringIO(GEOCLADE))
+        out = io.StringIO()
+        clade_tables.write_geoclade(out, geoclade)
+        self.assertEqual(out.getvalue(), "Europe (+55)\nG\t47\nGH\t8\nGR\t0\n\nAsia (+10)\nG\t8\nGH\t0\nGR\t2\n\n")
+        progression = clade_tables.read_progression(io.StringIO(PROGRESSION))
+        out = io.StringIO()
+        clade_tables.write_progression(out, progression)
+        self.assertEqual(out.getvalue(), PROGRESSION)
+
+    def test_to_frame(self):
+        frame = clade_tables.to_frame(clade_tables.read_geoclade(io.StringIO(GEOCLADE)))
+        self.assertEqual(list(frame.columns), ["region", "clade", "period", "count"])
+        self.assertEqual(int(frame["count"].sum()), 65)
+
+
+if __name__ == "__main__":
+    unittest.main()
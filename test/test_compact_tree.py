@@ -0,0 +1,92 @@
+import io
+import random
+import unittest
+
+from ete3 import Tree
+
+import compact_tree
+from clade_classifier import CladeClassifier
+
+
+def node_details(root):
+    return [(node.name, node.dist, node.support, len(node.children)) for node in root.traverse()]
+
+
+def random_newick(seed: int) -> str:
+    """
+    Builds a random newick tree with multifurcations and `)123` support labels
+    """
+    random.seed(seed)
+    tree = Tree()
+    tree.populate(random.randint(3, 60), random_branches=True)
+    for node in list(tree.traverse()):
+        if not node.is_leaf() and node.up and random.random() < 0.2:
+            node.delete()
+    for node in tree.traverse():
+        if not node.is_leaf():
+            node.support = random.randint(0, 100)
+    return tree.write(format=0)
+
+
+class TestCompactTree(unittest.TestCase):
+    def assert_same_tree(self, tree, expected):
+        root, _ = compact_tree.to_ete3(tree)
+        self.assertEqual(node_details(root), node_details(expected))
+
+    def test_parse_matches_ete3(self):
+        for newick in ["((A:1,B)95:0.5, 'C x':2,(D,E)0.8);", "(A:1,B:2):3;", "((a,b),c);"]:
+            self.assert_same_tree(compact_tree.read_newick(io.StringIO(newick)), Tree(newick))
+
+    def test_parse_quoted(self):
+        newick = "(('A,1':1,'B':2)95:0.5,'C x':2);"
+        tree = compact_tree.read_newick(io.StringIO(newick), is_quoted=True)
+        self.assertEqual(tree.leaf_names(), ["A,1", "B", "C x"])
+        self.assert_same_tree(tree, Tree(newick, quoted_node_names=True))
+
+    def test_small_chunks(self):
+        """
+        Tokens should be put back together whatever the chunk size
+        """
+        newick = random_newick(seed=0)
+        for chunk_size in (1, 7, 64):
+            self.assert_same_tree(compact_tree.read_newick(io.StringIO(newick), chunk_size=chunk_size), Tree(newick))
+
+    def test_empty_leaf(self):
+        with self.assertRaises(ValueError):
+            compact_tree.read_newick(io.StringIO("(A,,B);"))
+
+    def test_set_outgroup_matches_ete3(self):
+        for seed in range(20):
+            newick = random_newick(seed)
+            tree = compact_tree.read_newick(io.StringIO(newick))
+            expected = Tree(newick)
+            for _ in range(4):
+                candidates = [node for node in expected.traverse() if node is not expected]
+                outgroup = random.choice(candidates)
+                index = compact_tree.levelorder(tree)[list(expected.traverse()).index(outgroup)]
+
+                expected.set_outgroup(outgroup)
+                tree = compact_tree.set_outgroup(tree, index)
+                self.assert_same_tree(tree, expected)
+                reparsed = compact_tree.read_newick(io.StringIO(expected.write(format=0)))
+                self.assertEqual(tree.end.tolist(), reparsed.end.tolist())
+                self.assertEqual(tree.depth.tolist(), reparsed.depth.tolist())
+
+    def test_node_clade_counts(self):
+        classifier = CladeClassifier(["G_", "S_"], {"Gn_": "G_"})
+        tree = compact_tree.read_newick(io.StringIO("((G_1,Gn_2)1:1,(S_1,(S_2,L_1)),G_3);"))
+        tree = compact_tree.classify(tree, classifier)
+        counts = compact_tree.node_clade_counts(tree, len(classifier.labels))
+        self.assertEqual(counts[0].tolist(), [3, 2, 1])
+        self.assertEqual(counts[1].tolist(), [2, 0, 0])
+        self.assertEqual(counts[4].tolist(), [0, 2, 1])
+
+        rerooted = compact_tree.set_outgroup(tree, 8)
+        self.assertEqual(rerooted.leaf_names()[0], "L_1")
+        counts = compact_tree.node_clade_counts(rerooted, len(classifier.labels))
+        self.assertEqual(counts[0].tolist(), [3, 2, 1])
+        self.assertEqual(counts[1].tolist(), [0, 0, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+import io
+import os
+import tarfile
+import tempfile
+import unittest
+from unittest import mock
+
+import compact_tree
+import extractor
+
+NEWICK = "((G_1:1,Gn_2:2)90:1,(S_1:1,L_1:1)70:1,G_3:1);"
+GEOCLADE = "Europe (+3)\nG\t3\n\n"
+
+
+def add(tar: tarfile.TarFile, name: str, data: bytes, **fields):
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    info.mtime = 1600000000
+    for field, value in fields.items():
+        setattr(info, field, value)
+    tar.addfile(info, io.BytesIO(data))
+
+
+class TestExtractor(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.out = os.path.join(self.dir.name, "out")
+        self.archive = os.path.join(self.dir.name, "gisaid.tar")
+        with tarfile.open(self.archive, "w") as tar:
+            add(tar, "data/sequences.fasta", b">x\nACGT\n" * 1000)
+            add(tar, "data/iqtree.nwk", NEWICK.encode())
+            add(tar, "data/geoclade.tsv", GEOCLADE.encode())
+            add(tar, "data/link.nwk", b"", type=tarfile.SYMTYPE, linkname="/etc/passwd")
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_selective_and_unchanged(self):
+        for workers in (1, 3):
+            with self.subTest(workers=workers):
+                result = extractor.extract(self.archive, self.out, ["*.nwk", "*geoclade*.tsv"], workers=workers)
+                self.assertEqual(sorted(result.extracted), ["data/geoclade.tsv", "data/iqtree.nwk"])
+                self.assertEqual(result.skipped, ["data/link.nwk"])
+                self.assertFalse(os.path.exists(os.path.join(self.out, "data", "sequences.fasta")))
+                with open(os.path.join(self.out, "data", "iqtree.nwk")) as f:
+                    self.assertEqual(f.read(), NEWICK)
+                self.assertEqual(os.path.getmtime(os.path.join(self.out, "data", "iqtree.nwk")), 1600000000)
+
+                again = extractor.extract(self.archive, self.out, ["*.nwk", "*geoclade*.tsv"], workers=workers)
+                self.assertEqual(again.extracted, [])
+                self.assertEqual(sorted(again.unchanged), ["data/geoclade.tsv", "data/iqtree.nwk"])
+                os.remove(os.path.join(self.out, "data", "iqtree.nwk"))
+                os.remove(os.path.join(self.out, "data", "geoclade.tsv"))
+
+    def test_checksum_catches_same_size_edits(self):
+        extractor.extract(self.archive, self.out, ["*.tsv"])
+        path = os.path.join(self.out, "data", "geoclade.tsv")
+        with open(path, "w") as f:
+            f.write(GEOCLADE.replace("3", "4"))
+        os.utime(path, (1600000000, 1600000000))
+        self.assertEqual(extractor.extract(self.archive, self.out, ["*.tsv"], check="mtime").unchanged, ["data/geoclade.tsv"])
+        self.assertEqual(extractor.extract(self.archive, self.out, ["*.tsv"], check="checksum").extracted, ["data/geoclade.tsv"])
+        with open(path) as f:
+            self.assertEqual(f.read(), GEOCLADE)
+
+    def test_unsafe_paths(self):
+        archive = os.path.join(self.dir.name, "evil.tar")
+        with tarfile.open(archive, "w") as tar:
+            add(tar, "../escape.nwk", b"x")
+            add(tar, "/tmp/absolute.nwk", b"x")
+            add(tar, "fine.nwk", b"x")
+        result = extractor.extract(archive, self.out)
+        self.assertEqual(sorted(result.unsafe), ["../escape.nwk", "/tmp/absolute.nwk"])
+        self.assertEqual(result.extracted, ["fine.nwk"])
+        self.assertFalse(os.path.exists(os.path.join(self.dir.name, "escape.nwk")))
+        self.assertIsNone(extractor.safe_target(self.out, "a/../../b"))
+
+    def test_read_member_without_extracting(self):
+        for suffix, mode in (("tar", "w"), ("tar.gz", "w:gz")):
+            archive = os.path.join(self.dir.name, f"trees.{suffix}")
+            with tarfile.open(archive, mode) as tar:
+                add(tar, "data/iqtree.nwk", NEWICK.encode())
+            with mock.patch("tarfile.TarFile.extractall") as extractall:
+                tree = compact_tree.parse_newick(f"{archive}::*.nwk")
+                extractall.assert_not_called()
+            self.assertEqual(len(tree.leaves), 5)
+            with extractor.open_input(f"{archive}::data/iqtree.nwk", "rb") as f:
+                self.assertEqual(f.read(), NEWICK.encode())
+        with self.assertRaises(Exception):
+            with extractor.open_input(f"{self.archive}::*.json"):
+                pass
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import compact_tree
+import generate_tree
+import phylo_updated
+from clade_classifier import CladeClassifier
+
+
+class TestGenerateTree(unittest.TestCase):
+    def test_tree(self):
+        for style, marker in (("rf", "color="), ("iq", "____color__")):
+            for quoted in (False, True):
+                out = io.StringIO()
+                generate_tree.write_tree(out, 300, seed=1, style=style, quoted=quoted)
+                tree = compact_tree.read_newick(io.StringIO(out.getvalue()), is_quoted=quoted)
+                self.assertEqual(len(tree.leaves), 300)
+                self.assertEqual(len(set(tree.leaf_names())), 300)
+                colors = {phylo_updated.taxon_color(name, marker, -1) for name in tree.leaf_names()}
+                self.assertTrue(colors <= set(generate_tree.CLADES.values()) | {None})
+
+    def test_every_clade_has_a_node(self):
+        """
+        Even small trees should hold every clade, with a node holding part of it for the bench thresholds to pick
+        """
+        details = generate_tree.bench_clade_details()
+        clade_details = {clade: value for clade, value in details.items() if len(value) > 1}
+        alt_names = {clade: value[0] for clade, value in details.items() if len(value) == 1}
+        for seed in range(5):
+            out = io.StringIO()
+            generate_tree.write_tree(out, 30, seed=seed)
+            tree = compact_tree.classify(compact_tree.read_newick(io.StringIO(out.getvalue())), CladeClassifier(list(clade_details), alt_names))
+            counts = compact_tree.node_clade_counts(tree, len(clade_details) + 1)
+            clade_counts = dict(zip(clade_details, counts[0].tolist()))
+            picks = phylo_updated.get_compact_max_ancestors(tree, counts, list(clade_details) + ["other"], clade_details, clade_counts)
+            self.assertEqual(sorted(picks), sorted(generate_tree.CLADES))
+
+    def test_same_seed_same_tree(self):
+        first, second = io.StringIO(), io.StringIO()
+        generate_tree.write_tree(first, 100, seed=3)
+        generate_tree.write_tree(second, 100, seed=3)
+        self.assertEqual(first.getvalue(), second.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import io
+import os
+import random
+import tempfile
+import unittest
+from collections import Counter
+
+import pandas as pd
+
+import clade_tables
+import gisaid_ingest
+import graph_plot
+
+LOCATIONS = ["Europe / Germany", "Asia / Singapore", "Africa / Kenya", "Oceania / Australia", "North America / USA", "South America / Brazil"]
+CLADES = ["G", "GH", "GR", "GV", "L", "S", "V", "GRY", ""]
+
+
+def write_metadata(path: str, rows: int):
+    generator = random.Random(0)
+    with open(path, "w") as f:
+        f.write("Virus name\tClade\tCollection date\tLocation\tAA Substitutions\n")
+        for i in range(rows):
+            date = f"2020-{generator.randint(1, 12):02d}-{generator.randint(1, 28):02d}"
+            if generator.random() < 0.1:
+                date = generator.choice(["2020-05", "", "2020"])
+            substitutions = "(Spike_D614G,Spike_S477N)" if generator.random() < 0.2 else "(Spike_D614G)"
+            f.write(f"hCoV-19/{i}\t{generator.choice(CLADES)}\t{date}\t{generator.choice(LOCATIONS)}\t{substitutions}\n")
+
+
+class TestGisaidIngest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.TemporaryDirectory()
+        cls.metadata = os.path.join(cls.directory.name, "metadata.tsv")
+        write_metadata(cls.metadata, 2000)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.directory.cleanup()
+
+    def ingest(self, period: str, chunk_rows: int) -> Counter:
+        counts = Counter()
+        for chunk_counts, stats in gisaid_ingest.ingest(self.metadata, gisaid_ingest.Columns(), gisaid_ingest.PERIODS[period], chunk_rows):
+            self.assertLessEqual(stats.rows, chunk_rows)
+            counts.update(chunk_counts)
+        return counts
+
+    def test_chunks_match_whole_file(self):
+        columns, period = gisaid_ingest.Columns(), gisaid_ingest.PERIODS["month"]
+        whole = gisaid_ingest.count_chunk(pd.read_csv(self.metadata, sep="\t", dtype=str), columns, period)
+        self.assertEqual(self.ingest("month", 300), whole)
+
+    def test_clade_names(self):
+        clades = pd.Series(["G", "GH", "GRY", "L", None])
+        substitutions = pd.Series(["Spike_S477N", "", "Spike_S477N", "Spike_S477N", ""])
+        names = gisaid_ingest.clade_names(clades, substitutions)
+        self.assertEqual(names[:4].tolist(), ["Gn", "GH", "O", "L"])
+        self.assertTrue(pd.isna(names[4]))
+
+    def test_tables_read_back(self):
+        counts = self.ingest("month", 500)
+        progression, geoclade = gisaid_ingest.build_tables(gisaid_ingest.count_table(counts, gisaid_ingest.PERIODS["month"]))
+        self.assertEqual(progression.periods[0], "Jan20")
+        self.assertEqual(len(progression.periods), 12)
+        self.assertEqual(progression.counts.sum(), sum(counts.values()))
+        self.assertEqual(geoclade.regions, graph_plot.CONTINENTS)
+
+        out = io.StringIO()
+        clade_tables.write_progression(out, progression)
+        out.seek(0)
+        self.assertEqual(clade_tables.read_progression(out).counts.tolist(), progression.counts.tolist())
+        geo_file = os.path.join(self.directory.name, "geoclade.tsv")
+        with open(geo_file, "w") as f:
+            clade_tables.write_geoclade(f, geoclade)
+        dfs = graph_plot.make_df(geo_file, graph_plot.CONTINENTS)
+        self.assertEqual(len(dfs), 6)
+        self.assertEqual(sum(int(series.sum()) for series in dfs.values()), geoclade.counts.sum())
+
+    def test_weeks_need_the_day(self):
+        counts = self.ingest("week", 2000)
+        progression, geoclade = gisaid_ingest.build_tables(gisaid_ingest.count_table(counts, gisaid_ingest.PERIODS["week"]), geo_periods=0)
+        self.assertEqual(progression.periods[0], "2019-12-30")
+        self.assertEqual(geoclade.counts.sum(), progression.counts.sum())
+        self.assertLess(progression.counts.sum(), sum(self.ingest("month", 2000).values()))
+
+
+if __name__ == "__main__":
+    unittest.main()
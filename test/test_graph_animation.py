@@ -0,0 +1,37 @@
+import io
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+import clade_tables
+import graph_animation
+
+PROGRESSION = "Per week:\nWeek\tG\tGn\tS\tO\nW1\t1\t1\t2\t0\nW2\t0\t0\t0\t0\nW3\t5\t0\t0\t5\n"
+
+
+class TestGraphAnimation(unittest.TestCase):
+    def setUp(self):
+        self.progression = clade_tables.read_progression(io.StringIO(PROGRESSION))
+        weeks = [clade_tables.read_geoclade(io.StringIO(f"Europe (+{n})\nG\t{n}\nS\t1\n\nAsia (+1)\nGR\t1\n")) for n in range(3)]
+        self.geoclade = clade_tables.concat_periods(weeks, ["W1", "W2", "W3"])
+
+    def test_stack_rows(self):
+        labels, rows = graph_animation.stack_rows(self.progression)
+        self.assertEqual(rows[labels.index("G+S477X")].tolist(), [25, 0, 0])
+        self.assertTrue(np.allclose(rows.sum(axis=0), [100, 0, 100]))
+
+    def test_frames_and_gif(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for kind, table in (("progression", self.progression), ("geoclade", self.geoclade)):
+                paths = graph_animation.frame_paths(tmp, len(table.periods), prefix=kind)
+                graph_animation.write_frames(kind, table, paths, workers=1, dpi=40)
+                self.assertTrue(all(os.path.getsize(path) > 0 for path in paths))
+                out = os.path.join(tmp, f"{kind}.gif")
+                graph_animation.write_gif(paths, out)
+                self.assertTrue(os.path.getsize(out) > 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+import os
+import tempfile
+import unittest
+
+import graph_plot
+
+CLADES = ["G", "Gn", "GH", "GHn", "GR", "GRn", "GV", "GVn", "L", "O", "S", "V"]
+CONTINENTS = ["Europe", "Asia", "Africa", "Oceania", "NorthAmerica", "SouthAmerica"]
+
+
+class TestDrawCharts(unittest.TestCase):
+    def test_several_formats_in_parallel(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            progression = os.path.join(tmp, "progression.tsv")
+            with open(progression, "w") as f:
+                f.write("Per month:\nMonth\t" + "\t".join(CLADES) + "\n")
+                for month in range(4):
+                    f.write(f"M{month}\t" + "\t".join(str(month * 10 + i) for i in range(len(CLADES))) + "\n")
+            geoclade = os.path.join(tmp, "geoclade.tsv")
+            with open(geoclade, "w") as f:
+                for n, continent in enumerate(CONTINENTS):
+                    f.write(f"{continent} (+{n})\n" + "".join(f"{clade}\t{n + i}\n" for i, clade in enumerate(CLADES)) + "\n")
+
+            outs = [os.path.join(tmp, name) for name in ("clade.png", "clade.svg", "geo.png", "geo.pdf")]
+            charts = [
+                graph_plot.Chart("clade progression", graph_plot.generate_clade_progression, (progression, outs[:2], False)),
+                graph_plot.Chart("geoclade", graph_plot.generate_geoclade_progression, (geoclade, outs[2:])),
+            ]
+            seconds = graph_plot.draw_charts(charts, workers=2)
+            self.assertEqual(len(seconds), 2)
+            for out in outs:
+                self.assertGreater(os.path.getsize(out), 0, out)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,3 +1,6 @@
+import glob
+import os
+import tempfile
 import unittest
 import sys
 
@@ -55,5 +58,63 @@ class TestNwkToFig(unittest.TestCase):
         self.assertEqual(out, expected, "files should be identical")
 
 
+class TestStreamingConvert(unittest.TestCase):
+    newick = "(('hCoV b':1,'hCoV a':2)95:0.5,('hCoV d':1,'hCoV c':1)100:1);\n"
+
+    def convert(self, max_taxa_in_memory, workers=1):
+        with tempfile.TemporaryDirectory() as tmp:
+            file = os.path.join(tmp, "in.nwk")
+            settings = os.path.join(tmp, "settings.txt")
+            with open(file, "w") as f:
+                f.write(self.newick)
+            with open(settings, "w") as f:
+                f.write("begin figtree;\nend;\n")
+            os.makedirs(os.path.join(tmp, "out"))
+            nwk_to_fig.convert_to_nexus(file, os.path.join(tmp, "out", ""), settings, True, max_taxa_in_memory, workers)
+            (out,) = glob.glob(os.path.join(tmp, "out", "*_Full"))
+            with open(out) as f:
+                return f.read()
+
+    def test_convert_to_nexus(self):
+        expected = (
+            "#NEXUS\nbegin taxa;\n\tdimensions ntax=4;\n\ttaxlabels\n"
+            "\thCoV a\n\thCoV b\n\thCoV c\n\thCoV d\n;\nend;\n\n"
+            "begin trees;\n\ttree tree_1 = [&R] "
+            "((hCoV b:1,hCoV a:2)[&label=95]:0.5,(hCoV d:1,hCoV c:1)[&label=100]:1);\n"
+            "end;\n\nbegin figtree;\nend;\n"
+        )
+        self.assertEqual(self.convert(max_taxa_in_memory=1000), expected)
+
+    def test_spilled_taxa_are_merged(self):
+        """
+        Sorting the taxa through runs on disk should give the same file as sorting in memory
+        """
+        self.assertEqual(self.convert(max_taxa_in_memory=1), self.convert(max_taxa_in_memory=1000))
+
+    def test_parallel_matches_serial(self):
+        self.assertEqual(self.convert(max_taxa_in_memory=2, workers=3), self.convert(max_taxa_in_memory=1000))
+
+    def test_split_ranges(self):
+        """
+        Ranges should cover the file and start on delimiters outside of quotes
+        """
+        with tempfile.TemporaryDirectory() as tmp:
+            file = os.path.join(tmp, "in.nwk")
+            with open(file, "w") as f:
+                f.write("(('a,(b':1,'c':2)9:1,('d)e':1,f:1)8:1);")
+            ranges = nwk_to_fig.split_ranges(file, 6, is_quoted=True)
+            with open(file, "rb") as f:
+                text = f.read()
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], len(text))
+        for (_, end), (start, _) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, start)
+            self.assertIn(text[start : start + 1], b"(),;")
+            self.assertEqual(text[:start].count(b"'") % 2, 0)
+
+    def test_rewrite_labels(self):
+        self.assertEqual(nwk_to_fig.rewrite_labels("('a':1,b)12:3"), "(a:1,b)[&label=12]:3")
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,52 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import phylo_batch
+
+NEWICK = "((G_1____color__ff0000:1,G_2:2)90:1,(S_1:1,(S_2:1,S_3:1)80:2)70:1,G_3:1);"
+CLADES = {"G_": ["#ff0000", 0, 1, 0, 1], "S_": ["#00ff00", 0, 1, 0, 1]}
+
+
+class TestPhyloBatch(unittest.TestCase):
+    def test_failure_does_not_stop_batch(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            tree = os.path.join(tmp, "tree.nwk")
+            clades = os.path.join(tmp, "clades.json")
+            with open(tree, "w") as f:
+                f.write(NEWICK)
+            with open(clades, "w") as f:
+                json.dump(CLADES, f)
+            manifest = os.path.join(tmp, "manifest.txt")
+            with open(manifest, "w") as f:
+                f.write(f"# trees\n{tree} -iq -o {tmp}/a.svg\n\n{tmp}/missing.nwk -iq -o {tmp}/b.svg\n{tree} -iq -o '{tmp}/c d.svg'\n")
+
+            entries = phylo_batch.read_manifest(manifest)
+            self.assertEqual(len(entries), 3)
+            results = phylo_batch.run_batch(entries, ["-ccov", clades, "-ro", "S_", "--renderer", "svg"], workers=2)
+            self.assertEqual([bool(result.error) for result in results], [False, True, False])
+            self.assertIn("FileNotFoundError", results[1].error)
+            self.assertTrue(os.path.exists(os.path.join(tmp, "c d.svg")))
+            self.assertIn("6 taxons present", results[0].log)
+
+    @unittest.skipUnless(multiprocessing.get_start_method() == "fork", "the patched run only reaches forked workers")
+    def test_dead_worker_fails_only_its_tree(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            entries = [[os.path.join(tmp, name), "-o", os.path.join(tmp, f"{name}.svg")] for name in ("a", "crash", "b", "c")]
+            with mock.patch("phylo_updated.run", _run_or_crash):
+                results = phylo_batch.run_batch(entries, ["-ccov", "clade_del.json"], workers=2)
+        self.assertEqual([bool(result.error) for result in results], [False, True, False, False])
+        self.assertIn("died", results[1].error)
+
+
+def _run_or_crash(args, clade_details):
+    if args.file.endswith("crash"):
+        os._exit(1)
+    print(f"rendered {args.file}")
+
+
+if __name__ == "__main__":
+    unittest.main()
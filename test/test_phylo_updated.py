@@ -0,0 +1,179 @@
+import os
+import random
+import tempfile
+import unittest
+from collections import Counter
+from typing import Dict
+
+from ete3 import Tree
+
+import compact_tree
+import phylo_updated
+from clade_classifier import get_classifier
+
+CLADES = ["G_", "GH_", "GR_", "S_", "V_"]
+ALT_NAMES = {"Gn_": "G_", "GHn_": "GH_"}
+PREFIXES = CLADES + list(ALT_NAMES.keys()) + ["L_", "O_"]
+
+
+def make_tree(size: int, seed: int) -> Tree:
+    """
+    Builds a random tree of [size] leaves whose names start with one of PREFIXES
+    """
+    random.seed(seed)
+    tree = Tree()
+    tree.populate(size, random_branches=True)
+    for i, leaf in enumerate(tree.iter_leaves()):
+        leaf.name = f"{random.choice(PREFIXES)}{i}_color=ff0000|"
+    return tree
+
+
+def count_leaves(node: Tree) -> Dict[str, int]:
+    """
+    Counts the clade of every leaf under [node] one by one, the first clade or alternate name its name starts with
+    """
+    prefixes = dict({clade: clade for clade in CLADES}, **ALT_NAMES)
+    counts = Counter()
+    for leaf in node.get_leaves():
+        counts[next((clade for prefix, clade in prefixes.items() if leaf.name.startswith(prefix)), "other")] += 1
+    return dict(counts)
+
+
+class TestNodeCounts(unittest.TestCase):
+    def test_node_details_matches_per_node_count(self):
+        """
+        The single pass engine should give the same distribution as counting the leaves under each node
+        """
+        tree = make_tree(200, seed=1)
+        details = phylo_updated.get_node_details(tree, CLADES, ALT_NAMES)
+        internal = [node for node in tree.traverse() if not node.is_leaf()]
+        self.assertEqual(len(details), len(internal))
+        for node in internal:
+            self.assertEqual(details[node], count_leaves(node))
+
+    def test_root_row_is_clade_count(self):
+        tree = make_tree(100, seed=2)
+        node_counts = phylo_updated.get_node_counts(tree, CLADES, ALT_NAMES)
+        self.assertEqual(node_counts.labels[-1], "other")
+        self.assertEqual(node_counts.distribution(tree), phylo_updated.get_clade_count(tree, CLADES, ALT_NAMES))
+        self.assertEqual(node_counts.matrix[node_counts.index[tree]].sum(), 100)
+
+
+class TestMaxAncestors(unittest.TestCase):
+    details = {clade: ["#ffffff", 0.2, 1, 0.1, 1] for clade in CLADES}
+
+    def test_batched_matches_single_clade(self):
+        tree = make_tree(300, seed=3)
+        counts = phylo_updated.get_clade_count(tree, CLADES, ALT_NAMES)
+        node_cache = phylo_updated.get_node_counts(tree, CLADES, ALT_NAMES)
+        best = phylo_updated.get_max_ancestors(node_cache, self.details, counts)
+        for clade in CLADES:
+            single = phylo_updated.get_max_ancestor(tree, clade, self.details[clade], counts[clade], node_cache=node_cache)
+            self.assertIs(best[clade], single)
+            self.assertFalse(best[clade].is_leaf())
+
+    def test_node_details_as_cache(self):
+        """
+        The distributions of get_node_details should still work as the node cache of get_max_ancestor and color_clades
+        """
+        tree = make_tree(300, seed=3)
+        counts = phylo_updated.get_clade_count(tree, CLADES, ALT_NAMES)
+        details = phylo_updated.get_node_details(tree, CLADES, ALT_NAMES)
+        best = phylo_updated.get_max_ancestors(phylo_updated.get_node_counts(tree, CLADES, ALT_NAMES), self.details, counts)
+        for clade in CLADES:
+            self.assertIs(phylo_updated.get_max_ancestor(tree, clade, self.details[clade], counts[clade], node_cache=details), best[clade])
+        colors = {clade: ["#00ff00"] + self.details[clade][1:] for clade in CLADES}
+        phylo_updated.color_clades(tree, CLADES, colors, counts, node_cache=details)
+        self.assertEqual(best["S_"].img_style["bgcolor"], "#00ff00")
+
+    def test_no_qualifying_node(self):
+        tree = make_tree(50, seed=4)
+        counts = phylo_updated.get_clade_count(tree, CLADES, ALT_NAMES)
+        node_cache = phylo_updated.get_node_counts(tree, CLADES, ALT_NAMES)
+        details = dict(self.details, S_=["#ffffff", 2, 3, 0, 1])
+        with self.assertRaisesRegex(Exception, "Could not find any node to color for clade S_"):
+            phylo_updated.get_max_ancestors(node_cache, details, counts)
+
+
+class TestCladeIndex(unittest.TestCase):
+    def assert_matches_recount(self, tree, clade_index):
+        indexed = clade_index.node_counts(tree)
+        recounted = phylo_updated.get_node_counts(tree, CLADES, ALT_NAMES)
+        self.assertEqual(indexed.nodes, recounted.nodes)
+        self.assertEqual(indexed.matrix.tolist(), recounted.matrix.tolist())
+
+    def test_counts_follow_reroots(self):
+        """
+        Distributions read from the index should match a full recount after every set_outgroup
+        """
+        tree = make_tree(150, seed=5)
+        clade_index = phylo_updated.CladeIndex(tree, CLADES, ALT_NAMES)
+        self.assertEqual(clade_index.clade_count(), phylo_updated.get_clade_count(tree, CLADES, ALT_NAMES))
+        self.assert_matches_recount(tree, clade_index)
+
+        random.seed(5)
+        for _ in range(5):
+            outgroup = random.choice([node for node in tree.traverse() if node is not tree])
+            clade_index.set_outgroup(tree, outgroup)
+            self.assertIs(tree.children[0], outgroup)
+            self.assert_matches_recount(tree, clade_index)
+
+    def test_multifurcating_root(self):
+        tree = Tree("((G_1,G_2),(S_1,(S_2,V_1)),GH_1,O_1);")
+        clade_index = phylo_updated.CladeIndex(tree, CLADES, ALT_NAMES)
+        clade_index.set_outgroup(tree, tree.search_nodes(name="V_1")[0])
+        self.assert_matches_recount(tree, clade_index)
+
+
+class TestPrepareTree(unittest.TestCase):
+    def test_rooted_counts(self):
+        """
+        The prepared tree should be rooted on the clade, counted after rerooting, with the clade totals of the file
+        """
+        details = {clade: ["#ff0000", 0.9, 1, 0.9, 1] for clade in CLADES}
+        with tempfile.TemporaryDirectory() as tmp:
+            file = os.path.join(tmp, "tree.nwk")
+            with open(file, "w") as f:
+                f.write("((G_1,G_2),((V_1,GH_1),(S_1,S_2)),O_1);")
+            classifier = get_classifier(CLADES, ALT_NAMES)
+            parsed = phylo_updated.parse_tree(file, False, classifier)
+        unrooted = phylo_updated.prepare_tree(parsed, classifier, details)
+        tree, counts, classifier, clade_counts = phylo_updated.prepare_tree(parsed, classifier, details, "S_")
+        self.assertEqual(clade_counts, unrooted.clade_counts)
+        self.assertEqual(clade_counts["S_"], 2)
+        outgroup = tree.first_child[0]
+        self.assertEqual(sorted(tree.name(leaf) for leaf in range(outgroup, tree.end[outgroup]) if tree.is_leaf[leaf]), ["S_1", "S_2"])
+        self.assertEqual(counts.tolist(), compact_tree.node_clade_counts(tree, len(classifier.labels)).tolist())
+
+
+class TestOutputs(unittest.TestCase):
+    def test_parse_output(self):
+        self.assertEqual(phylo_updated.parse_output("tree.svg", 300, 5000), ("tree.svg", 300, 5000))
+        self.assertEqual(phylo_updated.parse_output("tree.png@72", 300, 5000), ("tree.png", 72, 5000))
+        self.assertEqual(phylo_updated.parse_output("thumb.png@72:800", 300, 5000), ("thumb.png", 72, 800))
+        self.assertEqual(phylo_updated.parse_output("C:\\out\\tree.png:800", 300, 5000), ("C:\\out\\tree.png", 300, 800))
+
+    def test_several_outputs(self):
+        args = phylo_updated._parse_args(["tree.nwk", "-o", "a.svg", "-o", "b.png@72:800", "--dpi", "150"])
+        self.assertEqual(args.outputs, [("a.svg", 150, 5000), ("b.png", 72, 800)])
+        self.assertEqual(phylo_updated._parse_args(["tree.nwk"]).outputs, [("./out.png", 300, 5000)])
+
+
+class TestNodeStyles(unittest.TestCase):
+    def test_styles_are_shared(self):
+        tree = Tree("((A____color__ff0000|:1,B:1):1,(C____color__ff0000|:1,D:1):1);")
+        phylo_updated.color_taxons(tree, "____color__", -1)
+        a, b, c, d = tree.get_leaves()
+        self.assertIs(a.img_style, c.img_style)
+        self.assertIs(b.img_style, tree.img_style)
+        self.assertEqual((a.img_style["hz_line_color"], a.img_style["hz_line_width"]), ("#ff0000", 0))
+
+        default = tree.img_style
+        tree.img_style = phylo_updated.node_bg_style(tree.img_style, "#00ff00")
+        self.assertEqual(tree.img_style["bgcolor"], "#00ff00")
+        self.assertNotEqual(default["bgcolor"], "#00ff00")
+        self.assertIs(tree.img_style, phylo_updated.node_style(bg_color="#00ff00"))
+
+
+if __name__ == "__main__":
+    unittest.main()
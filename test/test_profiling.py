@@ -0,0 +1,48 @@
+import json
+import os
+import pstats
+import tempfile
+import unittest
+
+import profiling
+from profiling import StageProfiler
+
+
+class TestStageProfiler(unittest.TestCase):
+    def test_stages_and_cprofile(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            out = os.path.join(tmp, "count.prof")
+            profiler = StageProfiler(cprofile_stage="count", cprofile_out=out)
+            with profiler.stage("parse"):
+                profiler.set_size(9, 5)
+            with profiler.stage("count"):
+                sum(range(10000))
+            with self.assertRaises(ValueError):
+                with profiler.stage("render"):
+                    raise ValueError()
+            profiler.write(os.path.join(tmp, "profile.json"), file="tree.nwk")
+
+            with open(os.path.join(tmp, "profile.json")) as f:
+                report = json.load(f)
+            self.assertTrue(pstats.Stats(out).total_calls > 0)
+        self.assertEqual(report["file"], "tree.nwk")
+        self.assertEqual([stage["stage"] for stage in report["stages"]], ["parse", "count", "render"])
+        self.assertEqual([stage["leaves"] for stage in report["stages"]], [5, 5, 5])
+        self.assertTrue(all(stage["wall_s"] >= 0 and stage["cpu_s"] >= 0 for stage in report["stages"]))
+
+    @unittest.skipUnless(profiling.reset_peak_rss(), "the peak memory can only be reset on Linux")
+    def test_peak_memory_of_each_stage(self):
+        profiler = StageProfiler()
+        with profiler.stage("big"):
+            block = bytearray(200 * 1024 ** 2)
+            block[:: 4096] = b"x" * len(block[:: 4096])
+            del block
+        with profiler.stage("small"):
+            pass
+        big, small = [stage["peak_rss_mb"] for stage in profiler.stages]
+        self.assertGreater(big - small, 150)
+        self.assertGreaterEqual(profiler.report()["peak_rss_mb"], big)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import io
+import os
+import tempfile
+import unittest
+from xml.etree import ElementTree
+
+import numpy as np
+
+import compact_tree
+from svg_render import ARC_SPAN, NodePaint, Wedge, circular_layout, render_svg
+
+
+class TestSvgRender(unittest.TestCase):
+    def setUp(self):
+        self.tree = compact_tree.read_newick(io.StringIO("((A:1,B:2)90:1,(C:1,D:1):2,E:3);"))
+
+    def test_circular_layout(self):
+        angle, radius = circular_layout(self.tree)
+        step = ARC_SPAN / 5
+        leaves = self.tree.leaves
+        np.testing.assert_allclose(angle[leaves], (np.arange(5) + 0.5) * step)
+        np.testing.assert_allclose(radius[leaves], [2, 3, 3, 3, 3])
+        np.testing.assert_allclose(radius[[0, 1, 4]], [0, 1, 2])
+        self.assertAlmostEqual(angle[1], step)
+        self.assertAlmostEqual(angle[0], (angle[1] + angle[leaves[-1]]) / 2)
+
+    def test_circular_layout_deep_tree(self):
+        newick = "L0:1"
+        for i in range(1, 200):
+            newick = f"({newick},L{i}:1):1"
+        tree = compact_tree.read_newick(io.StringIO(newick + ";"))
+        angle, radius = circular_layout(tree)
+        internal = np.flatnonzero(~tree.is_leaf)
+        last_child = np.array([max(np.flatnonzero(tree.parent == node)) for node in internal])
+        np.testing.assert_allclose(angle[internal], (angle[tree.first_child[internal]] + angle[last_child]) / 2)
+        self.assertEqual(radius.max(), 199)
+
+    def test_render_svg(self):
+        size = self.tree.size
+        paint = NodePaint(
+            color=np.array(["#343434"] * (size - 1) + ["#ff0000"], dtype=object),
+            width=np.array([2.0] * (size - 1) + [0.0]),
+            bgcolor=np.full(size, None, dtype=object),
+        )
+        paint.bgcolor[4] = "#00ff00"
+        with tempfile.TemporaryDirectory() as tmp:
+            out = os.path.join(tmp, "tree.svg")
+            render_svg(self.tree, out, paint, width=500, root_opening_factor=0.04)
+            paths = ElementTree.parse(out).getroot().findall("{http://www.w3.org/2000/svg}path")
+        self.assertEqual([path.get("fill") for path in paths], ["#00ff00", "none", "none"])
+        self.assertEqual([path.get("stroke") for path in paths[1:]], ["#343434", "#ff0000"])
+        # 6 branches and 3 arcs in grey, the branch of E in red
+        self.assertEqual(paths[1].get("d").count("M"), 9)
+        self.assertEqual(paths[2].get("d").count("M"), 1)
+
+    def test_render_collapsed(self):
+        size = self.tree.size
+        paint = NodePaint(
+            color=np.full(size, "#343434", dtype=object), width=np.full(size, 2.0), bgcolor=np.full(size, None, dtype=object)
+        )
+        collapsed = [Wedge(node=1, color="#ff0000", label="A 2/2"), Wedge(node=4, color="#00ff00", label="C 1/1"), Wedge(node=4, color="#00ff00", label="D 1/1")]
+        with tempfile.TemporaryDirectory() as tmp:
+            out = os.path.join(tmp, "tree.svg")
+            render_svg(self.tree, out, paint, width=500, collapsed=collapsed)
+            root = ElementTree.parse(out).getroot()
+        paths = root.findall("{http://www.w3.org/2000/svg}path")
+        texts = [text.text for text in root.findall("{http://www.w3.org/2000/svg}text")]
+        self.assertEqual(texts, ["A 2/2", "C 1/1, D 1/1"])
+        self.assertEqual([path.get("fill") for path in paths], ["#ff0000", "#00ff00", "none"])
+        # Only the branches of the two wedges and of E, plus the root arc
+        self.assertEqual(paths[2].get("d").count("M"), 4)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,53 @@
+import io
+import random
+import unittest
+
+import numpy as np
+from ete3 import Tree
+
+import compact_tree
+import phylo_updated
+import threshold_sweep
+from clade_classifier import CladeClassifier
+
+CLADES = ["G_", "GH_", "S_"]
+
+
+def random_tree(seed: int) -> compact_tree.CompactTree:
+    random.seed(seed)
+    tree = Tree()
+    tree.populate(80, names_library=[f"{random.choice(CLADES + ['O_'])}{i}" for i in range(80)])
+    classifier = CladeClassifier(CLADES, {})
+    return compact_tree.classify(compact_tree.read_newick(io.StringIO(tree.write(format=1))), classifier)
+
+
+class TestThresholdSweep(unittest.TestCase):
+    def test_parse_range(self):
+        self.assertEqual(threshold_sweep.parse_range("0.1:0.4:0.1"), [0.1, 0.2, 0.3, 0.4])
+        self.assertEqual(threshold_sweep.parse_range("0.5,1"), [0.5, 1.0])
+
+    def test_threshold_grid(self):
+        grid = threshold_sweep.threshold_grid(["#fff", 0.1, 1, 0.5, 1], {"min_density": [0.2, 0.6], "max_density": [0.5, 1]})
+        self.assertEqual(grid.tolist(), [[0.2, 0.5, 0.5, 1], [0.2, 1, 0.5, 1], [0.6, 1, 0.5, 1]])
+
+    def test_matches_single_queries(self):
+        labels = CladeClassifier(CLADES, {}).labels
+        for seed in range(5):
+            tree = random_tree(seed)
+            counts = compact_tree.node_clade_counts(tree, len(labels))
+            order = compact_tree.levelorder(tree)
+            totals = dict(zip(labels, counts[0].tolist()))
+            grid = threshold_sweep.threshold_grid(
+                ["#fff", 0, 1, 0, 1], {"min_density": [0, 0.3, 0.8], "min_coverage": [0, 0.2, 0.6], "max_coverage": [0.5, 1]}
+            )
+            for clade in CLADES:
+                result = threshold_sweep.sweep_clade(counts[order], ~tree.is_leaf[order], labels.index(clade), totals[clade], grid, batch=5)
+                for thresholds, (row, _, _) in zip(grid.tolist(), result.tolist()):
+                    expected, _, _ = phylo_updated.select_best_rows(
+                        counts[order], ~tree.is_leaf[order], np.array([labels.index(clade)]), np.array([thresholds]), np.array([totals[clade]])
+                    )
+                    self.assertEqual(int(row), int(expected[0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import tree_cache
+from clade_classifier import CladeClassifier
+
+NEWICK = "((G_1:1,Gn_2:2)90:1,(S_1:1,(S_2:1,L_1:1)80:2)70:1,G_3:1);"
+
+
+class TestTreeCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.dir.name, "cache")
+        self.file = os.path.join(self.dir.name, "tree.nwk")
+        with open(self.file, "w") as f:
+            f.write(NEWICK)
+
+    def tearDown(self):
+        self.dir.cleanup()
+
+    def test_warm_load_skips_parsing(self):
+        classifier = CladeClassifier(["G_", "S_"], {"Gn_": "G_"})
+        cold = tree_cache.load_newick(self.file, False, classifier, cache_dir=self.cache_dir)
+        with mock.patch("compact_tree.parse_newick") as parse, mock.patch("compact_tree.classify") as classify:
+            warm = tree_cache.load_newick(self.file, False, classifier, cache_dir=self.cache_dir)
+            parse.assert_not_called()
+            classify.assert_not_called()
+        for field in cold._fields:
+            if field == "names":
+                self.assertEqual(warm.names, cold.names)
+            else:
+                self.assertEqual(getattr(warm, field).tolist(), getattr(cold, field).tolist())
+
+    def test_other_classifier_reclassifies(self):
+        tree_cache.load_newick(self.file, False, CladeClassifier(["G_"], {}), cache_dir=self.cache_dir)
+        with mock.patch("compact_tree.parse_newick") as parse:
+            tree = tree_cache.load_newick(self.file, False, CladeClassifier(["S_"], {}), cache_dir=self.cache_dir)
+            parse.assert_not_called()
+        self.assertEqual(tree.clade[tree.leaves].tolist(), [1, 1, 0, 0, 1, 1])
+
+    def test_warm_load_is_mapped(self):
+        tree_cache.load_newick(self.file, False, cache_dir=self.cache_dir)
+        warm = tree_cache.load_newick(self.file, False, cache_dir=self.cache_dir)
+        self.assertIsInstance(warm.parent, np.memmap)
+        self.assertFalse(warm.parent.flags.writeable)
+
+    def test_corrupt_entry_is_parsed_again(self):
+        cold = tree_cache.load_newick(self.file, False, cache_dir=self.cache_dir)
+        path = tree_cache.cache_path(self.cache_dir, self.file, False)
+        for size in (os.path.getsize(path) // 2, 0):
+            with open(path, "r+b") as f:
+                f.truncate(size)
+            self.assertIsNone(tree_cache.load_tree(path))
+            self.assertFalse(os.path.exists(path))
+            tree = tree_cache.load_newick(self.file, False, cache_dir=self.cache_dir)
+            self.assertEqual(tree.parent.tolist(), cold.parent.tolist())
+            self.assertEqual(tree.names, cold.names)
+
+    def test_key_depends_on_contents_and_options(self):
+        first = tree_cache.cache_path(self.cache_dir, self.file, False)
+        self.assertNotEqual(first, tree_cache.cache_path(self.cache_dir, self.file, True))
+        with open(self.file, "a") as f:
+            f.write("\n")
+        self.assertNotEqual(first, tree_cache.cache_path(self.cache_dir, self.file, False))
+
+    def test_version_mismatch(self):
+        tree_cache.load_newick(self.file, False, cache_dir=self.cache_dir)
+        path = tree_cache.cache_path(self.cache_dir, self.file, False)
+        with mock.patch("tree_cache.CACHE_VERSION", tree_cache.CACHE_VERSION + 1):
+            self.assertIsNone(tree_cache.load_tree(path))
+
+    def test_evicts_least_recently_used(self):
+        paths = []
+        for i in range(3):
+            with open(self.file, "w") as f:
+                f.write(NEWICK.replace("G_3", f"G_{i + 3}"))
+            tree_cache.load_newick(self.file, False, cache_dir=self.cache_dir)
+            paths.append(tree_cache.cache_path(self.cache_dir, self.file, False))
+            os.utime(paths[-1], (i, i))
+        size = os.path.getsize(paths[0])
+        tree_cache.evict(self.cache_dir, max_bytes=2 * size)
+        self.assertEqual([os.path.exists(path) for path in paths], [False, True, True])
+
+
+if __name__ == "__main__":
+    unittest.main()
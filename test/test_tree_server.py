@@ -0,0 +1,93 @@
+import json
+import os
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+from unittest import mock
+
+import tree_server
+
+NEWICK = "((G_1____color__ff0000:1,G_2:2)90:1,(S_1:1,(S_2:1,S_3:1)80:2)70:1,G_3:1);"
+CLADES = {"G_": ["#ff0000", 0, 1, 0, 1], "S_": ["#00ff00", 0, 1, 0, 1]}
+
+
+class TestTreeServer(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.tree = os.path.join(self.tmp.name, "tree.nwk")
+        with open(self.tree, "w") as f:
+            f.write(NEWICK)
+        self.store = tree_server.TreeStore()
+        self.server = tree_server.make_server("127.0.0.1", 0, self.store)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.tmp.cleanup()
+
+    def post(self, path, body):
+        url = f"http://127.0.0.1:{self.server.server_address[1]}{path}"
+        request = urllib.request.Request(url, data=json.dumps(body).encode("utf-8"))
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.load(response)
+        except urllib.error.HTTPError as e:
+            return e.code, json.load(e)
+
+    def test_load_recolor_render(self):
+        status, loaded = self.post("/load", {"file": self.tree})
+        self.assertEqual((status, loaded["leaves"]), (200, 6))
+        status, colored = self.post("/recolor", {"tree": loaded["tree"], "clades": CLADES, "root_on": "S_"})
+        self.assertEqual(status, 200)
+        self.assertEqual(colored["clades"]["S_"]["coverage"], 1)
+
+        status, rerooted = self.post("/reroot", {"tree": loaded["tree"], "root_on": "G_"})
+        self.assertEqual((status, rerooted["root_on"]), (200, "G_"))
+
+        out = os.path.join(self.tmp.name, "tree.svg")
+        status, _ = self.post("/render", {"tree": loaded["tree"], "out": out, "color_marker": "____color__"})
+        self.assertEqual(status, 200)
+        with open(out) as f:
+            self.assertIn("#ff0000", f.read())
+
+    def test_errors(self):
+        self.assertEqual(self.post("/render", {"tree": "missing", "out": "x.svg"})[0], 404)
+        _, loaded = self.post("/load", {"file": self.tree})
+        self.assertEqual(self.post("/render", {"tree": loaded["tree"], "out": "x.svg"})[0], 400)
+        self.assertEqual(self.post("/recolor", {"tree": loaded["tree"], "clades": CLADES, "root_on": "L_"})[0], 400)
+
+    def test_failed_reroot_keeps_the_tree(self):
+        _, loaded = self.post("/load", {"file": self.tree})
+        self.assertEqual(self.post("/reroot", {"tree": loaded["tree"], "root_on": "S_"})[0], 400)
+        self.post("/recolor", {"tree": loaded["tree"], "clades": CLADES, "root_on": "S_"})
+        status, failed = self.post("/reroot", {"tree": loaded["tree"], "root_on": "XX_"})
+        self.assertEqual(status, 400)
+        self.assertIn("XX_", failed["error"])
+        status, colored = self.post("/recolor", {"tree": loaded["tree"], "clades": CLADES})
+        self.assertEqual((status, colored["root_on"]), (200, "S_"))
+        out = os.path.join(self.tmp.name, "tree.svg")
+        self.assertEqual(self.post("/render", {"tree": loaded["tree"], "out": out})[0], 200)
+
+    def test_reroot_reuses_the_clades(self):
+        tree_id, loaded = self.store.load(self.tree)
+        self.store.recolor(tree_id, CLADES, "S_")
+        with mock.patch("compact_tree.classify") as classify:
+            self.assertEqual(self.store.reroot(tree_id, "G_")["root_on"], "G_")
+            classify.assert_not_called()
+        self.assertEqual(loaded.nbytes(), tree_server.tree_bytes(loaded.tree) + loaded.views_bytes + loaded.classified.clade.nbytes)
+
+    def test_eviction(self):
+        other = os.path.join(self.tmp.name, "other.nwk")
+        with open(other, "w") as f:
+            f.write(NEWICK.replace("G_3", "G_4"))
+        first, _ = self.store.load(self.tree)
+        self.store.max_bytes = self.store.nbytes()
+        second, _ = self.store.load(other)
+        self.assertEqual(list(self.store.status()["trees"]), [second])
+
+
+if __name__ == "__main__":
+    unittest.main()
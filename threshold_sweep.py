@@ -0,0 +1,150 @@
+import argparse
+import itertools
+import time
+from typing import Dict, List, Optional, TextIO
+
+import numpy as np
+
+import compact_tree
+from clade_classifier import get_classifier
+from phylo_updated import ALT_NAME, MAX_COV, MAX_DENSITY, MIN_COV, MIN_DENSITY, load_clade_details, parse_tree, prepare_tree, select_best_rows
+
+PARAMETERS = ["min_density", "max_density", "min_coverage", "max_coverage"]
+# Number of threshold combinations evaluated together, bounding the size of the intermediate arrays
+BATCH = 64
+COLUMNS = PARAMETERS + ["node", "leaves", "clade_leaves", "density", "coverage"]
+
+
+def parse_range(spec: str) -> List[float]:
+    """
+    Parses either "start:stop:step", stop included, or a comma separated list of values
+    """
+    if ":" in spec:
+        start, stop, step = (float(part) for part in spec.split(":"))
+        count = int(np.floor((stop - start) / step + 1e-9)) + 1
+        return [round(start + i * step, 10) for i in range(count)]
+    return [float(value) for value in spec.split(",")]
+
+
+def threshold_grid(details: List, ranges: Dict[str, Optional[List[float]]]) -> np.ndarray:
+    """
+    Builds every [min_density, max_density, min_coverage, max_coverage] combination of [ranges] where minimums do not exceed maximums.
+
+    Args:
+
+        - details (List): The [color, min_density, max_density, min_coverage, max_coverage] of the clade, used for parameters without a range
+        - ranges (Dict[str, Optional[List[float]]]): The values to try for each of `PARAMETERS`, None to keep the value of [details]
+
+    Returns:
+
+        - np.ndarray: combinations x 4 array of thresholds
+    """
+    keys = dict(zip(PARAMETERS, (MIN_DENSITY, MAX_DENSITY, MIN_COV, MAX_COV)))
+    values = [ranges.get(name) or [details[keys[name]]] for name in PARAMETERS]
+    grid = np.array(list(itertools.product(*values)), dtype=float).reshape(-1, 4)
+    return grid[(grid[:, 0] <= grid[:, 1]) & (grid[:, 2] <= grid[:, 3])]
+
+
+def sweep_clade(matrix: np.ndarray, candidates: np.ndarray, column: int, clade_total: int, grid: np.ndarray, batch: int = BATCH) -> np.ndarray:
+    """
+    Finds the best row of [matrix] for one clade under every thresholds combination of [grid], as `select_best_rows` would.
+
+    Only rows holding the clade can score above 0, and among the others only the last can win, so the search is limited
+    to the ancestors of the clade's leaves.
+
+    Args:
+
+        - matrix (np.ndarray): nodes x labels clade count matrix
+        - candidates (np.ndarray): Boolean mask of the rows that may be picked
+        - column (int): Column of [matrix] holding the clade, -1 if it never occurs
+        - clade_total (int): The number of leaves of the clade
+        - grid (np.ndarray): combinations x 4 array of thresholds, see `threshold_grid`
+        - batch (int): Number of combinations evaluated at once
+
+    Returns:
+
+        - np.ndarray: combinations x 3 array of the best row (-1 if none), its density and coverage
+    """
+    result = np.full((len(grid), 3), np.nan)
+    result[:, 0] = -1
+    if column < 0:
+        return result
+    holds = matrix[:, column] > 0
+    others = np.flatnonzero(candidates & ~holds)
+    kept = candidates & holds
+    if len(others):
+        kept[others[-1]] = True
+    for start in range(0, len(grid), batch):
+        thresholds = grid[start : start + batch]
+        columns = np.full(len(thresholds), column)
+        best, density, coverage = select_best_rows(matrix, kept, columns, thresholds, np.full(len(thresholds), clade_total))
+        result[start : start + len(thresholds)] = np.column_stack([best, density, coverage])
+    return result
+
+
+def write_sweep(f: TextIO, clade: str, grid: np.ndarray, result: np.ndarray, matrix: np.ndarray, column: int, nodes: np.ndarray):
+    """
+    Writes one line per thresholds combination, with the best node found in the original node order of the tree
+    """
+    for thresholds, (row, density, coverage) in zip(grid.tolist(), result.tolist()):
+        if row < 0:
+            found = ["NA"] * 5
+        else:
+            counts = matrix[int(row)]
+            found = [str(int(nodes[int(row)])), str(int(counts.sum())), str(int(counts[column])), f"{density:.4f}", f"{coverage:.4f}"]
+        f.write("\t".join([clade] + [f"{value:g}" for value in thresholds] + found) + "\n")
+
+
+def _parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Finds the node every clade would be colored on for a grid of density and coverage thresholds, without rendering",
+        epilog="If you notice any issues, please open one over at https://github.com/ElasticBottle/GISAID-Analysis-Update ",
+    )
+    parser.add_argument("file", type=str, help="file path of the NEWICK tree to parse")
+    parser.add_argument(
+        "-ccov",
+        "--clade-color-density-coverage",
+        type=str,
+        dest="clade_color_density_coverage",
+        help="path to the clade json file. Thresholds without a range below keep its values",
+    )
+    parser.add_argument("-ro", "--root-on", dest="root_on", type=str, help="Clade to root the tree on first, with its thresholds from the json file")
+    parser.add_argument("-q", "--quoted", action="store_true", dest="is_quoted", help="Use this flag if newwick file contains quotes around the names")
+    parser.add_argument("--cache-dir", dest="cache_dir", type=str, help="Directory to cache the parsed tree in, as for phylo_updated.py")
+    for name in PARAMETERS:
+        parser.add_argument(
+            f"--{name.replace('_', '-')}",
+            dest=name,
+            type=parse_range,
+            help=f"Values of {name} to try, as start:stop:step or a comma separated list",
+        )
+    parser.add_argument("--clades", dest="clades", nargs="+", help="Clades to sweep. Default all clades of the json file")
+    parser.add_argument("-o", "--out", dest="out", type=str, default="./sweep.tsv", help="Path of the table to write. Default ./sweep.tsv")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    start = time.time()
+    clade_details = load_clade_details(args.clade_color_density_coverage)
+    alt_names = {clade: desired_name[ALT_NAME] for clade, desired_name in clade_details.items() if len(desired_name) == 1}
+    clade_list_details = {clade: col_dens_cov for clade, col_dens_cov in clade_details.items() if len(col_dens_cov) > 1}
+
+    classifier = get_classifier(list(clade_list_details), alt_names)
+    tree = parse_tree(args.file, args.is_quoted, classifier, args.cache_dir)
+    tree, counts, classifier, clade_counts = prepare_tree(tree, classifier, clade_list_details, args.root_on)
+
+    # Same node order as get_compact_max_ancestors, so ties resolve the same way
+    order = compact_tree.levelorder(tree)
+    matrix, candidates = counts[order], ~tree.is_leaf[order]
+    ranges = {name: getattr(args, name) for name in PARAMETERS}
+    with open(args.out, "w") as f:
+        f.write("\t".join(["clade"] + COLUMNS) + "\n")
+        for clade in args.clades or list(clade_list_details):
+            grid = threshold_grid(clade_list_details[clade], ranges)
+            column = classifier.labels.index(clade) if clade in clade_counts else -1
+            result = sweep_clade(matrix, candidates, column, clade_counts.get(clade, 0), grid)
+            write_sweep(f, clade, grid, result, matrix, column, order)
+            print(f"{clade}: {int((result[:, 0] >= 0).sum())}/{len(grid)} threshold combinations find a node")
+    print(f"Time taken: {time.time() - start:.2f}s")
@@ -0,0 +1,203 @@
+import hashlib
+import os
+import struct
+import tempfile
+import zipfile
+from typing import Dict, Optional
+
+import numpy as np
+
+import compact_tree
+from clade_classifier import CladeClassifier
+from compact_tree import CompactTree
+from extractor import open_input
+
+# Bump whenever the parser or the layout of the cached arrays changes
+CACHE_VERSION = 1
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "gisaid-analysis-update")
+DEFAULT_CACHE_SIZE = 2 * 1024 ** 3
+HASH_BLOCK = 1 << 20
+# Size of the fixed part of a zip local file header, followed by the member name and an extra field
+ZIP_LOCAL_HEADER = 30
+
+_ARRAYS = ["parent", "first_child", "next_sibling", "end", "depth", "dist", "support", "name_start", "name_end"]
+
+
+def file_digest(file: str) -> str:
+    """
+    Returns the blake2b digest of the contents of [file]
+    """
+    digest = hashlib.blake2b(digest_size=20)
+    with open_input(file, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def cache_path(cache_dir: str, file: str, is_quoted: bool) -> str:
+    """
+    Returns the path of the cache entry of [file] parsed with [is_quoted]
+    """
+    return os.path.join(cache_dir, f"{file_digest(file)}-{'q' if is_quoted else 'u'}-v{CACHE_VERSION}.npz")
+
+
+def save_tree(path: str, tree: CompactTree, clade_key: str = ""):
+    """
+    Writes [tree] to [path] as an uncompressed .npz, replacing any existing entry atomically
+
+    Args:
+
+        - path (str): The path of the cache entry
+        - tree (CompactTree): The parsed tree
+        - clade_key (str): `CladeClassifier.key` of the classifier the clade ids of [tree] come from, if any
+    """
+    arrays = {name: getattr(tree, name) for name in _ARRAYS}
+    arrays["names"] = np.frombuffer(tree.names.encode("utf-8"), dtype=np.uint8)
+    arrays["version"] = np.array(CACHE_VERSION)
+    if tree.clade is not None and clade_key:
+        arrays["clade"] = tree.clade
+        arrays["clade_key"] = np.array(clade_key)
+
+    handle, temp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(temp, path)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
+def map_arrays(path: str) -> Dict[str, np.ndarray]:
+    """
+    Maps every array of the uncompressed .npz at [path] into memory read only, so that only the pages in use are read.
+    Empty and 0-d arrays are read as they are.
+    """
+    arrays = {}
+    with zipfile.ZipFile(path) as archive, open(path, "rb") as f:
+        for info in archive.infolist():
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError(f"{info.filename} is compressed in {path}")
+            # The local header may have another extra field than the central directory, e.g. with zip64
+            f.seek(info.header_offset)
+            header = f.read(ZIP_LOCAL_HEADER)
+            if header[:4] != b"PK\x03\x04":
+                raise ValueError(f"Bad local header for {info.filename} in {path}")
+            name_length, extra_length = struct.unpack("<HH", header[26:30])
+            f.seek(info.header_offset + ZIP_LOCAL_HEADER + name_length + extra_length)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            name = info.filename[: -len(".npy")]
+            if dtype.hasobject:
+                raise ValueError(f"{info.filename} holds Python objects in {path}")
+            if not shape or 0 in shape:
+                arrays[name] = np.lib.format.read_array(archive.open(info))
+            else:
+                arrays[name] = np.memmap(path, dtype=dtype, mode="r", offset=f.tell(), shape=shape, order="F" if fortran else "C")
+    return arrays
+
+
+def load_tree(path: str, clade_key: str = "") -> Optional[CompactTree]:
+    """
+    Maps the tree stored at [path] into memory, see `map_arrays`. Only the names are read and decoded.
+    A truncated or corrupt entry is removed.
+
+    Args:
+
+        - path (str): The path of the cache entry
+        - clade_key (str): `CladeClassifier.key` of the classifier in use. Stored clade ids are only kept if it matches
+
+    Returns:
+
+        - Optional[CompactTree]: The tree, or None if the entry was written by another version or could not be read
+    """
+    try:
+        data = map_arrays(path)
+        if "version" not in data or int(data["version"]) != CACHE_VERSION:
+            return None
+        arrays = {name: data[name] for name in _ARRAYS}
+        names = str(data["names"], "utf-8")
+        clade = None
+        if clade_key and "clade_key" in data and str(data["clade_key"]) == clade_key:
+            clade = data["clade"]
+    except (OSError, ValueError, KeyError, EOFError, struct.error, zipfile.BadZipFile):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        return None
+    return CompactTree(names=names, clade=clade, **arrays)
+
+
+def evict(cache_dir: str, max_bytes: int, keep: str = None):
+    """
+    Removes the least recently used entries of [cache_dir] until it holds at most [max_bytes]
+
+    Args:
+
+        - cache_dir (str): The cache directory
+        - max_bytes (int): The size limit of the cache
+        - keep (str): Path of an entry that must not be removed
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith(".npz"):
+            path = os.path.join(cache_dir, name)
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path == keep:
+            continue
+        try:
+            os.remove(path)
+        except PermissionError:
+            # Windows keeps entries still mapped by a loaded tree
+            continue
+        total -= size
+
+
+def load_newick(file: str, is_quoted: bool, classifier: CladeClassifier = None, cache_dir: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_CACHE_SIZE) -> CompactTree:
+    """
+    Parses the newick file at [file], going through the on-disk cache in [cache_dir].
+
+    Entries are keyed by the hash of the file contents and the parser options, so an edited file is parsed again.
+    Reading an entry marks it as recently used, and the oldest entries are evicted once the cache exceeds [max_bytes].
+
+    Args:
+
+        - file (str): The path to the newick tree
+        - is_quoted (bool): Whether names are surrounded by quotes
+        - classifier (CladeClassifier): If given, the returned tree is classified with it, reusing cached clade ids when possible
+        - cache_dir (str): The cache directory, created if needed
+        - max_bytes (int): The size limit of the cache
+
+    Returns:
+
+        - CompactTree: The parsed tree
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    path = cache_path(cache_dir, file, is_quoted)
+    clade_key = classifier.key if classifier is not None else ""
+
+    tree = load_tree(path, clade_key) if os.path.exists(path) else None
+    if tree is not None and (classifier is None or tree.clade is not None):
+        os.utime(path)
+        return tree
+
+    if tree is None:
+        tree = compact_tree.parse_newick(file, is_quoted)
+    if classifier is not None:
+        tree = compact_tree.classify(tree, classifier)
+    try:
+        save_tree(path, tree, clade_key)
+    except PermissionError:
+        # Windows cannot replace an entry still mapped by a loaded tree, it is written again on a later run
+        return tree
+    evict(cache_dir, max_bytes, keep=path)
+    return tree
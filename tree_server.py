@@ -0,0 +1,338 @@
+import argparse
+import json
+import os
+import socketserver
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from typing import Dict, List, NamedTuple, Tuple
+
+import numpy as np
+
+import compact_tree
+import tree_cache
+from clade_classifier import CladeClassifier, get_classifier
+from compact_tree import CompactTree
+from phylo_updated import ALT_NAME, CLADE_COL, Output, clade_picks, collapsed_clades, draw, get_compact_max_ancestors, prepare_tree
+
+DEFAULT_MAX_MEMORY = 4 * 1024 ** 3
+# Colorings kept per tree, so switching back and forth between configurations stays instant
+MAX_VIEWS = 4
+
+
+class View(NamedTuple):
+    """
+    A tree classified, rooted and colored for one clade configuration
+
+    Attributes:
+
+        - tree (CompactTree): The rooted tree
+        - counts (np.ndarray): The clade counts of every node of [tree]
+        - labels (List[str]): The clade of each column of [counts]
+        - clade_details (Dict[str, List]): The [color, density, coverage] list of each clade
+        - clade_counts (Dict[str, int]): The total of each clade
+        - max_ancestors (Dict[str, int]): The node colored for each clade
+    """
+    tree: CompactTree
+    counts: np.ndarray
+    labels: List[str]
+    clade_details: Dict[str, List]
+    clade_counts: Dict[str, int]
+    max_ancestors: Dict[str, int]
+
+
+class UnknownTree(KeyError):
+    pass
+
+
+def tree_bytes(tree: CompactTree) -> int:
+    arrays = [getattr(tree, field) for field in tree._fields if isinstance(getattr(tree, field), np.ndarray)]
+    return sum(array.nbytes for array in arrays) + len(tree.names)
+
+
+def view_bytes(view: View) -> int:
+    return tree_bytes(view.tree) + view.counts.nbytes
+
+
+class LoadedTree:
+    """
+    A parsed tree kept in memory along with the clade ids of its leaves, its last colorings and the clade configuration
+    and root in use
+    """
+
+    def __init__(self, file: str, tree: CompactTree):
+        self.file = file
+        self.tree = tree
+        self.clade_details = None
+        self.root_on = None
+        self.views = OrderedDict()  # type: OrderedDict
+        # Size of the cached views, kept up to date under [lock] so that the store can read it while a view is computed
+        self.views_bytes = 0
+        # The tree classified by the classifier of key [clade_key], reused by every view of the same clades
+        self.classified = None  # type: CompactTree
+        self.clade_key = None
+        self.lock = threading.Lock()
+
+    def nbytes(self) -> int:
+        classified = self.classified
+        return tree_bytes(self.tree) + self.views_bytes + (classified.clade.nbytes if classified is not None else 0)
+
+    def classify(self, classifier: CladeClassifier) -> CompactTree:
+        """
+        Returns the tree with its leaves classified by [classifier], only classifying them again when the clades change.
+        Expects self.lock to be held
+        """
+        if self.clade_key != classifier.key:
+            self.classified = compact_tree.classify(self.tree, classifier)
+            self.clade_key = classifier.key
+        return self.classified
+
+    def view(self) -> View:
+        """
+        Returns the coloring for the current clade configuration and root, computing it if it is not cached. Expects self.lock to be held
+        """
+        return self._view(self.clade_details, self.root_on)
+
+    def select(self, clade_details: Dict[str, List], root_on: str = None) -> View:
+        """
+        Returns the coloring for [clade_details] rooted on [root_on], which become the current configuration and root only
+        once it is computed, so that a failing request leaves the tree as it was. Expects self.lock to be held
+        """
+        view = self._view(clade_details, root_on)
+        self.clade_details, self.root_on = clade_details, root_on
+        return view
+
+    def _view(self, clade_details: Dict[str, List], root_on: str = None) -> View:
+        if clade_details is None:
+            raise ValueError("No clade configuration yet, call /recolor first")
+        key = (json.dumps(clade_details, sort_keys=True), root_on)
+        if key in self.views:
+            self.views.move_to_end(key)
+            return self.views[key]
+        view = make_view(self, clade_details, root_on)
+        self.views[key] = view
+        self.views_bytes += view_bytes(view)
+        while len(self.views) > MAX_VIEWS:
+            self.views_bytes -= view_bytes(self.views.popitem(last=False)[1])
+        return view
+
+
+def make_view(loaded: LoadedTree, clade_details: Dict[str, List], root_on: str = None) -> View:
+    """
+    Counts and roots the tree of [loaded] with `phylo_updated.prepare_tree` and picks the node of each clade, as
+    `phylo_updated.run` does. Expects loaded.lock to be held
+    """
+    alt_names = {clade: desired_name[ALT_NAME] for clade, desired_name in clade_details.items() if len(desired_name) == 1}
+    clade_list_details = {clade: col_dens_cov for clade, col_dens_cov in clade_details.items() if len(col_dens_cov) > 1}
+    classifier = get_classifier(list(clade_list_details), alt_names)
+    tree, counts, classifier, clade_counts = prepare_tree(loaded.classify(classifier), classifier, clade_list_details, root_on)
+    max_ancestors = get_compact_max_ancestors(tree, counts, classifier.labels, clade_list_details, clade_counts)
+    return View(tree, counts, classifier.labels, clade_list_details, clade_counts, max_ancestors)
+
+
+def describe(view: View) -> Dict[str, Dict]:
+    picks = clade_picks(view.max_ancestors, view.counts, view.labels, view.clade_counts)
+    for clade, pick in picks.items():
+        pick["color"] = view.clade_details[clade][CLADE_COL]
+    return picks
+
+
+class TreeStore:
+    """
+    Trees loaded by the server, least recently used first, evicted once they hold more than [max_bytes]
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_MEMORY, cache_dir: str = None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.trees = OrderedDict()  # type: OrderedDict
+        self.lock = threading.Lock()
+        # Qt draws from a single thread at a time
+        self.render_lock = threading.Lock()
+
+    def load(self, file: str, is_quoted: bool = False) -> Tuple[str, LoadedTree]:
+        tree_id = f"{tree_cache.file_digest(file)[:16]}-{'q' if is_quoted else 'u'}"
+        with self.lock:
+            if tree_id in self.trees:
+                self.trees.move_to_end(tree_id)
+                return tree_id, self.trees[tree_id]
+        if self.cache_dir:
+            tree = tree_cache.load_newick(file, is_quoted, cache_dir=self.cache_dir)
+        else:
+            tree = compact_tree.parse_newick(file, is_quoted)
+        with self.lock:
+            loaded = self.trees.setdefault(tree_id, LoadedTree(file, tree))
+            self.trees.move_to_end(tree_id)
+            self.evict(keep=tree_id)
+        return tree_id, loaded
+
+    def get(self, tree_id: str) -> LoadedTree:
+        with self.lock:
+            if tree_id not in self.trees:
+                raise UnknownTree(f"Tree {tree_id} is not loaded")
+            self.trees.move_to_end(tree_id)
+            return self.trees[tree_id]
+
+    def nbytes(self) -> int:
+        return sum(loaded.nbytes() for loaded in self.trees.values())
+
+    def evict(self, keep: str = None):
+        """
+        Drops the least recently used trees until the store fits in its memory cap. Expects self.lock to be held
+        """
+        total = self.nbytes()
+        for tree_id in list(self.trees):
+            if total <= self.max_bytes:
+                break
+            if tree_id == keep:
+                continue
+            total -= self.trees.pop(tree_id).nbytes()
+
+    def status(self) -> Dict:
+        with self.lock:
+            trees = {tree_id: {"file": loaded.file, "leaves": len(loaded.tree.leaves), "bytes": loaded.nbytes()} for tree_id, loaded in self.trees.items()}
+            return {"trees": trees, "bytes": self.nbytes(), "max_bytes": self.max_bytes}
+
+    def recolor(self, tree_id: str, clade_details: Dict[str, List], root_on: str = None) -> Dict:
+        loaded = self.get(tree_id)
+        with loaded.lock:
+            view = loaded.select(clade_details, loaded.root_on if root_on is None else root_on)
+        self._after_view()
+        return {"tree": tree_id, "root_on": loaded.root_on, "clades": describe(view)}
+
+    def reroot(self, tree_id: str, root_on: str) -> Dict:
+        loaded = self.get(tree_id)
+        with loaded.lock:
+            view = loaded.select(loaded.clade_details, root_on)
+        self._after_view()
+        return {"tree": tree_id, "root_on": root_on, "clades": describe(view)}
+
+    def render(self, tree_id: str, outputs: List[Output], renderer: str = "svg", color_marker: str = "", offset: int = -1, collapse: bool = False) -> Dict:
+        loaded = self.get(tree_id)
+        with loaded.lock:
+            view = loaded.view()
+        collapsed = collapsed_clades(view.max_ancestors, view.counts, view.labels, view.clade_details, view.clade_counts) if collapse else None
+        with self.render_lock:
+            draw(view.tree, view.max_ancestors, view.clade_details, outputs, renderer, color_marker, offset, collapsed)
+        return {"tree": tree_id, "outputs": [output.path for output in outputs]}
+
+    def _after_view(self):
+        # New views take memory too
+        with self.lock:
+            self.evict()
+
+
+class TreeRequestHandler(BaseHTTPRequestHandler):
+    """
+    JSON API of the server. Every POST takes a json object and returns one, with the time taken under "seconds":
+
+        - POST /load {"file", "quoted"}: parses a NEWICK file, returns its "tree" id
+        - POST /recolor {"tree", "clades" or "clades_file", "root_on"}: sets the clade configuration, returns the node of each clade
+        - POST /reroot {"tree", "root_on"}: roots the tree on another clade, returns the node of each clade
+        - POST /render {"tree", "out", "renderer", "width", "dpi", "color_marker", "offset", "collapse"}: draws the tree
+        - GET /status: the loaded trees and their memory use
+    """
+
+    store = None  # type: TreeStore
+
+    def do_GET(self):
+        if self.path == "/status":
+            self._reply(200, self.store.status())
+        else:
+            self._reply(404, {"error": f"Unknown path {self.path}"})
+
+    def do_POST(self):
+        routes = {"/load": self._load, "/recolor": self._recolor, "/reroot": self._reroot, "/render": self._render}
+        if self.path not in routes:
+            self._reply(404, {"error": f"Unknown path {self.path}"})
+            return
+        start = time.perf_counter()
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            result = routes[self.path](body)
+        except UnknownTree as e:
+            self._reply(404, {"error": e.args[0]})
+            return
+        except KeyError as e:
+            self._reply(400, {"error": f"Missing {e}"})
+            return
+        except Exception as e:
+            self._reply(400, {"error": str(e)})
+            return
+        result["seconds"] = time.perf_counter() - start
+        self._reply(200, result)
+
+    def _load(self, body: Dict) -> Dict:
+        tree_id, loaded = self.store.load(body["file"], bool(body.get("quoted", False)))
+        return {"tree": tree_id, "leaves": len(loaded.tree.leaves), "nodes": loaded.tree.size}
+
+    def _recolor(self, body: Dict) -> Dict:
+        clade_details = body.get("clades")
+        if clade_details is None:
+            with open(body["clades_file"]) as f:
+                clade_details = json.load(f)
+        return self.store.recolor(body["tree"], clade_details, body.get("root_on"))
+
+    def _reroot(self, body: Dict) -> Dict:
+        return self.store.reroot(body["tree"], body["root_on"])
+
+    def _render(self, body: Dict) -> Dict:
+        outs = body["out"] if isinstance(body["out"], list) else [body["out"]]
+        outputs = [Output(out, int(body.get("dpi", 300)), int(body.get("width", 5000))) for out in outs]
+        renderer = body.get("renderer", "svg")
+        if renderer == "svg" and any(not output.path.lower().endswith(".svg") for output in outputs):
+            raise ValueError("The svg renderer only writes .svg outputs")
+        return self.store.render(
+            body["tree"], outputs, renderer, body.get("color_marker", ""), int(body.get("offset", -1)), bool(body.get("collapse", False))
+        )
+
+    def _reply(self, status: int, body: Dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class TreeServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_server(host: str, port: int, store: TreeStore) -> TreeServer:
+    handler = type("Handler", (TreeRequestHandler,), {"store": store})
+    return TreeServer((host, port), handler)
+
+
+def _parse_args():
+    """Parse command-line arguments."""
+    parser = argparse.ArgumentParser(
+        description="Keeps parsed trees in memory and serves recolor, reroot and render requests over HTTP",
+        epilog="If you notice any issues, please open one over at https://github.com/ElasticBottle/GISAID-Analysis-Update ",
+    )
+    parser.add_argument("--host", dest="host", type=str, default="127.0.0.1", help="Address to listen on. Default 127.0.0.1")
+    parser.add_argument("--port", dest="port", type=int, default=8765, help="Port to listen on. Default 8765")
+    parser.add_argument(
+        "--max-memory",
+        dest="max_memory",
+        type=int,
+        default=DEFAULT_MAX_MEMORY // 1024 ** 2,
+        help=f"Memory cap of the loaded trees in MB, least recently used trees are dropped first. Default {DEFAULT_MAX_MEMORY // 1024 ** 2}",
+    )
+    parser.add_argument("--cache-dir", dest="cache_dir", type=str, help="Directory to cache parsed trees on disk in, as for phylo_updated.py")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = _parse_args()
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    server = make_server(args.host, args.port, TreeStore(args.max_memory * 1024 ** 2, args.cache_dir))
+    print(f"Serving on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()